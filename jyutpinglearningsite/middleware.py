@@ -0,0 +1,114 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+# Per-request stats are kept for the most recent requests of each view, so that the percentiles follow recent traffic.
+REQUEST_STATS_WINDOW = 1000
+REQUEST_STATS_METRICS = ("wall_ms", "query_count", "sql_ms", "template_ms", "response_bytes")
+REQUEST_STATS_PERCENTILES = (50, 90, 99)
+
+_request_stats = {}
+_request_stats_lock = threading.Lock()
+_template_seconds = ContextVar("template_seconds", default=None)
+
+
+def percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) * percent // 100, len(sorted_values) - 1)]
+
+
+def get_request_stats():
+    # Returns {view_name: {"count": n, metric: {percentile: value}}} for every view seen in the current window.
+    with _request_stats_lock:
+        records_by_view = {view_name: list(records) for view_name, records in _request_stats.items()}
+    stats = {}
+    for view_name, records in sorted(records_by_view.items()):
+        stats[view_name] = {"count": len(records)}
+        for metric in REQUEST_STATS_METRICS:
+            values = sorted(record[metric] for record in records if record[metric] is not None)
+            stats[view_name][metric] = {percent: percentile(values, percent) for percent in REQUEST_STATS_PERCENTILES} if values else None
+    return stats
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def timed_template_render(render):
+    @functools.wraps(render)
+    def render_and_time(self, *args, **kwargs):
+        # Only the outermost template of a render is timed, as included templates are rendered inside it.
+        if (seconds := _template_seconds.get()) is None or seconds[1]:
+            return render(self, *args, **kwargs)
+        seconds[1] = True
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            seconds[0] += time.perf_counter() - start
+            seconds[1] = False
+    render_and_time.timed = True
+    return render_and_time
+
+
+class RequestStatsMiddleware:
+    # Records the wall time, SQL queries, template render time and response size of every request. Turned on by the
+    # REQUEST_STATS setting; when it is off Django drops the middleware entirely, so it costs nothing.
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_STATS", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.log_path = getattr(settings, "REQUEST_STATS_LOG", None)
+        self.log_lock = threading.Lock()
+        if not getattr(Template.render, "timed", False):
+            Template.render = timed_template_render(Template.render)
+
+    def __call__(self, request):
+        query_timer = QueryTimer()
+        template_seconds = [0, False]
+        token = _template_seconds.set(template_seconds)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(query_timer))
+                response = self.get_response(request)
+        finally:
+            _template_seconds.reset(token)
+        wall_seconds = time.perf_counter() - start
+        resolver_match = getattr(request, "resolver_match", None)
+        record = {
+            "view_name": resolver_match.view_name if resolver_match else "<unresolved>",
+            "method": request.method,
+            "status_code": response.status_code,
+            "wall_ms": round(wall_seconds * 1000, 3),
+            "query_count": query_timer.count,
+            "sql_ms": round(query_timer.seconds * 1000, 3),
+            "template_ms": round(template_seconds[0] * 1000, 3),
+            "response_bytes": None if response.streaming else len(response.content),
+        }
+        with _request_stats_lock:
+            _request_stats.setdefault(record["view_name"], deque(maxlen=REQUEST_STATS_WINDOW)).append(record)
+        if self.log_path:
+            # The log is opened for each line rather than kept open, so that it can be rotated or removed at any time.
+            with self.log_lock, open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps({"time": time.time(), "path": request.path, **record}) + "\n")
+        return response
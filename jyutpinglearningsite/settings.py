@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'jyutpinglearningsite.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -109,6 +110,46 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'mediafiles')
+# Set to an internal location of the front proxy (such as '/protected-media/' for nginx) to have it send media files
+# with X-Accel-Redirect rather than Django.
+MEDIA_ACCEL_REDIRECT = os.environ.get("MEDIA_ACCEL_REDIRECT") or None
+
+# Uploads waiting for a background import job to run. IMPORT_JOBS_IN_REQUEST runs import jobs straight away instead.
+IMPORT_JOBS_ROOT = os.path.join(BASE_DIR, 'import_jobs')
+IMPORT_JOBS_IN_REQUEST = False
+
+# The last export of topics and of words, kept until the vocabulary changes.
+EXPORTS_ROOT = os.path.join(BASE_DIR, 'exports')
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# File based so that the vocabulary version is shared between worker processes. The version has a cache of its own,
+# as culling the default cache once it is full removes entries at random.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'vocabulary': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'vocabulary'),
+        'TIMEOUT': None,
+    },
+}
+
+# Number of ready-made quizzes kept in the cache for each quiz length and audio setting (0 turns the pool off).
+# Run `python manage.py fill_quiz_pool` after deploying to fill it up front.
+QUIZ_POOL_SIZE = int(os.environ.get("QUIZ_POOL_SIZE", "3"))
+
+# Per-request timings and query counts, shown on the request stats page. Off unless REQUEST_STATS is "True".
+# REQUEST_STATS_LOG is an optional path of a JSONL file to also write one line per request to.
+REQUEST_STATS = os.environ.get("REQUEST_STATS", "False") == "True"
+REQUEST_STATS_LOG = os.environ.get("REQUEST_STATS_LOG")
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
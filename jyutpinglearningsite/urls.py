@@ -1,8 +1,6 @@
-from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth.decorators import login_required
-from django.views.static import serve
 from django.urls import include, path, re_path
 
 from . import views
@@ -14,5 +12,5 @@ urlpatterns = [
     path('login/', logged_out_required(views.LoginView.as_view()), name='login'),
     path('logout/', login_required(views.LogoutView.as_view(), login_url="/login/"), name='logout'),
     path('admin/', admin.site.urls),
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    re_path(r'^media/(?P<path>.*)$', views.MediaView.as_view(), name='media'),
 ]
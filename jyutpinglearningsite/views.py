@@ -1,8 +1,22 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.views import generic
 
+from wordsandsentences.audio_bundles import get_word_ids_by_audio_url
+from wordsandsentences.models import get_audio_url
+from wordsandsentences.snapshot import get_vocabulary_snapshot
 from .forms import LoginForm
 
 
@@ -23,3 +37,94 @@ class LogoutView(generic.View):
     def post(self, request, *args, **kwargs):
         logout(request)
         return redirect('login')
+
+
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRange:
+    # Reads at most length bytes of a file from where it was left, for FileResponse to stream part of a file.
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_byte_range(range_header, size):
+    # The (start, end) of a single "bytes=" range, end inclusive; None when there is no usable range, so that the whole
+    # file is sent, and False when the range is outside the file. Lists of ranges are answered with the whole file.
+    if not (match := RANGE_RE.match(range_header or "")) or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    return (start, end) if start <= end and start < size else False
+
+
+class MediaView(generic.View):
+    # Serves uploaded files with ETags, byte ranges (which audio players use to seek) and, for URLs with the current hash
+    # of a word's audio in them (see get_audio_url), caching for a year. With MEDIA_ACCEL_REDIRECT set, only the headers are worked out
+    # here, and the front proxy is told to send the file from that internal location itself.
+    def get(self, request, *args, **kwargs):
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, posixpath.normpath(kwargs["path"]).lstrip("/"))
+        except SuspiciousFileOperation:
+            raise Http404
+        try:
+            stat = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404
+        if not os.path.isfile(full_path):
+            raise Http404
+        name = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, "/")
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if (response := get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))) is None:
+            content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+            if settings.MEDIA_ACCEL_REDIRECT:
+                response = HttpResponse(content_type=content_type, headers={"X-Accel-Redirect": settings.MEDIA_ACCEL_REDIRECT + name})
+            else:
+                response = self.get_file_response(request, full_path, stat.st_size, etag, content_type)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(stat.st_mtime)
+        response["Accept-Ranges"] = "bytes"
+        if response.status_code != 416 and self.is_current_audio_url(name, request.GET.get("v")):
+            patch_cache_control(response, public=True, max_age=MEDIA_IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    @staticmethod
+    def is_current_audio_url(name, audio_hash):
+        # Only the URL the site currently links a word's audio by is cached for good. Any other hash, such as that of
+        # audio since replaced, or a made up one, would otherwise keep whatever is served for it in browsers for a year.
+        return bool(audio_hash) and get_audio_url(name, audio_hash) in get_word_ids_by_audio_url(get_vocabulary_snapshot())
+
+    @staticmethod
+    def get_file_response(request, full_path, size, etag, content_type):
+        # If-Range asks for the range only if the file is still the one it was read from.
+        byte_range = None
+        if request.headers.get("If-Range", etag) == etag:
+            byte_range = get_byte_range(request.headers.get("Range"), size)
+        if byte_range is False:
+            return HttpResponse(status=416, headers={"Content-Range": f"bytes */{size}"})
+        media_file = open(full_path, "rb")
+        if byte_range is None:
+            # The whole file goes through FileResponse as it is, so that the server can send it with sendfile.
+            return FileResponse(media_file, content_type=content_type)
+        start, end = byte_range
+        media_file.seek(start)
+        response = FileResponse(FileRange(media_file, end - start + 1), status=206, content_type=content_type)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return response
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import mimetypes
+import struct
+
+from django.core.cache import cache
+from django.urls import reverse
+
+from .models import Word, get_audio_url
+
+# A quiz comes with bundles holding the audio of all its questions, so that the clips arrive in one or two requests
+# before the first question is shown rather than one request each. A bundle is a 4 byte big-endian length, a JSON
+# manifest of that length mapping each clip's usual URL to its [offset, length, content type] in the rest of the bundle,
+# and then the clips one after another. A 50 question quiz uses at most a couple of hundred clips.
+AUDIO_BUNDLE_MAX_WORDS = 100
+AUDIO_BUNDLE_TIMEOUT = 60 * 60 * 24
+
+
+def get_audio_bundle_key(word_ids, version):
+    return f"audio_bundle:{version}:{hashlib.md5(','.join(map(str, word_ids)).encode()).hexdigest()}"
+
+
+def get_word_ids_by_audio_url(snapshot):
+    words = snapshot.words
+    return snapshot.get_or_build("word_ids_by_audio_url", lambda: {audio_url: words.ids[index] for index, audio_url in enumerate(words.audio_urls) if audio_url})
+
+
+def get_audio_bundle_urls(snapshot, questions):
+    # The bundles of the clips in the questions, by the sorted ids of their words.
+    word_ids_by_audio_url = get_word_ids_by_audio_url(snapshot)
+    audio_urls = set()
+    for question in questions:
+        audio_urls.add(question["question_audio_url"])
+        audio_urls.update(option.get("audio_url") for option in question["options"] or ())
+    word_ids = sorted({word_ids_by_audio_url[audio_url] for audio_url in audio_urls if audio_url in word_ids_by_audio_url})
+    return [
+        f"{reverse('quiz_audio_bundle', args=['-'.join(map(str, word_ids[start:start + AUDIO_BUNDLE_MAX_WORDS]))])}?v={snapshot.version}"
+        for start in range(0, len(word_ids), AUDIO_BUNDLE_MAX_WORDS)
+    ]
+
+
+def get_audio_bundle(word_ids, version):
+    # The bundle is cached by the sorted word ids and the vocabulary version, as every quiz draws on the same clips.
+    key = get_audio_bundle_key(word_ids, version)
+    if (bundle := cache.get(key)) is None:
+        bundle = build_audio_bundle(word_ids)
+        cache.set(key, bundle, timeout=AUDIO_BUNDLE_TIMEOUT)
+    return bundle
+
+
+def build_audio_bundle(word_ids):
+    manifest = {}
+    clips = []
+    offset = 0
+    for audio_file, audio_rendition, audio_hash in Word.objects.filter(pk__in=word_ids).order_by("id").values_list("audio_file", "audio_rendition", "audio_hash"):
+        if not audio_file:
+            continue
+        name = audio_rendition or audio_file
+        try:
+            with Word._meta.get_field("audio_file").storage.open(name) as clip_file:
+                clip = clip_file.read()
+        except FileNotFoundError:
+            continue
+        manifest[get_audio_url(name, audio_hash)] = [offset, len(clip), mimetypes.guess_type(name)[0] or "application/octet-stream"]
+        clips.append(clip)
+        offset += len(clip)
+    manifest_bytes = json.dumps(manifest, separators=(",", ":")).encode()
+    return b"".join([struct.pack(">I", len(manifest_bytes)), manifest_bytes, *clips])
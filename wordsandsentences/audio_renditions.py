@@ -0,0 +1,120 @@
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.files import File
+from django.db import connection, transaction
+
+from .models import WORD_HAS_AUDIO, Word
+from .transcode import TranscodeError, can_transcode, transcode_audio
+from .utils import bump_vocabulary_version
+
+logger = logging.getLogger(__name__)
+
+# Transcoding is CPU bound, so renditions are made in this many worker processes rather than threads.
+AUDIO_RENDITION_WORKERS = min(4, os.cpu_count() or 1)
+AUDIO_RENDITION_CHUNK_SIZE = 1000
+
+
+def delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
+
+
+def make_audio_renditions(word_ids, progress=None):
+    # Makes a compact rendition of the audio of each word, and records the duration and size of what will be served.
+    # Words whose audio cannot be transcoded keep serving the upload itself. Words whose audio changed while this ran
+    # are left alone, as their new audio will have asked for a rendition of its own.
+    word_ids = list(word_ids)
+    field = Word._meta.get_field("audio_rendition")
+    storage = field.storage
+    words = []
+    for start in range(0, len(word_ids), AUDIO_RENDITION_CHUNK_SIZE):
+        words += Word.objects.filter(pk__in=word_ids[start:start + AUDIO_RENDITION_CHUNK_SIZE]).filter(WORD_HAS_AUDIO).only("id", "topic_id", "audio_file", "audio_hash", "audio_rendition")
+    words = [word for word in words if storage.exists(word.audio_file.name)]
+    if not words:
+        return 0
+    old_names = [word.audio_rendition.name for word in words if word.audio_rendition]
+    new_names = []
+    output_dir = tempfile.mkdtemp()
+    try:
+        for word in words:
+            word.audio_rendition = None
+            word.audio_duration = None
+            word.audio_size = storage.size(word.audio_file.name)
+        # The pool is only started if there is something to transcode. Its processes are spawned rather than forked, as
+        # forking copies whatever locks the web server's other threads are holding.
+        if words_to_transcode := [word for word in words if can_transcode(storage.path(word.audio_file.name))]:
+            with ProcessPoolExecutor(max_workers=AUDIO_RENDITION_WORKERS, mp_context=multiprocessing.get_context("spawn")) as executor:
+                words_by_future = {executor.submit(transcode_audio, storage.path(word.audio_file.name), output_dir): word for word in words_to_transcode}
+                for future in as_completed(words_by_future):
+                    word = words_by_future[future]
+                    try:
+                        rendition = future.result()
+                    except (TranscodeError, OSError) as e:
+                        logger.warning("Could not transcode %s: %s", word.audio_file.name, e)
+                        rendition = None
+                    if rendition:
+                        output_path, word.audio_duration = rendition
+                        stem = os.path.splitext(os.path.basename(word.audio_file.name))[0]
+                        with open(output_path, "rb") as output_file:
+                            word.audio_rendition = storage.save(field.generate_filename(word, stem + os.path.splitext(output_path)[1]), File(output_file), max_length=field.max_length)
+                        os.remove(output_path)
+                        new_names.append(word.audio_rendition.name)
+                        word.audio_size = storage.size(word.audio_rendition.name)
+                    if progress:
+                        progress(1)
+        if progress:
+            progress(len(words) - len(words_to_transcode))
+        audio_hashes = {}
+        for start in range(0, len(words), AUDIO_RENDITION_CHUNK_SIZE):
+            audio_hashes.update(Word.objects.filter(pk__in=[word.pk for word in words[start:start + AUDIO_RENDITION_CHUNK_SIZE]]).values_list("id", "audio_hash"))
+        changed_words = [word for word in words if audio_hashes.get(word.pk) != word.audio_hash]
+        delete_files(storage, [word.audio_rendition.name for word in changed_words if word.audio_rendition])
+        words = [word for word in words if audio_hashes.get(word.pk) == word.audio_hash]
+        with transaction.atomic():
+            Word.objects.bulk_update(words, ["audio_rendition", "audio_duration", "audio_size"], batch_size=AUDIO_RENDITION_CHUNK_SIZE)
+            transaction.on_commit(lambda: delete_files(storage, old_names))
+            transaction.on_commit(lambda: bump_vocabulary_version({word.topic_id for word in words}))
+    except BaseException:
+        delete_files(storage, new_names)
+        raise
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return len(words)
+
+
+class AudioRenditionWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(name="audio-rendition-worker", daemon=True)
+        self.requests = queue.Queue()
+
+    def run(self):
+        while True:
+            word_ids = self.requests.get()
+            try:
+                make_audio_renditions(word_ids)
+            except Exception:
+                logger.exception("Failed to make audio renditions.")
+            finally:
+                connection.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def request_audio_renditions(word_ids):
+    # Renditions of audio uploaded through the site are made on a worker thread of this process. Words still without
+    # one (such as when the process stopped first) can be caught up with `python manage.py make_audio_renditions`.
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = AudioRenditionWorker()
+            _worker.start()
+    _worker.requests.put(list(word_ids))
@@ -0,0 +1,97 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+from .jyutping import get_syllable_rows
+
+# The number of confusable words kept for each word.
+DISTRACTOR_CANDIDATE_COUNT = 8
+# Initials that learners tend to mix up; initials in the same group count as near each other.
+NEAR_INITIALS = (("n", "l"), ("ng", ""), ("g", "gw", "k", "kw"), ("b", "p"), ("d", "t"), ("z", "c", "s"), ("f", "h"))
+INITIAL_GROUPS = {initial: group[0] for group in NEAR_INITIALS for initial in group}
+
+
+def get_similarity_keys(jyutping):
+    # The keys of a word's similarity buckets, most confusable first: the same syllables with any tones, the same finals
+    # with near initials, and the same finals. Words only ever compete with words of the same number of syllables.
+    syllables = [(initial, final) for _position, initial, final, _tone in get_syllable_rows(jyutping)]
+    return (
+        ("syllables", *(initial + final for initial, final in syllables)),
+        ("near", *((INITIAL_GROUPS.get(initial, initial), final) for initial, final in syllables)),
+        ("finals", *(final for _initial, final in syllables)),
+    )
+
+
+class DistractorIndex:
+    # For every word, a ranked list of other words that are easy to mistake for it, to use as harder distractors.
+    # Words are grouped into buckets by their similarity keys, and each bucket is sorted once by the length of the
+    # English; a word's candidates are then the words from its buckets, most similar bucket first, whose English is
+    # closest in length to its own, found by bisecting into the sorted buckets.
+    # Candidate lists are worked out by word id, and a new vocabulary version only recomputes the lists of words whose
+    # buckets changed, reusing the rest from the previous index.
+    def __init__(self, snapshot, previous=None):
+        words = snapshot.words
+        self.entries_by_id = {}
+        self.buckets = {}
+        for index, word_id in enumerate(words.ids):
+            jyutping = words.jyutping[index].lower()
+            keys = get_similarity_keys(jyutping)
+            if len(keys[0]) == 1:
+                continue
+            english_length = len(words.english[index])
+            self.entries_by_id[word_id] = (keys, english_length, jyutping)
+            for key in keys:
+                self.buckets.setdefault(key, []).append((english_length, word_id, jyutping))
+        for bucket in self.buckets.values():
+            bucket.sort()
+        if previous is None:
+            changed_keys = set(self.buckets)
+        else:
+            changed_keys = {key for key, bucket in self.buckets.items() if previous.buckets.get(key) != bucket}
+        self.candidate_ids_by_id = {}
+        for word_id, entry in self.entries_by_id.items():
+            if previous is not None and previous.entries_by_id.get(word_id) == entry and not changed_keys.intersection(entry[0]):
+                self.candidate_ids_by_id[word_id] = previous.candidate_ids_by_id[word_id]
+            else:
+                self.candidate_ids_by_id[word_id] = self.find_candidate_ids(word_id, entry)
+        self.candidates = tuple(
+            array("q", (words.index_by_id[candidate_id] for candidate_id in self.candidate_ids_by_id.get(word_id, ())))
+            for word_id in words.ids
+        )
+
+    @classmethod
+    def for_snapshot(cls, snapshot):
+        def build():
+            global _latest_index
+            with _latest_index_lock:
+                _latest_index = cls(snapshot, previous=_latest_index)
+                return _latest_index
+        return snapshot.get_or_build("distractor_index", build)
+
+    def find_candidate_ids(self, word_id, entry):
+        keys, english_length, jyutping = entry
+        candidate_ids = []
+        seen_ids = {word_id}
+        for key in keys:
+            bucket = self.buckets[key]
+            # Walk outwards from the word's English length, taking whichever side is closer in length each time.
+            right = bisect_left(bucket, (english_length,))
+            left = right - 1
+            while len(candidate_ids) < DISTRACTOR_CANDIDATE_COUNT and (left >= 0 or right < len(bucket)):
+                if right >= len(bucket) or (left >= 0 and english_length - bucket[left][0] <= bucket[right][0] - english_length):
+                    _length, candidate_id, candidate_jyutping = bucket[left]
+                    left -= 1
+                else:
+                    _length, candidate_id, candidate_jyutping = bucket[right]
+                    right += 1
+                if candidate_id not in seen_ids and candidate_jyutping != jyutping:
+                    seen_ids.add(candidate_id)
+                    candidate_ids.append(candidate_id)
+            if len(candidate_ids) >= DISTRACTOR_CANDIDATE_COUNT:
+                break
+        return tuple(candidate_ids)
+
+
+# The most recently built index, which the index of the next vocabulary version is refreshed from.
+_latest_index = None
+_latest_index_lock = threading.Lock()
@@ -0,0 +1,125 @@
+import codecs
+import contextlib
+import glob
+import os
+import tempfile
+from itertools import groupby
+from operator import attrgetter, itemgetter
+
+from django.conf import settings
+from django.db.models import Prefetch
+from openpyxl import Workbook
+import unicodecsv
+
+from .models import Topic, Word, Sentence
+
+# Exports read the database this many rows at a time, so memory use does not grow with the vocabulary, and the number of
+# queries depends on the row count divided by this.
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+TOPICS_EXPORT_COLUMNS = ["topic_name", "colour"]
+WORDS_EXPORT_COLUMNS = ["topic", "jyutping", "cantonese", "english", "notes", "is_sentence", "response_to"]
+
+
+def iter_topics_rows():
+    yield TOPICS_EXPORT_COLUMNS
+    yield from Topic.objects.order_by("loc", "id").values_list("topic_name", "colour").iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iter_words_rows():
+    # Every topic's words then its sentences, in the order the site lists them. The words and the sentences are each
+    # read with one streaming query in topic order, and split by topic as they go past.
+    yield WORDS_EXPORT_COLUMNS
+    topics = list(Topic.objects.order_by("loc", "id").values_list("id", "topic_name"))
+    item_order = ("topic__loc", "topic_id", "loc", "id")
+    words = Word.objects.order_by(*item_order).values_list("topic_id", "jyutping", "cantonese", "english", "notes").iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    sentences = (
+        Sentence.objects.order_by(*item_order).only("topic_id", "jyutping", "cantonese", "english", "notes")
+        .prefetch_related(Prefetch("response_to", queryset=Sentence.objects.only("jyutping")))
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    words_by_topic = groupby(words, key=itemgetter(0))
+    sentences_by_topic = groupby(sentences, key=attrgetter("topic_id"))
+    word_group = next(words_by_topic, None)
+    sentence_group = next(sentences_by_topic, None)
+    for topic_id, topic_name in topics:
+        if word_group and word_group[0] == topic_id:
+            for _topic_id, jyutping, cantonese, english, notes in word_group[1]:
+                yield [topic_name, jyutping, cantonese, english, notes, "no", ""]
+            word_group = next(words_by_topic, None)
+        if sentence_group and sentence_group[0] == topic_id:
+            for sentence in sentence_group[1]:
+                yield [topic_name, sentence.jyutping, sentence.cantonese, sentence.english, sentence.notes, "yes", ", ".join(response_to_sentence.jyutping for response_to_sentence in sentence.response_to.all())]
+            sentence_group = next(sentences_by_topic, None)
+
+
+class Echo:
+    # A file-like object that hands back what is written to it, for the csv writer to produce one line at a time.
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    yield codecs.BOM_UTF8  # Force into UTF-8 so that it accepts Chinese characters.
+    writer = unicodecsv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, title, xlsx_file):
+    # openpyxl's write only mode keeps rows in a temporary file rather than in memory until the workbook is saved.
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title)
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(xlsx_file)
+
+
+# The last export of each kind and format is kept on disk, named after the vocabulary version it was made from, so that
+# it is served again without reading the database until the vocabulary changes.
+def get_export_path(export_name, export_format, version):
+    return os.path.join(settings.EXPORTS_ROOT, f"{export_name}-{version}.{export_format}")
+
+
+def open_saved_export(export_name, export_format, version):
+    try:
+        return open(get_export_path(export_name, export_format, version), "rb")
+    except FileNotFoundError:
+        return None
+
+
+@contextlib.contextmanager
+def saving_export(export_name, export_format, version):
+    # Yields a file to write the export into, which replaces the saved export once it has all been written (and is
+    # thrown away if writing stops part way, such as when a streamed download is cancelled).
+    os.makedirs(settings.EXPORTS_ROOT, exist_ok=True)
+    path = get_export_path(export_name, export_format, version)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=settings.EXPORTS_ROOT, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as export_file:
+            yield export_file
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    for old_path in glob.glob(get_export_path(export_name, export_format, "*")):
+        if old_path != path:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(old_path)
+
+
+def iter_saved_export(chunks, export_name, export_format, version):
+    # Passes the chunks of a streamed export through while saving them.
+    with saving_export(export_name, export_format, version) as export_file:
+        for chunk in chunks:
+            export_file.write(chunk)
+            yield chunk
+
+
+def save_xlsx(rows, title, export_name, version):
+    with saving_export(export_name, "xlsx", version) as export_file:
+        write_xlsx(rows, title, export_file)
+    return open(get_export_path(export_name, "xlsx", version), "rb")
@@ -0,0 +1,58 @@
+import random
+import uuid
+
+from django.core.cache import cache
+
+from .models import Topic, Word, Sentence, get_audio_url
+from .search import get_item_index, get_item_key
+
+# A deck of flashcards is kept in the cache as just the order of its cards, and the cards themselves are read from the
+# database and sent a page at a time, so neither the server nor the page ever holds the whole vocabulary.
+FLASHCARD_PAGE_SIZE = 50
+FLASHCARD_DECK_TIMEOUT = 60 * 60 * 24
+
+
+def get_deck_key(deck_id):
+    return f"flashcards:{deck_id}"
+
+
+def start_flashcards(topic, randomise_order, words_sentences_both):
+    # Cards are identified by item key, as in the search index, but made from database ids rather than snapshot indexes.
+    card_keys = []
+    for is_sentence, model_class in [(False, Word), (True, Sentence)]:
+        if words_sentences_both in ("both", "sentences" if is_sentence else "words"):
+            items = model_class.objects.filter(topic=topic) if topic else model_class.objects.all()
+            card_keys += [get_item_key(item_id, is_sentence) for item_id in items.values_list("id", flat=True)]
+    if randomise_order:
+        random.shuffle(card_keys)
+    deck_id = uuid.uuid4().hex
+    cache.set(get_deck_key(deck_id), card_keys, timeout=FLASHCARD_DECK_TIMEOUT)
+    return deck_id, card_keys
+
+
+def get_deck(deck_id):
+    return cache.get(get_deck_key(deck_id))
+
+
+def get_deck_page_count(card_keys):
+    return -(-len(card_keys) // FLASHCARD_PAGE_SIZE)
+
+
+def get_flashcards_page(card_keys, page):
+    # The cards of a page as [jyutping, cantonese, english, notes, topic_id, audio_url], with None for any card whose
+    # word or sentence has been deleted since the deck was made, and the colours of their topics.
+    page_keys = card_keys[page * FLASHCARD_PAGE_SIZE:(page + 1) * FLASHCARD_PAGE_SIZE]
+    cards_by_key = {}
+    for is_sentence, model_class in [(False, Word), (True, Sentence)]:
+        if not (item_ids := [item_id for item_id, item_is_sentence in map(get_item_index, page_keys) if item_is_sentence == is_sentence]):
+            continue
+        if is_sentence:
+            rows = ((*row, None, None, None) for row in model_class.objects.filter(pk__in=item_ids).values_list("id", "jyutping", "cantonese", "english", "notes", "topic_id"))
+        else:
+            rows = model_class.objects.filter(pk__in=item_ids).values_list("id", "jyutping", "cantonese", "english", "notes", "topic_id", "audio_file", "audio_rendition", "audio_hash")
+        for item_id, jyutping, cantonese, english, notes, topic_id, audio_file, audio_rendition, audio_hash in rows:
+            audio_url = get_audio_url(audio_rendition or audio_file, audio_hash) if audio_file else None
+            cards_by_key[get_item_key(item_id, is_sentence)] = [jyutping, cantonese, english, notes, topic_id, audio_url]
+    cards = [cards_by_key.get(card_key) for card_key in page_keys]
+    topic_ids = {card[4] for card in cards if card}
+    return cards, dict(Topic.objects.filter(pk__in=topic_ids).values_list("id", "colour"))
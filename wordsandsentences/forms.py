@@ -11,6 +11,8 @@ from .models import Topic, LearningItem, Word, Sentence
 class QuizStartForm(FormWithHelperMixin, forms.Form):
     question_count = forms.ChoiceField(choices=((10, "10"), (25, "25"), (50, "50")), label="Number of questions")
     include_audio = forms.BooleanField(initial=True, label="Include questions with audio", required=False)
+    # Replays the quiz with this seed (for the same vocabulary version) rather than making up a new one.
+    seed = forms.IntegerField(min_value=0, required=False, widget=forms.HiddenInput)
     submit_text = "Start quiz"
     submit_css_class = "btn-primary"
 
@@ -80,7 +82,7 @@ class SentenceForm(LearningItemForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if self.instance:
+        if self.instance.pk:
             self.fields["response_to"].queryset = self.fields["response_to"].queryset.exclude(id=self.instance.id)
             self.fields["responses"].queryset = self.fields["response_to"].queryset
 
@@ -108,18 +110,22 @@ class ImportForm(forms.Form):
     topics_csv = forms.FileField(required=False, label="CSV of topics")
     words_csv = forms.FileField(required=False, label="CSV of words and sentences")
     audio_files = MultipleFileField(required=False)
+    delete_missing = forms.BooleanField(required=False, label="Delete words and sentences of the imported topics that are not in the CSV")
+    dry_run = forms.BooleanField(required=False, label="Preview the changes to words and sentences without importing anything")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.helper = FormHelper(self)
         self.helper.layout = Layout(
-            Div(Div("topics_csv", css_class="col-12 col-md-8 col-lg-9"), Div(HTML(f"""<a href='{reverse_lazy("topics_export")}' class='btn btn-info w-100'>Export existing topics</a>"""), css_class="col-12 col-md-4 col-lg-3 mb-3"), css_class="row align-items-end"),
-            Div(Div("words_csv", css_class="col-12 col-md-8 col-lg-9"), Div(HTML(f"""<a href='{reverse_lazy("words_export")}' class='btn btn-info w-100'>Export existing words</a>"""), css_class="col-12 col-md-4 col-lg-3 mb-3"), css_class="row align-items-end"),
-            "audio_files")
+            Div(Div("topics_csv", css_class="col-12 col-md-8 col-lg-9"), Div(HTML(f"""<div class='btn-group w-100'><a href='{reverse_lazy("topics_export")}' class='btn btn-info'>Export existing topics</a><a href='{reverse_lazy("topics_export")}?format=xlsx' class='btn btn-outline-info flex-grow-0'>XLSX</a></div>"""), css_class="col-12 col-md-4 col-lg-3 mb-3"), css_class="row align-items-end"),
+            Div(Div("words_csv", css_class="col-12 col-md-8 col-lg-9"), Div(HTML(f"""<div class='btn-group w-100'><a href='{reverse_lazy("words_export")}' class='btn btn-info'>Export existing words</a><a href='{reverse_lazy("words_export")}?format=xlsx' class='btn btn-outline-info flex-grow-0'>XLSX</a></div>"""), css_class="col-12 col-md-4 col-lg-3 mb-3"), css_class="row align-items-end"),
+            "audio_files", "delete_missing", "dry_run")
         self.helper.add_input(Submit('submit', "Upload", css_class="btn-secondary"))
 
     def clean(self):
         super().clean()
         if not self.cleaned_data["topics_csv"] and not self.cleaned_data["words_csv"] and not self.cleaned_data["audio_files"]:
             raise forms.ValidationError("Please upload a file.")
+        if self.cleaned_data["dry_run"] and not self.cleaned_data["words_csv"]:
+            raise forms.ValidationError("Please upload a CSV of words and sentences to preview.")
         
\ No newline at end of file
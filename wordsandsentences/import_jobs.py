@@ -0,0 +1,194 @@
+import logging
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .audio_renditions import make_audio_renditions
+from .imports import IMPORT_PREVIEW_ROWS, count_csv_rows, import_audio_files, import_topics_csv, import_words_csv
+from .models import ImportJob, ImportJobFile
+
+logger = logging.getLogger(__name__)
+
+# While a job runs its progress is kept in the cache rather than the job table, as most of the work happens inside a
+# transaction whose writes other requests cannot see until it commits.
+IMPORT_JOB_PROGRESS_TIMEOUT = 60 * 60 * 24
+IMPORT_JOB_STAGES = {"topics_csv": "topics CSV", "words_csv": "words CSV", "audio_file": "audio files", "audio_rendition": "audio renditions"}
+# A running job whose progress has not moved for this long is taken to have died with its process (such as when the
+# server restarted part way through), and is marked as failed so that its progress page stops waiting for it.
+IMPORT_JOB_STALE_AFTER = timedelta(minutes=30)
+# A running job also saves its progress this often (in seconds) while it is busy with something that reports none, such
+# as the bulk writes of a words CSV or transcoding audio, so that only a job whose process has died goes stale.
+IMPORT_JOB_HEARTBEAT_INTERVAL = 60
+
+
+def get_import_job_progress_key(job_id):
+    return f"import_job_progress:{job_id}"
+
+
+def create_import_job(topics_csv, words_csv, audio_files, delete_missing):
+    with transaction.atomic():
+        job = ImportJob.objects.create(delete_missing=delete_missing)
+        for kind, uploaded_files in [("topics_csv", [topics_csv] if topics_csv else []), ("words_csv", [words_csv] if words_csv else []), ("audio_file", audio_files or [])]:
+            for uploaded_file in uploaded_files:
+                ImportJobFile.objects.create(job=job, kind=kind, name=uploaded_file.name, file=uploaded_file)
+        transaction.on_commit(lambda: request_import_job(job.pk))
+    return job
+
+
+class ImportJobProgress:
+    def __init__(self, job):
+        self.job = job
+        self.rows_processed = 0
+
+    def set_stage(self, stage):
+        self.job.stage = stage
+        self.save()
+
+    def __call__(self, row_count):
+        self.rows_processed += row_count
+        self.save()
+
+    def heartbeat(self, stopped):
+        while not stopped.wait(IMPORT_JOB_HEARTBEAT_INTERVAL):
+            self.save()
+
+    def save(self):
+        cache.set(get_import_job_progress_key(self.job.pk), {"stage": self.job.stage, "rows_processed": self.rows_processed, "updated_at": timezone.now()}, timeout=IMPORT_JOB_PROGRESS_TIMEOUT)
+
+
+def fail_stale_import_job(job):
+    # Returns True if the running job had gone stale and has now been marked as failed.
+    progress = cache.get(get_import_job_progress_key(job.pk)) or {}
+    last_active = progress.get("updated_at") or job.started_at
+    if last_active and timezone.now() - last_active < IMPORT_JOB_STALE_AFTER:
+        return False
+    error = f"Error in {progress.get('stage') or job.stage or 'the import'}: the import stopped without finishing, e.g. because the server restarted. Please run it again."
+    if not ImportJob.objects.filter(pk=job.pk, status="running").update(status="failed", error=error, rows_processed=progress.get("rows_processed", job.rows_processed), finished_at=timezone.now()):
+        return False
+    cache.delete(get_import_job_progress_key(job.pk))
+    delete_import_job_files(job, list(job.files.all()))
+    return True
+
+
+def fail_stale_import_jobs():
+    return sum(fail_stale_import_job(job) for job in ImportJob.objects.filter(status="running"))
+
+
+def get_import_job_progress(job):
+    # The job as it is stored, with the latest progress of a running job from the cache.
+    if job.status == "running" and fail_stale_import_job(job):
+        job.refresh_from_db()
+    progress = {"stage": job.stage, "rows_processed": job.rows_processed}
+    if job.status == "running":
+        progress.update(cache.get(get_import_job_progress_key(job.pk)) or {})
+    end = job.finished_at or timezone.now()
+    seconds = (end - job.started_at).total_seconds() if job.started_at else 0
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "stage": progress["stage"],
+        "rows_total": job.rows_total,
+        "rows_processed": progress["rows_processed"],
+        "rows_per_second": round(progress["rows_processed"] / seconds, 1) if seconds > 0 else None,
+        "seconds": round(seconds, 1),
+        "error": job.error,
+        "report": job.report,
+    }
+
+
+def run_import_job(job_id):
+    # Only the worker that moves the job out of the queue gets to run it.
+    if not ImportJob.objects.filter(pk=job_id, status="queued").update(status="running", started_at=timezone.now()):
+        return
+    job = ImportJob.objects.get(pk=job_id)
+    job_files = list(job.files.all())
+    files_by_kind = {kind: [job_file for job_file in job_files if job_file.kind == kind] for kind in IMPORT_JOB_STAGES}
+    progress = ImportJobProgress(job)
+    heartbeat_stopped = threading.Event()
+    threading.Thread(target=progress.heartbeat, args=[heartbeat_stopped], name=f"import-job-{job.pk}-heartbeat", daemon=True).start()
+    report = {}
+    try:
+        for job_file in files_by_kind["topics_csv"] + files_by_kind["words_csv"]:
+            job.stage = IMPORT_JOB_STAGES[job_file.kind]
+            with job_file.file.open("rb") as field_file:
+                job.rows_total += count_csv_rows(field_file.file)
+        job.rows_total += len(files_by_kind["audio_file"])
+        job.save(update_fields=["rows_total"])
+        for job_file in files_by_kind["topics_csv"]:
+            progress.set_stage(IMPORT_JOB_STAGES["topics_csv"])
+            with job_file.file.open("rb") as field_file:
+                import_topics_csv(field_file.file, progress)
+            report["topics_imported"] = True
+        for job_file in files_by_kind["words_csv"]:
+            progress.set_stage(IMPORT_JOB_STAGES["words_csv"])
+            with job_file.file.open("rb") as field_file:
+                diff = import_words_csv(field_file.file, delete_missing=job.delete_missing, progress=progress)
+            report["words"] = {action: {"count": len(entries), "entries": entries[:IMPORT_PREVIEW_ROWS] if action != "unchanged" else []} for action, entries in diff.items()}
+        if files_by_kind["audio_file"]:
+            progress.set_stage(IMPORT_JOB_STAGES["audio_file"])
+            word_ids = import_audio_files([(job_file.name, job_file.file) for job_file in files_by_kind["audio_file"]], progress)
+            report["audio_files"] = len(files_by_kind["audio_file"])
+            # The imported audio then gets its compact renditions, which count as rows of their own.
+            job.rows_total += len(word_ids)
+            job.save(update_fields=["rows_total"])
+            progress.set_stage(IMPORT_JOB_STAGES["audio_rendition"])
+            report["audio_renditions"] = make_audio_renditions(word_ids, progress)
+        job.status = "done"
+        job.stage = ""
+    except Exception as e:
+        job.status = "failed"
+        job.error = f"Error in {job.stage}: {e}"
+    finally:
+        heartbeat_stopped.set()
+    # A job that was marked as failed in the meantime (having been taken for stale) stays failed.
+    ImportJob.objects.filter(pk=job.pk, status="running").update(
+        status=job.status, stage=job.stage, error=job.error, rows_processed=progress.rows_processed, report=report, finished_at=timezone.now(),
+    )
+    cache.delete(get_import_job_progress_key(job.pk))
+    delete_import_job_files(job, job_files)
+
+
+def delete_import_job_files(job, job_files):
+    # Finished jobs keep their report but not their uploads.
+    for job_file in job_files:
+        job_file.file.delete(save=False)
+    job.files.all().delete()
+
+
+class ImportJobWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(name="import-job-worker", daemon=True)
+        self.requests = queue.Queue()
+
+    def run(self):
+        while True:
+            job_id = self.requests.get()
+            try:
+                run_import_job(job_id)
+            except Exception:
+                logger.exception("Failed to run import job %s.", job_id)
+            finally:
+                connection.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def request_import_job(job_id):
+    # Jobs run one at a time, in the order they were requested, on a worker thread of this process. Jobs that are still
+    # queued when the process stops can be run with `python manage.py run_import_jobs`.
+    global _worker
+    if getattr(settings, "IMPORT_JOBS_IN_REQUEST", False):
+        run_import_job(job_id)
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = ImportJobWorker()
+            _worker.start()
+    _worker.requests.put(job_id)
@@ -0,0 +1,338 @@
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .jyutping import parse_jyutping
+from .models import Topic, Word, Sentence, get_content_hash, get_file_hash
+from .utils import bump_vocabulary_version, update_syllables
+
+# Uploaded CSVs are read a chunk of rows at a time, and everything is written with bulk queries of up to this many rows,
+# so the number of queries an import makes depends on the number of rows divided by this rather than on the row count.
+IMPORT_CHUNK_SIZE = 1000
+TOPICS_CSV_COLUMNS = ("topic_name", "colour")
+REQUIRED_WORDS_CSV_COLUMNS = ("topic", "jyutping", "english", "is_sentence")
+IMPORT_DIFF_ACTIONS = ("created", "updated", "unchanged", "deleted")
+# The most rows of each kind that a dry run lists; the rest are only counted.
+IMPORT_PREVIEW_ROWS = 200
+# Audio files are hashed and written by this many threads at once, as that is bound by disk I/O rather than Python.
+AUDIO_IMPORT_WORKERS = 8
+
+
+class ImportDataError(Exception):
+    pass
+
+
+def count_csv_rows(uploaded_file):
+    row_count = sum(len(chunk) for chunk in iter_csv_chunks(uploaded_file, ()))
+    uploaded_file.seek(0)
+    return row_count
+
+
+def iter_csv_chunks(uploaded_file, required_columns):
+    # Yields lists of (line_number, row) without ever decoding the whole file at once.
+    text_file = io.TextIOWrapper(uploaded_file.file, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(text_file)
+        if missing_columns := [column for column in required_columns if column not in (reader.fieldnames or ())]:
+            raise ImportDataError(f"Missing column{'s' if len(missing_columns) > 1 else ''}: {', '.join(missing_columns)}.")
+        chunk = []
+        for row in reader:
+            chunk.append((reader.line_num, row))
+            if len(chunk) == IMPORT_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        # Leave the uploaded file open, as closing the wrapper would otherwise close it too.
+        text_file.detach()
+
+
+def get_field(line_number, row, column, max_length, required=True):
+    value = (row.get(column) or "").strip()
+    if required and not value:
+        raise ImportDataError(f"Line {line_number}: {column} is empty.")
+    if len(value) > max_length:
+        raise ImportDataError(f"Line {line_number}: {column} is longer than {max_length} characters.")
+    return value
+
+
+def split_response_to(response_to):
+    return [jyutping.strip() for jyutping in response_to.split(",") if jyutping.strip()]
+
+
+def import_topics_csv(uploaded_file, progress=None):
+    colour_by_name = {}
+    for chunk in iter_csv_chunks(uploaded_file, TOPICS_CSV_COLUMNS):
+        for line_number, row in chunk:
+            topic_name = get_field(line_number, row, "topic_name", 100)
+            if topic_name in colour_by_name:
+                raise ImportDataError(f"Line {line_number}: topic {topic_name} appears more than once.")
+            colour_by_name[topic_name] = get_field(line_number, row, "colour", 7)
+        if progress:
+            progress(len(chunk))
+    with transaction.atomic():
+        existing_topics = list(Topic.objects.order_by("loc", "id"))
+        loc = 0
+        # Existing topics that are not in the CSV keep their order ahead of the new ones, which follow in CSV order.
+        for topic in existing_topics:
+            if topic.topic_name not in colour_by_name:
+                topic.loc = loc
+                loc += 10
+            else:
+                topic.colour = colour_by_name[topic.topic_name]
+        existing_names = {topic.topic_name for topic in existing_topics}
+        new_topics = []
+        for topic_name, colour in colour_by_name.items():
+            if topic_name not in existing_names:
+                new_topics.append(Topic(topic_name=topic_name, colour=colour, loc=loc))
+            loc += 10
+        Topic.objects.bulk_update(existing_topics, ["colour", "loc"], batch_size=IMPORT_CHUNK_SIZE)
+        Topic.objects.bulk_create(new_topics, batch_size=IMPORT_CHUNK_SIZE)
+        # Bulk operations do not send model signals, so the vocabulary version has to be bumped here.
+        transaction.on_commit(lambda: bump_vocabulary_version([topic.id for topic in existing_topics]))
+
+
+def read_words_csv(uploaded_file, progress=None):
+    # Returns {is_sentence: {topic_name: [row]}} with the rows of each topic in CSV order, where each row is a tuple of
+    # (line_number, jyutping, cantonese, english, notes, response_to).
+    rows_by_topic = {False: {}, True: {}}
+    for chunk in iter_csv_chunks(uploaded_file, REQUIRED_WORDS_CSV_COLUMNS):
+        for line_number, row in chunk:
+            topic_name = get_field(line_number, row, "topic", 100)
+            jyutping = get_field(line_number, row, "jyutping", 100)
+            is_sentence = row["is_sentence"].strip().lower() == "yes"
+            topic_rows = rows_by_topic[is_sentence].setdefault(topic_name, {})
+            if jyutping in topic_rows:
+                raise ImportDataError(f"Line {line_number}: {jyutping} appears more than once in topic {topic_name}.")
+            topic_rows[jyutping] = (
+                line_number, jyutping, get_field(line_number, row, "cantonese", 50, required=False), get_field(line_number, row, "english", 100),
+                get_field(line_number, row, "notes", 200, required=False), split_response_to(row.get("response_to") or "") if is_sentence else [],
+            )
+        if progress:
+            progress(len(chunk))
+    return {is_sentence: {topic_name: list(topic_rows.values()) for topic_name, topic_rows in rows_by_topic[is_sentence].items()} for is_sentence in (False, True)}
+
+
+def add_diff_entry(entries, is_sentence, topic_name, jyutping, action, changes=()):
+    entries[is_sentence, topic_name, jyutping] = {"type": "sentence" if is_sentence else "word", "topic": topic_name, "jyutping": jyutping, "action": action, "changes": list(changes)}
+
+
+def import_words_csv(uploaded_file, dry_run=False, delete_missing=False, progress=None):
+    # Returns {action: [entry]} listing every word and sentence that the import created, updated, left unchanged or
+    # deleted. Only rows whose content hash, order or responses differ are written; with dry_run nothing is kept, so the
+    # diff is a preview. With delete_missing the words and sentences of the imported topics that are not in the CSV are
+    # deleted, rather than kept ahead of the imported ones. progress, if given, is called with the number of rows read
+    # after each chunk.
+    rows_by_topic = read_words_csv(uploaded_file, progress)
+    entries = {}
+    with transaction.atomic():
+        # Topics that the CSV mentions but that do not exist yet are added after the existing ones.
+        existing_topics = list(Topic.objects.order_by("loc", "id"))
+        topic_ids_by_name = {topic.topic_name: topic.id for topic in existing_topics}
+        next_topic_loc = existing_topics[-1].loc + 10 if existing_topics else 0
+        new_topics = []
+        for topic_name in dict.fromkeys([*rows_by_topic[False], *rows_by_topic[True]]):
+            if topic_name not in topic_ids_by_name:
+                new_topics.append(Topic(topic_name=topic_name, loc=next_topic_loc))
+                next_topic_loc += 10
+        for topic in Topic.objects.bulk_create(new_topics, batch_size=IMPORT_CHUNK_SIZE):
+            topic_ids_by_name[topic.topic_name] = topic.id
+        for model_class, is_sentence in [(Word, False), (Sentence, True)]:
+            topic_ids = [topic_ids_by_name[topic_name] for topic_name in rows_by_topic[is_sentence]]
+            existing_objs_by_topic_id = {}
+            for obj in model_class.objects.filter(topic_id__in=topic_ids).order_by("topic_id", "loc", "id").only("id", "topic_id", "jyutping", "content_hash", "loc"):
+                existing_objs_by_topic_id.setdefault(obj.topic_id, []).append(obj)
+            objs_to_create = []
+            objs_to_update = []
+            objs_to_move = []
+            ids_to_delete = []
+            for topic_name, rows in rows_by_topic[is_sentence].items():
+                topic_id = topic_ids_by_name[topic_name]
+                existing_objs_by_jyutping = {obj.jyutping: obj for obj in existing_objs_by_topic_id.get(topic_id, ())}
+                imported_jyutping = {row[1] for row in rows}
+                loc = 0
+                # Existing objects that are not in the CSV keep their order ahead of the imported ones.
+                for obj in existing_objs_by_topic_id.get(topic_id, ()):
+                    if obj.jyutping in imported_jyutping:
+                        continue
+                    if delete_missing:
+                        ids_to_delete.append(obj.id)
+                        add_diff_entry(entries, is_sentence, topic_name, obj.jyutping, "deleted")
+                        continue
+                    if obj.loc != loc:
+                        obj.loc = loc
+                        objs_to_move.append(obj)
+                        add_diff_entry(entries, is_sentence, topic_name, obj.jyutping, "updated", ["order"])
+                    loc += 10
+                for _line_number, jyutping, cantonese, english, notes, _response_to in rows:
+                    content_hash = get_content_hash(cantonese, english, notes)
+                    if (obj := existing_objs_by_jyutping.get(jyutping)) is None:
+                        objs_to_create.append(model_class(
+                            topic_id=topic_id, jyutping=jyutping, cantonese=cantonese, english=english, notes=notes, loc=loc,
+                            syllable_count=len(parse_jyutping(jyutping)), content_hash=content_hash,
+                        ))
+                        add_diff_entry(entries, is_sentence, topic_name, jyutping, "created")
+                    elif obj.content_hash != content_hash:
+                        add_diff_entry(entries, is_sentence, topic_name, jyutping, "updated", ["content", "order"] if obj.loc != loc else ["content"])
+                        obj.cantonese = cantonese
+                        obj.english = english
+                        obj.notes = notes
+                        obj.content_hash = content_hash
+                        obj.loc = loc
+                        objs_to_update.append(obj)
+                    elif obj.loc != loc:
+                        obj.loc = loc
+                        objs_to_move.append(obj)
+                        add_diff_entry(entries, is_sentence, topic_name, jyutping, "updated", ["order"])
+                    else:
+                        add_diff_entry(entries, is_sentence, topic_name, jyutping, "unchanged")
+                    loc += 10
+            for start in range(0, len(ids_to_delete), IMPORT_CHUNK_SIZE):
+                model_class.objects.filter(id__in=ids_to_delete[start:start + IMPORT_CHUNK_SIZE]).delete()
+            model_class.objects.bulk_update(objs_to_update, ["cantonese", "english", "notes", "content_hash", "loc"], batch_size=IMPORT_CHUNK_SIZE)
+            model_class.objects.bulk_update(objs_to_move, ["loc"], batch_size=IMPORT_CHUNK_SIZE)
+            model_class.objects.bulk_create(objs_to_create, batch_size=IMPORT_CHUNK_SIZE)
+            update_syllables(model_class, objs_to_create, replace=False)
+        import_responses(rows_by_topic[True], topic_ids_by_name, entries)
+        diff = {action: [] for action in IMPORT_DIFF_ACTIONS}
+        for entry in entries.values():
+            diff[entry["action"]].append(entry)
+        if dry_run:
+            transaction.set_rollback(True)
+        elif new_topics or diff["created"] or diff["updated"] or diff["deleted"]:
+            # Bulk operations do not send model signals, so the vocabulary version has to be bumped here.
+            transaction.on_commit(lambda: bump_vocabulary_version({topic_ids_by_name[topic_name] for is_sentence in (False, True) for topic_name in rows_by_topic[is_sentence]}))
+    return diff
+
+
+def import_responses(sentence_rows_by_topic, topic_ids_by_name, entries):
+    # Sets the response_to links of every sentence in the CSV that lists some, looking the sentences up by jyutping in
+    # every topic, or in the sentence's own topic when more than one topic has a sentence with that jyutping. Only the
+    # links of sentences whose responses differ from the CSV are replaced.
+    ids_by_jyutping = {}
+    for sentence_id, topic_id, jyutping in Sentence.objects.values_list("id", "topic_id", "jyutping"):
+        ids_by_jyutping.setdefault(jyutping, {})[topic_id] = sentence_id
+    through = Sentence.response_to.through
+    existing_links = {}
+    for from_sentence_id, to_sentence_id in through.objects.filter(from_sentence__topic_id__in=[topic_ids_by_name[topic_name] for topic_name in sentence_rows_by_topic]).values_list("from_sentence_id", "to_sentence_id"):
+        existing_links.setdefault(from_sentence_id, set()).add(to_sentence_id)
+    from_sentence_ids = []
+    links = []
+    for topic_name, rows in sentence_rows_by_topic.items():
+        topic_id = topic_ids_by_name[topic_name]
+        for line_number, jyutping, _cantonese, _english, _notes, response_to in rows:
+            if not response_to:
+                continue
+            from_sentence_id = ids_by_jyutping[jyutping][topic_id]
+            to_sentence_ids = {}
+            for response_to_jyutping in response_to:
+                sentence_ids_by_topic_id = ids_by_jyutping.get(response_to_jyutping, {})
+                if len(sentence_ids_by_topic_id) == 1:
+                    to_sentence_ids[next(iter(sentence_ids_by_topic_id.values()))] = None
+                elif topic_id in sentence_ids_by_topic_id:
+                    to_sentence_ids[sentence_ids_by_topic_id[topic_id]] = None
+                else:
+                    raise ImportDataError(f"Line {line_number}: no {'single ' if sentence_ids_by_topic_id else ''}sentence found with jyutping '{response_to_jyutping}' to be a response to.")
+            if set(to_sentence_ids) == existing_links.get(from_sentence_id, set()):
+                continue
+            from_sentence_ids.append(from_sentence_id)
+            links += [through(from_sentence_id=from_sentence_id, to_sentence_id=to_sentence_id) for to_sentence_id in to_sentence_ids]
+            entry = entries[True, topic_name, jyutping]
+            if entry["action"] == "unchanged":
+                entry["action"] = "updated"
+            if entry["action"] == "updated":
+                entry["changes"].append("responses")
+    for start in range(0, len(from_sentence_ids), IMPORT_CHUNK_SIZE):
+        through.objects.filter(from_sentence_id__in=from_sentence_ids[start:start + IMPORT_CHUNK_SIZE]).delete()
+    through.objects.bulk_create(links, batch_size=IMPORT_CHUNK_SIZE)
+
+
+def delete_audio_files(names):
+    storage = Word._meta.get_field("audio_file").storage
+    for name in names:
+        storage.delete(name)
+
+
+def write_audio_file(file_name, audio_file, words):
+    # Runs on the import's thread pool, without touching the database. Returns the (word, name, hash) of each word whose
+    # audio differs from the upload, with the upload written to its own file for that word, and the (word, hash) of
+    # each unchanged word whose stored audio had not been hashed yet.
+    field = Word._meta.get_field("audio_file")
+    written = []
+    hashed = []
+    try:
+        with audio_file.open("rb"):
+            audio_hash = get_file_hash(audio_file)
+            for word in words:
+                word_audio_hash = word.audio_hash
+                if not word_audio_hash and word.audio_file and field.storage.exists(word.audio_file.name):
+                    with field.storage.open(word.audio_file.name) as stored_file:
+                        word_audio_hash = get_file_hash(stored_file)
+                if word_audio_hash == audio_hash:
+                    if not word.audio_hash:
+                        hashed.append((word, audio_hash))
+                    continue
+                name = field.storage.save(field.generate_filename(word, file_name), audio_file, max_length=field.max_length)
+                written.append((word, name, audio_hash))
+    except BaseException:
+        delete_audio_files(name for _word, name, _audio_hash in written)
+        raise
+    return written, hashed
+
+
+def import_audio_files(audio_files, progress=None):
+    # Attaches each (file_name, audio_file) to every word whose jyutping matches the file name, less its extension;
+    # audio_file is any Django file that can be opened, so that the uploads can be read in parallel. Every word is
+    # matched up front with one query per chunk of files, the files are hashed and written on a thread pool, skipping
+    # words whose audio is already the same, and the words are updated with bulk queries. Replaced files are removed
+    # once the import commits, and the files written are removed again if it does not. Returns the ids of the words
+    # whose audio changed, which need new renditions.
+    audio_files_by_jyutping = {file_name.split(".")[0].lower(): (file_name, audio_file) for file_name, audio_file in audio_files}
+    jyutpings = list(audio_files_by_jyutping)
+    words_by_jyutping = {}
+    for start in range(0, len(jyutpings), IMPORT_CHUNK_SIZE):
+        words = Word.objects.annotate(jyutping_lower=Lower("jyutping")).filter(jyutping_lower__in=jyutpings[start:start + IMPORT_CHUNK_SIZE]).only("id", "topic_id", "jyutping", "audio_file", "audio_hash", "audio_rendition")
+        for word in words:
+            words_by_jyutping.setdefault(word.jyutping_lower, []).append(word)
+    for jyutping, (file_name, _audio_file) in audio_files_by_jyutping.items():
+        if jyutping not in words_by_jyutping:
+            raise ImportDataError(f"No word found with jyutping '{file_name.split('.')[0]}'.")
+    objs_to_update = []
+    objs_to_hash = []
+    old_names = []
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=AUDIO_IMPORT_WORKERS) as executor:
+            futures = [executor.submit(write_audio_file, file_name, audio_file, words_by_jyutping[jyutping]) for jyutping, (file_name, audio_file) in audio_files_by_jyutping.items()]
+            for future in as_completed(futures):
+                written, hashed = future.result()
+                for word, name, audio_hash in written:
+                    old_names += [old_file.name for old_file in (word.audio_file, word.audio_rendition) if old_file]
+                    word.audio_file = name
+                    word.audio_hash = audio_hash
+                    word.audio_rendition = None
+                    word.audio_duration = None
+                    word.audio_size = None
+                    objs_to_update.append(word)
+                for word, audio_hash in hashed:
+                    word.audio_hash = audio_hash
+                    objs_to_hash.append(word)
+                if progress:
+                    progress(1)
+        with transaction.atomic():
+            Word.objects.bulk_update(objs_to_update, ["audio_file", "audio_hash", "audio_rendition", "audio_duration", "audio_size"], batch_size=IMPORT_CHUNK_SIZE)
+            Word.objects.bulk_update(objs_to_hash, ["audio_hash"], batch_size=IMPORT_CHUNK_SIZE)
+            if objs_to_update:
+                transaction.on_commit(lambda: delete_audio_files(old_names))
+                transaction.on_commit(lambda: bump_vocabulary_version({word.topic_id for word in objs_to_update}))
+    except BaseException:
+        # Any file written before the failure, including by tasks that finished after it, is no longer wanted.
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                delete_audio_files(name for _word, name, _audio_hash in future.result()[0])
+        raise
+    return [word.pk for word in objs_to_update]
@@ -0,0 +1,112 @@
+import re
+
+from .search import get_item_key
+
+SYLLABLE_RE = re.compile(r"([a-z]+)([1-6]?)")
+INITIALS = ("ng", "gw", "kw", "b", "p", "m", "f", "d", "t", "n", "l", "g", "k", "h", "w", "z", "c", "s", "j")
+
+
+def parse_jyutping(jyutping):
+    # "Nei5 hou2?" -> [("nei", "5"), ("hou", "2")]; the tone is "" when it is left out.
+    return SYLLABLE_RE.findall(jyutping.lower())
+
+
+def split_syllable(syllable):
+    # "gwong" -> ("gw", "ong"). The syllabic nasals "m" and "ng" have no initial.
+    if syllable not in ("m", "ng"):
+        for initial in INITIALS:
+            if syllable.startswith(initial) and len(syllable) > len(initial):
+                return initial, syllable[len(initial):]
+    return "", syllable
+
+
+def get_syllable_rows(jyutping):
+    # (position, initial, final, tone) for each syllable, as stored in the syllable tables.
+    return [(position, *split_syllable(syllable), int(tone) if tone else None) for position, (syllable, tone) in enumerate(parse_jyutping(jyutping))]
+
+
+def get_edit_distance(a, b):
+    previous_row = list(range(len(b) + 1))
+    for i, a_character in enumerate(a, start=1):
+        row = [i]
+        for j, b_character in enumerate(b, start=1):
+            row.append(min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + (a_character != b_character)))
+        previous_row = row
+    return previous_row[-1]
+
+
+def get_deletions(syllable):
+    return {syllable[:i] + syllable[i + 1:] for i in range(len(syllable))}
+
+
+class JyutpingIndex:
+    # Syllable level index over the jyutping of every word and sentence:
+    # - items_by_syllable and items_by_tone map each toneless syllable and each tone to the items that contain it,
+    # - the sequence trie holds every item's toneless syllables in order, with the items themselves under the None key,
+    # - syllables_by_deletion maps each syllable, and each way of deleting one letter from it, back to the syllables, so
+    #   that the syllables within one edit of a typed syllable are found with a few dictionary lookups.
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.items_by_syllable = {}
+        self.items_by_tone = {}
+        self.sequence_trie = {}
+        self.tones = {}
+        for is_sentence in (False, True):
+            table = snapshot.table(is_sentence)
+            for index in range(len(table)):
+                item_key = get_item_key(index, is_sentence)
+                syllables = parse_jyutping(table.jyutping[index])
+                if not syllables:
+                    continue
+                self.tones[item_key] = tuple(tone for _syllable, tone in syllables)
+                node = self.sequence_trie
+                for syllable, tone in syllables:
+                    self.items_by_syllable.setdefault(syllable, set()).add(item_key)
+                    if tone:
+                        self.items_by_tone.setdefault(tone, set()).add(item_key)
+                    node = node.setdefault(syllable, {})
+                node.setdefault(None, []).append(item_key)
+        self.syllables_by_deletion = {}
+        for syllable in self.items_by_syllable:
+            for variant in {syllable, *get_deletions(syllable)}:
+                self.syllables_by_deletion.setdefault(variant, set()).add(syllable)
+
+    @classmethod
+    def for_snapshot(cls, snapshot):
+        return snapshot.get_or_build("jyutping_index", lambda: cls(snapshot))
+
+    def get_similar_syllables(self, syllable):
+        # Every known syllable within one edit (insertion, deletion or substitution) of the syllable, with its distance.
+        candidates = set()
+        for variant in {syllable, *get_deletions(syllable)}:
+            candidates.update(self.syllables_by_deletion.get(variant, ()))
+        return [(candidate, distance) for candidate in candidates if (distance := get_edit_distance(syllable, candidate)) <= 1]
+
+    def lookup(self, jyutping, max_edits=1, wrong_tone_is_edit=True):
+        # Returns [(item_key, edits)] for every item whose whole jyutping matches, best first. Missing tones match any
+        # tone, and up to max_edits letters may be wrong; a wrong tone counts as an edit, or rules the item out if
+        # wrong_tone_is_edit is False.
+        query = parse_jyutping(jyutping)
+        if not query:
+            return []
+        edits_by_item_key = {}
+        # Depth first through the sequence trie, only following syllables close enough to the typed ones.
+        stack = [(self.sequence_trie, 0, 0)]
+        while stack:
+            node, position, edits = stack.pop()
+            if position == len(query):
+                for item_key in node.get(None, ()):
+                    tone_edits = sum(1 for (_syllable, tone), item_tone in zip(query, self.tones[item_key]) if tone and tone != item_tone)
+                    if tone_edits and not wrong_tone_is_edit:
+                        continue
+                    if (item_edits := edits + tone_edits) <= max_edits and item_edits < edits_by_item_key.get(item_key, max_edits + 1):
+                        edits_by_item_key[item_key] = item_edits
+                continue
+            syllable = query[position][0]
+            if syllable in node:
+                stack.append((node[syllable], position + 1, edits))
+            if edits < max_edits:
+                for candidate, distance in self.get_similar_syllables(syllable):
+                    if distance and candidate in node:
+                        stack.append((node[candidate], position + 1, edits + distance))
+        return sorted(edits_by_item_key.items(), key=lambda item: (item[1], item[0]))
@@ -0,0 +1,285 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client
+from django.test.utils import override_settings
+
+from wordsandsentences.distractors import DistractorIndex
+from wordsandsentences.jyutping import parse_jyutping
+from wordsandsentences.models import WORD_HAS_AUDIO, Topic, Word, Sentence
+from wordsandsentences.quiz import QuizGenerationError, QuizGenerator, QuizScheduler
+from wordsandsentences.snapshot import VocabularySnapshot, get_vocabulary_snapshot
+from wordsandsentences.utils import bump_vocabulary_version, get_vocabulary_version, update_syllables
+
+INITIALS = ["b", "p", "m", "f", "d", "t", "n", "l", "g", "k", "ng", "h", "gw", "kw", "w", "z", "c", "s", "j", ""]
+FINALS = [
+    "aa", "aai", "aau", "aam", "aan", "aang", "aap", "aat", "aak", "ai", "au", "am", "an", "ang", "ap", "at", "ak", "e", "ei", "eng",
+    "ek", "i", "iu", "im", "in", "ing", "ip", "it", "ik", "o", "oi", "ou", "on", "ong", "ot", "ok", "u", "ui", "un", "ung", "ut", "uk",
+    "oe", "oeng", "oek", "eoi", "eon", "eot", "yu", "yun", "yut",
+]
+SYLLABLES = [initial + final for initial in INITIALS for final in FINALS]
+QUESTION_TYPES = QuizScheduler.GENERAL_QUESTION_TYPES + QuizScheduler.WORD_QUESTION_TYPES + QuizScheduler.SENTENCE_QUESTION_TYPES
+
+
+class SyntheticVocabulary:
+    # Topics, words, sentences, responses and audio files made up from a fixed seed, so that every run (and every
+    # commit) benchmarks exactly the same data.
+    def __init__(self, item_count, seed):
+        self.random = random.Random(seed)
+        self.item_count = item_count
+
+    def make_jyutping(self, syllable_count):
+        return " ".join(f"{self.random.choice(SYLLABLES)}{self.random.randint(1, 6)}" for _i in range(syllable_count))
+
+    def make_cantonese(self, syllable_count):
+        return "".join(chr(0x4e00 + self.random.randrange(20000)) for _i in range(syllable_count))
+
+    def load(self, media_root):
+        word_count = self.item_count * 2 // 3
+        sentence_count = self.item_count - word_count
+        topics = Topic.objects.bulk_create(Topic(topic_name=f"topic {i}", colour="#eeeeee", loc=i * 10) for i in range(max(self.item_count // 100, 3)))
+        words = []
+        used_jyutping = set()
+        while len(words) < word_count:
+            topic = self.random.choice(topics)
+            syllable_count = self.random.choice([1, 1, 2, 2, 2, 3])
+            jyutping = self.make_jyutping(syllable_count)
+            if (topic.id, jyutping) in used_jyutping:
+                continue
+            used_jyutping.add((topic.id, jyutping))
+            audio_file = f"{jyutping}.mp3" if self.random.random() < 0.5 else None
+            words.append(Word(topic=topic, jyutping=jyutping, cantonese=self.make_cantonese(syllable_count), english=f"word {len(words)}", loc=len(words) * 10, audio_file=audio_file, syllable_count=syllable_count))
+        Word.objects.bulk_create(words, batch_size=1000)
+        update_syllables(Word, words, replace=False)
+        for audio_file in {word.audio_file.name for word in words if word.audio_file}:
+            with open(os.path.join(media_root, audio_file), "wb") as f:
+                f.write(b"\xff\xfb\x90\x00" + bytes(self.random.randrange(256) for _i in range(252)))
+        sentences = []
+        while len(sentences) < sentence_count:
+            topic = self.random.choice(topics)
+            sentence_words = self.random.sample(words, self.random.randint(2, 6))
+            jyutping = " ".join(word.jyutping for word in sentence_words) + ("?" if self.random.random() < 0.3 else "")
+            if (topic.id, jyutping) in used_jyutping:
+                continue
+            used_jyutping.add((topic.id, jyutping))
+            cantonese = "".join(word.cantonese for word in sentence_words)
+            sentences.append(Sentence(topic=topic, jyutping=jyutping, cantonese=cantonese, english=f"sentence {len(sentences)}", loc=len(sentences) * 10, syllable_count=len(parse_jyutping(jyutping))))
+        sentences = Sentence.objects.bulk_create(sentences, batch_size=1000)
+        update_syllables(Sentence, sentences, replace=False)
+        through = Sentence.response_to.through
+        responses = []
+        for i, sentence in enumerate(sentences[1:], start=1):
+            if self.random.random() < 0.3:
+                for response_to in self.random.sample(sentences[max(i - 20, 0):i], min(self.random.randint(1, 2), i)):
+                    responses.append(through(from_sentence_id=sentence.id, to_sentence_id=response_to.id))
+        through.objects.bulk_create(responses, batch_size=1000)
+        bump_vocabulary_version()
+
+    def make_import_files(self, name, row_count):
+        rows = ["topic,jyutping,cantonese,english,notes,is_sentence,response_to"]
+        sentence_jyutping = []
+        word_jyutping = []
+        for i in range(row_count):
+            if i % 3 == 2:
+                jyutping = f"{self.make_jyutping(self.random.randint(2, 6))} {i}"
+                response_to = self.random.choice(sentence_jyutping) if sentence_jyutping and self.random.random() < 0.3 else ""
+                rows.append(f"{name},{jyutping},{self.make_cantonese(2)},imported sentence {i},,yes,{response_to}")
+                sentence_jyutping.append(jyutping)
+            else:
+                jyutping = f"{self.make_jyutping(self.random.randint(1, 3))} {i}"
+                rows.append(f"{name},{jyutping},{self.make_cantonese(2)},imported word {i},,no,")
+                word_jyutping.append(jyutping)
+        words_csv = SimpleUploadedFile("words.csv", "\n".join(rows).encode("utf-8"), content_type="text/csv")
+        audio_files = [SimpleUploadedFile(f"{jyutping}.mp3", b"\xff\xfb\x90\x00", content_type="audio/mpeg") for jyutping in word_jyutping[:20]]
+        return words_csv, audio_files
+
+
+class QueryCounter:
+    # Counts queries through an execute wrapper, as the query log that CaptureQueriesContext reads is cleared at the start
+    # of every request made with the test client.
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(run, repeat):
+    # Times every run, counts the queries of the last one and then does one more run with tracemalloc on for the peak
+    # memory, as tracing slows everything down too much to time the same run.
+    durations = []
+    for run_index in range(repeat):
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            start = time.perf_counter()
+            result = run(run_index)
+            durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run(repeat)
+        _current, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    measurement = {
+        "median_seconds": round(statistics.median(durations), 6),
+        "min_seconds": round(min(durations), 6),
+        "max_seconds": round(max(durations), 6),
+        "queries": queries.count,
+        "peak_memory_bytes": peak_memory,
+    }
+    if (content := getattr(result, "content", None)) is not None:
+        measurement["status_code"] = result.status_code
+        measurement["response_bytes"] = len(content)
+    return measurement
+
+
+class Command(BaseCommand):
+    help = "Benchmarks quiz generation and the main views against synthetic vocabularies in a throwaway database, and writes a JSON report."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated numbers of words and sentences to benchmark with.")
+        parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each benchmark.")
+        parser.add_argument("--questions-per-type", type=int, default=20, help="Number of questions generated when timing each question type.")
+        parser.add_argument("--import-rows", type=int, default=300, help="Number of rows in the CSV used to benchmark the import.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="benchmark.json", help="Path of the JSON report.")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",")]
+        media_root = tempfile.mkdtemp(prefix="benchmark-media-")
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": self.get_git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "options": {key: options[key] for key in ("sizes", "repeat", "questions_per_type", "import_rows", "seed")},
+            "sizes": {},
+        }
+        # Everything runs against a test database, a private cache and a temporary media folder, and with the quiz pool
+        # off so that quizzes are really generated.
+        caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmark"},
+            "vocabulary": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmark-vocabulary", "TIMEOUT": None},
+        }
+        with override_settings(CACHES=caches, MEDIA_ROOT=media_root, IMPORT_JOBS_ROOT=os.path.join(media_root, "import_jobs"), EXPORTS_ROOT=os.path.join(media_root, "exports"), IMPORT_JOBS_IN_REQUEST=True, QUIZ_POOL_SIZE=0, ALLOWED_HOSTS=["testserver"]):
+            old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                for size in sizes:
+                    self.stdout.write(f"Benchmarking {size} items...")
+                    report["sizes"][str(size)] = self.benchmark_size(size, media_root, options)
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+                shutil.rmtree(media_root, ignore_errors=True)
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        self.stdout.write(f"Wrote {options['output']}.")
+
+    @staticmethod
+    def get_git_commit():
+        try:
+            return subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def benchmark_size(self, size, media_root, options):
+        repeat = options["repeat"]
+        call_command("flush", interactive=False, verbosity=0)
+        for file_name in os.listdir(media_root):
+            path = os.path.join(media_root, file_name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        vocabulary = SyntheticVocabulary(size, options["seed"])
+        start = time.perf_counter()
+        vocabulary.load(media_root)
+        results = {
+            "load_seconds": round(time.perf_counter() - start, 6),
+            "topics": Topic.objects.count(),
+            "words": Word.objects.count(),
+            "words_with_audio": Word.objects.filter(WORD_HAS_AUDIO).count(),
+            "sentences": Sentence.objects.count(),
+            "responses": Sentence.response_to.through.objects.count(),
+        }
+        version = get_vocabulary_version()
+        results["snapshot"] = measure(lambda run_index: VocabularySnapshot(version), repeat)
+        snapshot = get_vocabulary_snapshot()
+        results["scheduler"] = {f"include_audio={include_audio}": measure(lambda run_index: QuizScheduler(snapshot, include_audio), repeat) for include_audio in (True, False)}
+        results["distractor_index"] = measure(lambda run_index: DistractorIndex(snapshot), repeat)
+        results["question_types"] = self.benchmark_question_types(snapshot, options)
+
+        client = Client()
+        client.force_login(User.objects.create_user("benchmark", is_staff=True))
+        results["views"] = views = {}
+        for question_count in (10, 25, 50):
+            # A different seed for every run, as a repeated seed would be served from the quiz result cache.
+            views[f"quiz_{question_count}"] = measure(lambda run_index: client.post("/quiz/", {"question_count": question_count, "include_audio": "on", "seed": run_index}), repeat)
+        views["quiz_api_all_pages"] = measure(lambda run_index: self.fetch_all_quiz_pages(client, run_index), repeat)
+        views["flashcards"] = measure(lambda run_index: client.post("/flashcards/", {"topic": "", "randomise_order": "on", "words_sentences_both": "both", "starting_side": "jyutping"}), repeat)
+        views["index"] = measure(lambda run_index: client.get("/"), repeat)
+        for export_url in ("/words_export/", "/words_export/?format=xlsx"):
+            # A new vocabulary version for every run, as otherwise the export saved by the first run would be served.
+            views[export_url.strip("/").replace("/?format=", "_")] = measure(lambda run_index: self.fetch_export(client, export_url, bump_version=True), repeat)
+        # Save the CSV export of the current vocabulary version first, so that every run of this one is served from disk.
+        self.fetch_export(client, "/words_export/")
+        views["words_export_saved"] = measure(lambda run_index: self.fetch_export(client, "/words_export/"), repeat)
+        with contextlib.redirect_stdout(io.StringIO()):
+            views["import"] = measure(lambda run_index: self.post_import(client, vocabulary, run_index, options["import_rows"]), repeat)
+        return results
+
+    @staticmethod
+    def benchmark_question_types(snapshot, options):
+        results = {}
+        for question_type in QUESTION_TYPES:
+            generator = QuizGenerator(snapshot, True, options["seed"])
+            try:
+                start = time.perf_counter()
+                for _i in range(options["questions_per_type"]):
+                    generator.generate_question_dict(question_type)
+                results[question_type] = {"mean_seconds": round((time.perf_counter() - start) / options["questions_per_type"], 6)}
+            except (QuizGenerationError, IndexError) as e:
+                results[question_type] = {"error": str(e)}
+        return results
+
+    @staticmethod
+    def fetch_all_quiz_pages(client, run_index):
+        response = client.post("/quiz/api/", {"question_count": 50, "include_audio": "on"})
+        page_data = response.json()
+        while next_page_url := page_data["next_page_url"]:
+            response = client.get(next_page_url)
+            page_data = response.json()
+        return response
+
+    @staticmethod
+    def fetch_export(client, url, bump_version=False):
+        # Exports are streamed, so read the whole body for it to be timed and measured like the other views.
+        if bump_version:
+            bump_vocabulary_version()
+        response = client.get(url)
+        return HttpResponse(b"".join(response.streaming_content), status=response.status_code)
+
+    @staticmethod
+    def post_import(client, vocabulary, run_index, row_count):
+        words_csv, audio_files = vocabulary.make_import_files(f"imported topic {run_index}", row_count)
+        return client.post("/import/", {"words_csv": words_csv, "audio_files": audio_files})
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from wordsandsentences.forms import QuizStartForm
+from wordsandsentences.quiz import QuizGenerationError
+from wordsandsentences.quiz_pool import fill_quiz_pool, get_quiz_pool_size
+
+
+class Command(BaseCommand):
+    help = "Generates ready-made quizzes for every quiz length, with and without audio, so that quizzes start instantly."
+
+    def handle(self, *args, **options):
+        if not get_quiz_pool_size():
+            self.stdout.write("QUIZ_POOL_SIZE is 0, so there is no quiz pool to fill.")
+            return
+        for question_count, _label in QuizStartForm.base_fields["question_count"].choices:
+            for include_audio in (True, False):
+                try:
+                    filled = fill_quiz_pool(int(question_count), include_audio)
+                except QuizGenerationError as e:
+                    self.stdout.write(f"{question_count} questions, include_audio={include_audio}: {e}")
+                    continue
+                self.stdout.write(f"{question_count} questions, include_audio={include_audio}: generated {filled} quizzes.")
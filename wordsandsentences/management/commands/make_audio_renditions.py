@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from wordsandsentences.audio_renditions import make_audio_renditions
+from wordsandsentences.models import WORD_HAS_AUDIO, Word
+
+
+class Command(BaseCommand):
+    help = "Makes the compact audio renditions of words that do not have one yet, e.g. audio uploaded before renditions existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Remake the renditions of every word with audio.")
+
+    def handle(self, *args, **options):
+        words = Word.objects.filter(WORD_HAS_AUDIO)
+        if not options["all"]:
+            words = words.filter(audio_size__isnull=True)
+        word_ids = list(words.values_list("id", flat=True))
+        self.stdout.write(f"Processed the audio of {make_audio_renditions(word_ids)} of {len(word_ids)} words.")
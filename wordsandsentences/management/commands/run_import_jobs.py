@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from wordsandsentences.import_jobs import fail_stale_import_jobs, run_import_job
+from wordsandsentences.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = "Runs every queued import job in the foreground, e.g. ones left behind when the web server restarted, and marks running jobs that have stopped making progress as failed."
+
+    def handle(self, *args, **options):
+        if stale_count := fail_stale_import_jobs():
+            self.stdout.write(f"Marked {stale_count} stalled import jobs as failed.")
+        for job_id in ImportJob.objects.filter(status="queued").order_by("created_at").values_list("id", flat=True):
+            run_import_job(job_id)
+            job = ImportJob.objects.get(pk=job_id)
+            self.stdout.write(f"Import {job_id}: {job.status}{f' ({job.error})' if job.error else ''}.")
@@ -0,0 +1,76 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from wordsandsentences.jyutping import get_syllable_rows
+
+
+def parse_existing_jyutping(apps, schema_editor):
+    for model_name, syllable_model_name in [("Word", "WordSyllable"), ("Sentence", "SentenceSyllable")]:
+        model_class = apps.get_model("wordsandsentences", model_name)
+        syllable_class = apps.get_model("wordsandsentences", syllable_model_name)
+        item_field = model_name.lower()
+        items = list(model_class.objects.all())
+        syllables = []
+        for item in items:
+            rows = get_syllable_rows(item.jyutping)
+            item.syllable_count = len(rows)
+            syllables += [syllable_class(**{item_field: item}, position=position, initial=initial, final=final, tone=tone) for position, initial, final, tone in rows]
+        model_class.objects.bulk_update(items, ["syllable_count"], batch_size=1000)
+        syllable_class.objects.bulk_create(syllables, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0006_topic_colour'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentence',
+            name='syllable_count',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='syllable_count',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0),
+        ),
+        migrations.CreateModel(
+            name='SentenceSyllable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('initial', models.CharField(blank=True, max_length=2)),
+                ('final', models.CharField(max_length=100)),
+                ('tone', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('sentence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='syllables', to='wordsandsentences.sentence')),
+            ],
+            options={
+                'ordering': ['position'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['tone'], name='sentencesyllable_tone_idx'), models.Index(fields=['initial', 'final'], name='sentencesyllable_sound_idx')],
+                'unique_together': {('sentence', 'position')},
+            },
+        ),
+        migrations.CreateModel(
+            name='WordSyllable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('initial', models.CharField(blank=True, max_length=2)),
+                ('final', models.CharField(max_length=100)),
+                ('tone', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='syllables', to='wordsandsentences.word')),
+            ],
+            options={
+                'ordering': ['position'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['tone'], name='wordsyllable_tone_idx'), models.Index(fields=['initial', 'final'], name='wordsyllable_sound_idx')],
+                'unique_together': {('word', 'position')},
+            },
+        ),
+        migrations.RunPython(parse_existing_jyutping, migrations.RunPython.noop),
+    ]
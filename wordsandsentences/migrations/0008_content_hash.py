@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+from wordsandsentences.models import get_content_hash
+
+
+def hash_existing_content(apps, schema_editor):
+    for model_name in ("Word", "Sentence"):
+        model_class = apps.get_model("wordsandsentences", model_name)
+        items = list(model_class.objects.only("id", "cantonese", "english", "notes"))
+        for item in items:
+            item.content_hash = get_content_hash(item.cantonese, item.english, item.notes)
+        model_class.objects.bulk_update(items, ["content_hash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0007_syllables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentence',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.RunPython(hash_existing_content, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:46
+
+import django.db.models.deletion
+import wordsandsentences.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0008_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('stage', models.CharField(blank=True, max_length=50)),
+                ('delete_missing', models.BooleanField(default=False)),
+                ('rows_total', models.PositiveIntegerField(default=0)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('report', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportJobFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('topics_csv', 'CSV of topics'), ('words_csv', 'CSV of words and sentences'), ('audio_file', 'Audio file')], max_length=10)),
+                ('name', models.CharField(max_length=255)),
+                ('file', models.FileField(storage=wordsandsentences.models.get_import_job_storage, upload_to='%Y/%m/%d')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='wordsandsentences.importjob')),
+            ],
+        ),
+    ]
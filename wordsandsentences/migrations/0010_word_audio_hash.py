@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0009_import_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='audio_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
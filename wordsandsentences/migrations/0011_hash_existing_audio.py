@@ -0,0 +1,25 @@
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+from wordsandsentences.models import get_file_hash
+
+
+def hash_existing_audio(apps, schema_editor):
+    Word = apps.get_model("wordsandsentences", "Word")
+    words = list(Word.objects.exclude(audio_file="").exclude(audio_file__isnull=True).filter(audio_hash="").only("id", "audio_file"))
+    for word in words:
+        if default_storage.exists(word.audio_file.name):
+            with default_storage.open(word.audio_file.name) as audio_file:
+                word.audio_hash = get_file_hash(audio_file)
+    Word.objects.bulk_update(words, ["audio_hash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0010_word_audio_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(hash_existing_audio, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0011_hash_existing_audio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='audio_duration',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='audio_rendition',
+            field=models.FileField(blank=True, editable=False, null=True, upload_to='renditions/'),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='audio_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-18 08:03
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wordsandsentences', '0012_word_audio_rendition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sentence',
+            index=models.Index(fields=['topic', 'loc'], name='sentence_topic_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['loc'], name='topic_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['topic', 'loc'], name='word_topic_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(django.db.models.functions.text.Lower('jyutping'), name='word_jyutping_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(condition=models.Q(('audio_file__gt', '')), fields=['audio_size'], name='word_has_audio_idx'),
+        ),
+    ]
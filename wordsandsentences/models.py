@@ -1,4 +1,12 @@
-from django.db import models
+import hashlib
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .jyutping import parse_jyutping
 
 # Create your models here.
 
@@ -10,11 +18,30 @@ class Topic(models.Model):
 
     class Meta:
         ordering = ["loc"]
+        indexes = [models.Index(fields=["loc"], name="topic_loc_idx")]
 
     def __str__(self):
         return self.topic_name.capitalize()
 
 
+def get_content_hash(cantonese, english, notes):
+    # Digest of the fields that an import can change, so that rows can be compared with a CSV without loading them.
+    return hashlib.md5("\x1f".join((cantonese, english, notes)).encode()).hexdigest()
+
+
+def get_file_hash(file):
+    file_hash = hashlib.md5()
+    for chunk in file.chunks():
+        file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_audio_url(audio_file, audio_hash):
+    # The hash in the URL changes whenever the audio does, so that browsers can keep each URL for good.
+    url = default_storage.url(audio_file)
+    return f"{url}?v={audio_hash}" if audio_hash else url
+
+
 class LearningItem(models.Model):
     topic = models.ForeignKey(Topic, on_delete=models.deletion.CASCADE)
     jyutping = models.CharField(max_length=100)
@@ -22,23 +49,148 @@ class LearningItem(models.Model):
     english = models.CharField(max_length=100)
     notes = models.CharField(blank=True, max_length=200)
     loc = models.IntegerField()
+    syllable_count = models.PositiveSmallIntegerField(default=0, db_index=True)
+    content_hash = models.CharField(blank=True, max_length=32, editable=False)
 
     class Meta:
         abstract = True
         ordering = ["loc"]
         unique_together = [["topic", "jyutping"]]
+        indexes = [models.Index(fields=["topic", "loc"], name="%(class)s_topic_loc_idx")]
 
     def __str__(self):
         return f"{self.jyutping} ({self.english})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # The topic the item was loaded from, which changes too if the item is moved to another topic.
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_topic_id = instance.__dict__.get("topic_id")
+        return instance
     
+    def save(self, *args, **kwargs):
+        self.syllable_count = len(parse_jyutping(self.jyutping))
+        self.content_hash = get_content_hash(self.cantonese, self.english, self.notes)
+        super().save(*args, **kwargs)
+
     @property
     def cantonese_and_jyutping(self):
         return f"{self.jyutping}{f' ({self.cantonese})' if self.cantonese else ''}"
 
 
+# Words with an audio file. Queries for them should filter on this, rather than excluding blank and null file names, so
+# that the database can match them to the partial index below.
+WORD_HAS_AUDIO = Q(audio_file__gt="")
+
+
 class Word(LearningItem):
     audio_file = models.FileField(blank=True, null=True)
+    # Digest of the audio file's content, worked out when a file is uploaded or first saved.
+    audio_hash = models.CharField(blank=True, max_length=32, editable=False)
+
+    # The compact, normalised copy of the audio that is served instead of it, made in the background (see
+    # audio_renditions.py), and the duration and size of what is served.
+    audio_rendition = models.FileField(blank=True, null=True, editable=False, upload_to="renditions/")
+    audio_duration = models.FloatField(blank=True, null=True, editable=False)
+    audio_size = models.PositiveIntegerField(blank=True, null=True, editable=False)
+
+    class Meta(LearningItem.Meta):
+        indexes = [
+            *LearningItem.Meta.indexes,
+            # Audio files are matched to words by their jyutping, whatever its case.
+            models.Index(Lower("jyutping"), name="word_jyutping_lower_idx"),
+            models.Index(fields=["audio_size"], condition=WORD_HAS_AUDIO, name="word_has_audio_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.audio_file or not self.audio_file._committed:
+            # The rendition of the old audio is removed once the new audio has been saved.
+            if old_rendition_name := self.audio_rendition.name:
+                storage = self.audio_rendition.storage
+                transaction.on_commit(lambda: storage.delete(old_rendition_name))
+            self.audio_rendition = None
+            self.audio_duration = None
+            self.audio_size = None
+        if not self.audio_file:
+            self.audio_hash = ""
+        elif not self.audio_file._committed:
+            self.audio_hash = get_file_hash(self.audio_file)
+        elif not self.audio_hash and self.audio_file.storage.exists(self.audio_file.name):
+            with self.audio_file.open("rb"):
+                self.audio_hash = get_file_hash(self.audio_file)
+        super().save(*args, **kwargs)
+
+    @property
+    def audio_url(self):
+        if not self.audio_file:
+            return None
+        return get_audio_url(self.audio_rendition.name or self.audio_file.name, self.audio_hash)
 
 
 class Sentence(LearningItem):
-    response_to = models.ManyToManyField("self", symmetrical=False, blank=True, related_name="responses", help_text="Hold Ctrl to select multiple.")
\ No newline at end of file
+    response_to = models.ManyToManyField("self", symmetrical=False, blank=True, related_name="responses", help_text="Hold Ctrl to select multiple.")
+
+# One row per syllable of a word or sentence's jyutping, kept up to date on save and on import.
+class Syllable(models.Model):
+    position = models.PositiveSmallIntegerField()
+    initial = models.CharField(blank=True, max_length=2)
+    final = models.CharField(max_length=100)
+    tone = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    class Meta:
+        abstract = True
+        ordering = ["position"]
+        indexes = [
+            models.Index(fields=["tone"], name="%(class)s_tone_idx"),
+            models.Index(fields=["initial", "final"], name="%(class)s_sound_idx"),
+        ]
+
+
+class WordSyllable(Syllable):
+    word = models.ForeignKey(Word, on_delete=models.deletion.CASCADE, related_name="syllables")
+
+    class Meta(Syllable.Meta):
+        unique_together = [["word", "position"]]
+
+
+class SentenceSyllable(Syllable):
+    sentence = models.ForeignKey(Sentence, on_delete=models.deletion.CASCADE, related_name="syllables")
+
+    class Meta(Syllable.Meta):
+        unique_together = [["sentence", "position"]]
+
+
+def get_import_job_storage():
+    # Uploads waiting to be imported are kept out of MEDIA_ROOT, so they are never served.
+    return FileSystemStorage(location=settings.IMPORT_JOBS_ROOT)
+
+
+# An import handed over from ImportView to a background worker; the uploads are kept until the job has run.
+class ImportJob(models.Model):
+    STATUS_CHOICES = [("queued", "Queued"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    stage = models.CharField(blank=True, max_length=50)
+    delete_missing = models.BooleanField(default=False)
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    report = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.status})"
+
+
+class ImportJobFile(models.Model):
+    KIND_CHOICES = [("topics_csv", "CSV of topics"), ("words_csv", "CSV of words and sentences"), ("audio_file", "Audio file")]
+
+    job = models.ForeignKey(ImportJob, on_delete=models.deletion.CASCADE, related_name="files")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    file = models.FileField(storage=get_import_job_storage, upload_to="%Y/%m/%d")
@@ -0,0 +1,470 @@
+import random
+from array import array
+
+from .distractors import DistractorIndex
+from .snapshot import iter_random_sample
+
+
+def new_quiz_seed():
+    return random.getrandbits(63)
+
+
+class QuizGenerationError(Exception):
+    pass
+
+
+def has_distinct_items(table, pool, count, exclude_indexes=(), exclude_english=(), exclude_jyutping=()):
+    # Whether the pool holds at least `count` items that all have different English and different Jyutping (and that are
+    # not excluded), i.e. enough for answers that can be told apart.
+    seen_english = set(exclude_english)
+    seen_jyutping = set(exclude_jyutping)
+    found = 0
+    for index in pool:
+        if index not in exclude_indexes and table.english[index] not in seen_english and table.jyutping[index] not in seen_jyutping:
+            seen_english.add(table.english[index])
+            seen_jyutping.add(table.jyutping[index])
+            if (found := found + 1) >= count:
+                return True
+    return False
+
+
+def has_incorrect_words(table, pool, correct_index, exclude_indexes=()):
+    return has_distinct_items(table, pool, 3, exclude_indexes=exclude_indexes, exclude_english=(table.english[correct_index],), exclude_jyutping=(table.jyutping[correct_index],))
+
+
+# Works out up front which question types can be generated from the snapshot, and which items each one can ask about,
+# then allocates the question types for a whole quiz in one pass so that every question is generated at the first attempt.
+class QuizScheduler:
+    GENERAL_QUESTION_TYPES = ("j_to_e", "e_to_j_buttons", "e_to_j_text")
+    WORD_QUESTION_TYPES = ("audio_to_tone", "audio_to_not_tone", "topic_to_not_linked_word")
+    SENTENCE_QUESTION_TYPES = (
+        "sentence_to_response_buttons", "sentence_to_response_text", "response_to_sentence_buttons", "response_to_sentence_text",
+        "sentence_to_missing_word_buttons", "sentence_to_missing_word_text", "words_to_ordered_sentence",
+    )
+
+    @classmethod
+    def for_snapshot(cls, snapshot, include_audio):
+        # Nothing here depends on the quiz being generated, so one scheduler is shared by every quiz of a vocabulary version.
+        return snapshot.get_or_build(("scheduler", include_audio), lambda: cls(snapshot, include_audio))
+
+    def __init__(self, snapshot, include_audio):
+        self.snapshot = snapshot
+        self.include_audio = include_audio
+        words = snapshot.words
+        sentences = snapshot.sentences
+        word_count = len(words)
+        sentence_count = len(sentences)
+        all_words = range(word_count)
+        all_sentences = range(sentence_count)
+        audio_words = snapshot.word_pool(audio_only=True)
+        # Items that can be the correct answer of a question with buttons, as there are three other items to use as distractors.
+        self.button_word_pool = array("q", (index for index in all_words if has_incorrect_words(words, all_words, index)))
+        self.button_sentence_pool = array("q", (index for index in all_sentences if has_incorrect_words(sentences, all_sentences, index)))
+        self.audio_words_have_distractors = has_distinct_items(words, audio_words, 4)
+        self.audio_to_tone_word_pool = array("q", (index for index in snapshot.word_pool(audio_only=True, single_jyutping_word_only=True) if words.tones[index])) if include_audio else array("q")
+        # Tones whose words with audio can be the distractors of an audio_to_not_tone question about a given word.
+        self.distractor_tones = {}
+        if include_audio:
+            for index in audio_words:
+                if tones := [tone for tone in "123456" if tone not in words.tones[index] and has_incorrect_words(words, snapshot.word_pool(audio_only=True, include_tone=tone), index)]:
+                    self.distractor_tones[index] = tones
+        self.audio_to_not_tone_word_pool = array("q", sorted(self.distractor_tones))
+        self.topic_ids = array("q", (topic_id for topic_id in snapshot.topic_ids_with_words(3) if has_distinct_items(words, snapshot.word_pool(topic_id=topic_id), 3)))
+        # A topic with five distinct words keeps at least three of them whatever the correct answer shares its English or
+        # Jyutping with, so only words tested against smaller topics need checking one by one.
+        large_topic_ids = {topic_id for topic_id in self.topic_ids if has_distinct_items(words, snapshot.word_pool(topic_id=topic_id), 5)}
+        self.topic_word_pool = array("q", (
+            index for index in all_words
+            if any(topic_id != words.topic_ids[index] and (topic_id in large_topic_ids or has_incorrect_words(words, snapshot.word_pool(topic_id=topic_id), index)) for topic_id in self.topic_ids)
+        ))
+        # For each sentence that a response buttons question can ask about, the linked sentences that can be its correct answer.
+        self.response_button_answers = {}
+        for links_name in ("responses", "response_to"):
+            links = getattr(snapshot, links_name)
+            self.response_button_answers[links_name] = answers = {}
+            for index in snapshot.linked_sentence_pool(links_name, max_link_count=sentence_count - 4):
+                exclude_indexes = set(links[index]) | {index}
+                if linked_indexes := tuple(linked_index for linked_index in links[index] if has_incorrect_words(sentences, all_sentences, linked_index, exclude_indexes=exclude_indexes)):
+                    answers[index] = linked_indexes
+        self.response_button_pools = {links_name: array("q", answers) for links_name, answers in self.response_button_answers.items()}
+        self.single_words_have_distractors = has_distinct_items(words, snapshot.word_pool(single_jyutping_word_only=True), 4)
+        # The most items a single e_to_j_text question can use up, as it uses every item sharing the English of the correct answer.
+        self.max_english_group_size = max((len(indexes) for table in (words, sentences) for indexes in table.indexes_by_english.values()), default=1)
+        # The number of items that each question type can ask about; 0 means that the question type cannot be generated.
+        self.pool_sizes = {
+            "j_to_e": len(self.button_word_pool) + len(self.button_sentence_pool),
+            "e_to_j_buttons": len(self.button_word_pool) + len(self.button_sentence_pool),
+            "e_to_j_text": word_count + sentence_count,
+            "audio_to_tone": len(self.audio_to_tone_word_pool),
+            "audio_to_not_tone": len(self.audio_to_not_tone_word_pool),
+            "topic_to_not_linked_word": len(self.topic_word_pool),
+            "sentence_to_response_buttons": len(self.response_button_pools["responses"]),
+            "sentence_to_response_text": len(snapshot.linked_sentence_pool("responses")),
+            "response_to_sentence_buttons": len(self.response_button_pools["response_to"]),
+            "response_to_sentence_text": len(snapshot.linked_sentence_pool("response_to")),
+            "sentence_to_missing_word_buttons": sentence_count if self.single_words_have_distractors else 0,
+            "sentence_to_missing_word_text": sentence_count,
+            "words_to_ordered_sentence": sentence_count,
+        }
+        self.weights = self.get_question_type_weights()
+
+    def get_question_type_weights(self):
+        # The share of each question type in a quiz: general questions make up 41%, and the rest is split between word and
+        # sentence questions according to how many words and sentences there are.
+        word_count = len(self.snapshot.words)
+        sentence_count = len(self.snapshot.sentences)
+        if self.include_audio:
+            word_portion = word_count * 0.25 / (word_count * 0.25 + sentence_count) if word_count else 0
+        else:
+            word_portion = word_count * 0.075 / (word_count * 0.075 + sentence_count) if word_count else 0
+        sentences_with_responses_portion = len(self.snapshot.response_to) / sentence_count if sentence_count else 0
+        response_portion = min(sentences_with_responses_portion / 2, 1 - word_portion)
+        sentence_portion = 1 - word_portion - response_portion
+        weights = {
+            "j_to_e": 0.41 * 0.4,
+            "e_to_j_buttons": 0.41 * 0.33,
+            "e_to_j_text": 0.41 * 0.27,
+            "sentence_to_response_buttons": 0.59 * response_portion * 0.22,
+            "sentence_to_response_text": 0.59 * response_portion * 0.28,
+            "response_to_sentence_buttons": 0.59 * response_portion * 0.28,
+            "response_to_sentence_text": 0.59 * response_portion * 0.22,
+            "sentence_to_missing_word_buttons": 0.59 * sentence_portion * 0.33,
+            "sentence_to_missing_word_text": 0.59 * sentence_portion * 0.31,
+            "words_to_ordered_sentence": 0.59 * sentence_portion * 0.36,
+        }
+        if self.include_audio:
+            weights.update({"audio_to_tone": 0.59 * word_portion * 0.37, "audio_to_not_tone": 0.59 * word_portion * 0.33, "topic_to_not_linked_word": 0.59 * word_portion * 0.3})
+        else:
+            weights["topic_to_not_linked_word"] = 0.59 * word_portion
+        return weights
+
+    def get_cost(self, question_type):
+        return self.max_english_group_size if question_type == "e_to_j_text" else 1
+
+    def get_capacities(self, used_words, used_sentences, used_items):
+        # How many more times each question type can be used, assuming the worst case where every item used so far
+        # came out of that question type's own pool.
+        capacities = {}
+        for question_type, pool_size in self.pool_sizes.items():
+            if question_type in self.GENERAL_QUESTION_TYPES:
+                remaining = pool_size - used_items
+            elif question_type in self.WORD_QUESTION_TYPES:
+                remaining = pool_size - used_words
+            else:
+                remaining = pool_size - used_sentences
+            capacities[question_type] = max(remaining // self.get_cost(question_type), 0)
+        return capacities
+
+    def allocate(self, question_count, rng=random):
+        question_types = []
+        used_words = 0
+        used_sentences = 0
+        used_items = 0
+        for _question_number in range(question_count):
+            capacities = self.get_capacities(used_words, used_sentences, used_items)
+            feasible_types = [question_type for question_type, weight in self.weights.items() if weight and capacities[question_type]]
+            if not feasible_types:
+                raise QuizGenerationError("Quiz generation failed; try adding more words to the database.")
+            question_type = rng.choices(feasible_types, weights=[self.weights[question_type] for question_type in feasible_types])[0]
+            cost = self.get_cost(question_type)
+            used_items += cost
+            if question_type in self.GENERAL_QUESTION_TYPES:
+                # General questions may use either a word or a sentence, so count them against both.
+                used_words += cost
+                used_sentences += cost
+            elif question_type in self.WORD_QUESTION_TYPES:
+                used_words += cost
+            else:
+                used_sentences += cost
+            question_types.append(question_type)
+        return question_types
+
+
+class QuizGenerator:
+    # All randomness comes from the generator's own Random instance, so the same seed, vocabulary version, question
+    # count and audio setting always give the same quiz.
+    def __init__(self, snapshot, include_audio, seed=None):
+        self.snapshot = snapshot
+        self.include_audio = include_audio
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.used_word_indexes = set()
+        self.used_sentence_indexes = set()
+        self.question_types = []
+        self.generated_count = 0
+        self.scheduler = QuizScheduler.for_snapshot(snapshot, include_audio)
+
+    def iter_unused_words_and_sentences(self, word_pool, sentence_pool):
+        word_pool_size = len(word_pool)
+        for combined_index in iter_random_sample(range(word_pool_size + len(sentence_pool)), self.random):
+            if combined_index < word_pool_size:
+                if (word_index := word_pool[combined_index]) not in self.used_word_indexes:
+                    yield word_index, False
+            elif (sentence_index := sentence_pool[combined_index - word_pool_size]) not in self.used_sentence_indexes:
+                yield sentence_index, True
+
+    def iter_unused(self, pool, is_sentence):
+        used_indexes = self.used_sentence_indexes if is_sentence else self.used_word_indexes
+        for index in iter_random_sample(pool, self.random):
+            if index not in used_indexes:
+                yield index
+
+    @staticmethod
+    def choose(candidates):
+        # A pool can run out when a quiz carried on from its state finds that the vocabulary has shrunk since it started.
+        if (candidate := next(candidates, None)) is None:
+            raise QuizGenerationError("Quiz generation failed; try adding more words to the database.")
+        return candidate
+
+    @staticmethod
+    def choose_with_incorrect_words(candidates, get_incorrect_words):
+        # Duplicated English or Jyutping can leave some candidates without three distinct incorrect answers; move on to the
+        # next candidate when that happens rather than failing the question.
+        for candidate in candidates:
+            try:
+                return candidate, get_incorrect_words(candidate)
+            except IndexError:
+                continue
+        raise QuizGenerationError("Quiz generation failed; try adding more words to the database.")
+
+    def choose_from_pool(self, table, pool, exclude_english, exclude_jyutping, exclude_indexes, in_order=False):
+        # Rejection sampling: each candidate is checked against the exclusions with constant time set lookups.
+        for index in pool if in_order else iter_random_sample(pool, self.random):
+            if index not in exclude_indexes and table.english[index] not in exclude_english and table.jyutping[index] not in exclude_jyutping:
+                return index
+        raise IndexError(f"No {'sentences' if table.is_sentence else 'words'} left to choose from.")
+
+    def draw_incorrect_words(self, table, pool, exclude_english, exclude_jyutping, exclude_indexes, in_order=False, count=3):
+        exclude_english = set(exclude_english)
+        exclude_jyutping = set(exclude_jyutping)
+        incorrect_indexes = []
+        for _i in range(count):
+            incorrect_index = self.choose_from_pool(table, pool, exclude_english, exclude_jyutping, exclude_indexes, in_order=in_order)
+            exclude_english.add(table.english[incorrect_index])
+            exclude_jyutping.add(table.jyutping[incorrect_index])
+            incorrect_indexes.append(incorrect_index)
+        return incorrect_indexes
+
+    def draw_similar_words(self, correct_index, exclude_english, exclude_jyutping, exclude_indexes, audio_only):
+        # Up to three of the words that are easiest to mistake for the correct one, adding them to the exclusions.
+        words = self.snapshot.words
+        similar_indexes = []
+        for index in iter_random_sample(DistractorIndex.for_snapshot(self.snapshot).candidates[correct_index], self.random):
+            if index not in exclude_indexes and (not audio_only or words.audio_urls[index]) and words.english[index] not in exclude_english and words.jyutping[index] not in exclude_jyutping:
+                exclude_english.add(words.english[index])
+                exclude_jyutping.add(words.jyutping[index])
+                similar_indexes.append(index)
+                if len(similar_indexes) == 3:
+                    break
+        return similar_indexes
+
+    def get_incorrect_words(self, correct_index, is_sentence, exclude_jyutping=(), exclude_indexes=(), include_tone=None, audio_only=False, single_jyutping_word_only=False, topic_id=None, similar=False):
+        table = self.snapshot.table(is_sentence)
+        if is_sentence:
+            pool = range(len(table))
+        else:
+            pool = self.snapshot.word_pool(audio_only=audio_only, single_jyutping_word_only=single_jyutping_word_only, include_tone=include_tone, topic_id=topic_id)
+        exclude_english = set()
+        exclude_jyutping = set(exclude_jyutping)
+        if correct_index is not None:
+            exclude_english.add(table.english[correct_index])
+            exclude_jyutping.add(table.jyutping[correct_index])
+        try:
+            # Similar words are only drawn for the word questions whose pool is every word, or every word with audio.
+            similar_indexes = self.draw_similar_words(correct_index, set(exclude_english), set(exclude_jyutping), exclude_indexes, audio_only) if similar and not is_sentence else []
+            return similar_indexes + self.draw_incorrect_words(
+                table, pool, exclude_english | {table.english[index] for index in similar_indexes}, exclude_jyutping | {table.jyutping[index] for index in similar_indexes},
+                exclude_indexes, count=3 - len(similar_indexes),
+            )
+        except IndexError:
+            # With duplicated English or Jyutping a random draw can rule out the only remaining options, whereas taking the
+            # pool in order finds the same distractors that the scheduler found when it checked this question was possible.
+            incorrect_indexes = self.draw_incorrect_words(table, pool, exclude_english, exclude_jyutping, exclude_indexes, in_order=True)
+            self.random.shuffle(incorrect_indexes)
+            return incorrect_indexes
+
+    def use(self, index, is_sentence):
+        if is_sentence:
+            self.used_sentence_indexes.add(index)
+        else:
+            self.used_word_indexes.add(index)
+
+    def get_audio_url(self, index, is_sentence):
+        return self.snapshot.words.audio_urls[index] if not is_sentence and self.include_audio else None
+
+    def generate_question_dict(self, question_type):
+        snapshot = self.snapshot
+        scheduler = self.scheduler
+        words = snapshot.words
+        sentences = snapshot.sentences
+        match question_type:
+            case "j_to_e":
+                candidates = self.iter_unused_words_and_sentences(scheduler.button_word_pool, scheduler.button_sentence_pool)
+                (correct_index, is_sentence), incorrect_indexes = self.choose_with_incorrect_words(candidates, lambda candidate: self.get_incorrect_words(*candidate, similar=True))
+                table = snapshot.table(is_sentence)
+                self.use(correct_index, is_sentence)
+                question_audio_url = self.get_audio_url(correct_index, is_sentence)
+                if question_audio_url and self.random.randint(0, 1) == 1:
+                    question_text = f"What is the English translation of this Cantonese word?"
+                else:
+                    question_text = f"What is the English translation of '{table.cantonese_and_jyutping(correct_index)}'?"
+                options = [{"text": table.english[index], "cantonese": None, "audio_url": None, "hide_text": False} for index in incorrect_indexes + [correct_index]]
+                self.random.shuffle(options)
+                return {"question_text": question_text, "question_audio_url": question_audio_url, "correct": table.english[correct_index], "options": options, "ordering_options": None}
+            case "e_to_j_buttons":
+                def get_incorrect_words(candidate):
+                    correct_index, is_sentence = candidate
+                    option_audio_only = bool(self.get_audio_url(correct_index, is_sentence)) and scheduler.audio_words_have_distractors and self.random.randint(0, 1) == 1
+                    return option_audio_only, self.get_incorrect_words(correct_index, is_sentence, audio_only=option_audio_only, similar=True)
+
+                candidates = self.iter_unused_words_and_sentences(scheduler.button_word_pool, scheduler.button_sentence_pool)
+                (correct_index, is_sentence), (option_audio_only, incorrect_indexes) = self.choose_with_incorrect_words(candidates, get_incorrect_words)
+                table = snapshot.table(is_sentence)
+                self.use(correct_index, is_sentence)
+                if option_audio_only:
+                    question_text = f"What is the Cantonse word for '{table.english[correct_index]}'?"
+                else:
+                    question_text = f"What is the Jyutping representation of '{table.english[correct_index]}'?"
+                options = [{"text": table.jyutping[index], "cantonese": table.cantonese[index], "audio_url": self.get_audio_url(index, is_sentence), "hide_text": option_audio_only} for index in incorrect_indexes + [correct_index]]
+                self.random.shuffle(options)
+                return {"question_text": question_text, "question_audio_url": None, "correct": table.jyutping[correct_index], "options": options, "ordering_options": None}
+            case "e_to_j_text":
+                correct_index, is_sentence = self.choose(self.iter_unused_words_and_sentences(range(len(words)), range(len(sentences))))
+                table = snapshot.table(is_sentence)
+                english = table.english[correct_index]
+                correct_indexes = table.indexes_by_english[english]
+                for index in correct_indexes:
+                    self.use(index, is_sentence)
+                correct_list = [table.jyutping[index] for index in correct_indexes]
+                question_text = f"What is the Jyutping representation of '{english}'?"
+                return {"question_text": question_text, "question_audio_url": None, "correct": correct_list, "options": None, "ordering_options": None}
+            case "audio_to_tone":
+                index = self.choose(self.iter_unused(scheduler.audio_to_tone_word_pool, False))
+                self.use(index, False)
+                question_audio_url = words.audio_urls[index]
+                question_text = f"What tone is used for this word?"
+                options = [{"text": str(tone_num), "cantonese": None, "audio_url": None, "hide_text": False} for tone_num in [1, 2, 3, 4, 5, 6]]
+                return {"question_text": question_text, "question_audio_url": question_audio_url, "correct": words.tones[index], "options": options, "ordering_options": None}
+            case "audio_to_not_tone":
+                def get_incorrect_words(correct_index):
+                    excluded_tone = self.random.choice(scheduler.distractor_tones[correct_index])
+                    return excluded_tone, self.get_incorrect_words(correct_index, False, include_tone=excluded_tone, audio_only=True)
+
+                correct_index, (excluded_tone, incorrect_indexes) = self.choose_with_incorrect_words(self.iter_unused(scheduler.audio_to_not_tone_word_pool, False), get_incorrect_words)
+                self.use(correct_index, False)
+                question_text = f"Which of these does not use tone {excluded_tone}?"
+                options = [{"text": words.jyutping[index], "cantonese": words.cantonese[index], "audio_url": words.audio_urls[index], "hide_text": True} for index in incorrect_indexes + [correct_index]]
+                self.random.shuffle(options)
+                return {"question_text": question_text, "question_audio_url": None, "correct": words.jyutping[correct_index], "options": options, "ordering_options": None}
+            case "topic_to_not_linked_word":
+                # Only include topics with at least three words.
+                def get_incorrect_words(candidate):
+                    topic_id, correct_index = candidate
+                    option_audio_only = bool(self.get_audio_url(correct_index, False)) and self.random.randint(0, 1) == 1 and len(snapshot.word_pool(audio_only=True, topic_id=topic_id)) >= 3
+                    try:
+                        return option_audio_only, self.get_incorrect_words(correct_index, False, topic_id=topic_id, audio_only=option_audio_only)
+                    except IndexError:
+                        if not option_audio_only:
+                            raise
+                        return False, self.get_incorrect_words(correct_index, False, topic_id=topic_id)
+
+                candidates = ((topic_id, correct_index) for correct_index in self.iter_unused(scheduler.topic_word_pool, False) for topic_id in iter_random_sample(scheduler.topic_ids, self.random) if topic_id != words.topic_ids[correct_index])
+                (topic_id, correct_index), (option_audio_only, incorrect_indexes) = self.choose_with_incorrect_words(candidates, get_incorrect_words)
+                self.use(correct_index, False)
+                question_text = f"Which of these is not associated with the topic '{snapshot.topic_names[topic_id]}'?"
+                options = [{"text": words.jyutping[index], "cantonese": words.cantonese[index], "audio_url": self.get_audio_url(index, False), "hide_text": option_audio_only} for index in incorrect_indexes + [correct_index]]
+                self.random.shuffle(options)
+                return {"question_text": question_text, "question_audio_url": None, "correct": words.jyutping[correct_index], "options": options, "ordering_options": None}
+            case "sentence_to_response_buttons" | "response_to_sentence_buttons":
+                links_name = "responses" if question_type == "sentence_to_response_buttons" else "response_to"
+                links = getattr(snapshot, links_name)
+                pool = scheduler.response_button_pools[links_name]
+
+                def get_incorrect_words(question_index):
+                    correct_index = self.random.choice(scheduler.response_button_answers[links_name][question_index])
+                    return correct_index, self.get_incorrect_words(correct_index, True, exclude_indexes=set(links[question_index]) | {question_index})
+
+                question_index, (correct_index, incorrect_indexes) = self.choose_with_incorrect_words(self.iter_unused(pool, True), get_incorrect_words)
+                self.use(question_index, True)
+                if question_type == "sentence_to_response_buttons":
+                    question_text = f"Which of these would be a response to '{sentences.cantonese_and_jyutping(question_index)}'?"
+                else:
+                    question_text = f"Which of these would '{sentences.cantonese_and_jyutping(question_index)}' be a response to?"
+                options = [{"text": sentences.jyutping[index], "cantonese": sentences.cantonese[index], "audio_url": None, "hide_text": False} for index in incorrect_indexes + [correct_index]]
+                self.random.shuffle(options)
+                return {"question_text": question_text, "question_audio_url": None, "correct": sentences.jyutping[correct_index], "options": options, "ordering_options": None}
+            case "sentence_to_response_text" | "response_to_sentence_text":
+                links_name = "responses" if question_type == "sentence_to_response_text" else "response_to"
+                links = getattr(snapshot, links_name)
+                question_index = self.choose(self.iter_unused(snapshot.linked_sentence_pool(links_name), True))
+                self.use(question_index, True)
+                if question_type == "sentence_to_response_text":
+                    question_text = f"What would be a response to '{sentences.cantonese_and_jyutping(question_index)}'?"
+                else:
+                    question_text = f"What would '{sentences.cantonese_and_jyutping(question_index)}' be a response to?"
+                return {"question_text": question_text, "question_audio_url": None, "correct": [sentences.jyutping[index] for index in links[question_index]], "options": None, "ordering_options": None}
+            case "sentence_to_missing_word_buttons" | "sentence_to_missing_word_text":
+                def get_missing_word(index):
+                    sentence_word_array = sentences.jyutping[index].replace("?", "").split(" ")
+                    correct_word_index = self.random.choice(range(len(sentence_word_array)))
+                    if question_type == "sentence_to_missing_word_text":
+                        return sentence_word_array, correct_word_index, None
+                    incorrect_indexes = self.get_incorrect_words(None, False, exclude_jyutping={sentence_word_array[correct_word_index]}, single_jyutping_word_only=True)
+                    return sentence_word_array, correct_word_index, incorrect_indexes
+
+                index, (sentence_word_array, correct_word_index, incorrect_indexes) = self.choose_with_incorrect_words(self.iter_unused(range(len(sentences)), True), get_missing_word)
+                self.use(index, True)
+                jyutping = sentences.jyutping[index]
+                correct_word_jyutping = sentence_word_array[correct_word_index]
+                question_text = f"""Fill in the blank: '{' '.join(["_" if i == correct_word_index else sentence_word for i, sentence_word in enumerate(sentence_word_array)])}{"?" if "?" in jyutping else ""}'."""
+                if question_type == "sentence_to_missing_word_text":
+                    return {"question_text": question_text, "question_audio_url": None, "correct": [correct_word_jyutping], "options": None, "ordering_options": None}
+                options = [{"text": word_jyutping, "audio_url": None, "hide_text": False} for word_jyutping in [words.jyutping[i] for i in incorrect_indexes] + [correct_word_jyutping]]
+                self.random.shuffle(options)
+                return {"question_text": question_text, "question_audio_url": None, "correct": correct_word_jyutping, "options": options, "ordering_options": None}
+            case "words_to_ordered_sentence":
+                index = self.choose(self.iter_unused(range(len(sentences)), True))
+                self.use(index, True)
+                jyutping = sentences.jyutping[index]
+                sentence_word_array = jyutping.replace("?", "").split(" ")
+                question_text = f"Order these words to form the Jyutping representation of '{sentences.english[index]}'."
+                sentence_word_array_shuffled = [sentence_word for sentence_word in sentence_word_array]
+                self.random.shuffle(sentence_word_array_shuffled)
+                return {"question_text": question_text, "question_audio_url": None, "correct": sentence_word_array, "options": None, "ordering_options": sentence_word_array_shuffled, "include_question_mark": "?" in jyutping}
+            case _:
+                raise Exception(f"Unknown question type {question_type}")
+
+    def plan(self, question_count):
+        self.question_types = self.scheduler.allocate(question_count, self.random)
+
+    def generate_next_questions(self, count):
+        questions = [self.generate_question_dict(question_type) for question_type in self.question_types[self.generated_count:self.generated_count + count]]
+        self.generated_count += len(questions)
+        return questions
+
+    def generate_questions(self, question_count):
+        self.plan(question_count)
+        return self.generate_next_questions(question_count)
+
+    # A part-generated quiz can be stored between requests and carried on later. Items are stored by id rather than by
+    # index, so the quiz still carries on (with whatever remains of its items) if the vocabulary changes in the meantime.
+    def get_state(self):
+        return {
+            "include_audio": self.include_audio,
+            "seed": self.seed,
+            "random_state": self.random.getstate(),
+            "question_types": self.question_types,
+            "generated_count": self.generated_count,
+            "used_word_ids": [self.snapshot.words.ids[index] for index in self.used_word_indexes],
+            "used_sentence_ids": [self.snapshot.sentences.ids[index] for index in self.used_sentence_indexes],
+        }
+
+    @classmethod
+    def from_state(cls, snapshot, state):
+        generator = cls(snapshot, state["include_audio"], state["seed"])
+        generator.random.setstate(state["random_state"])
+        generator.question_types = state["question_types"]
+        generator.generated_count = state["generated_count"]
+        generator.used_word_indexes = {snapshot.words.index_by_id[item_id] for item_id in state["used_word_ids"] if item_id in snapshot.words.index_by_id}
+        generator.used_sentence_indexes = {snapshot.sentences.index_by_id[item_id] for item_id in state["used_sentence_ids"] if item_id in snapshot.sentences.index_by_id}
+        return generator
@@ -0,0 +1,85 @@
+import logging
+import queue
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .quiz import QuizGenerationError, QuizGenerator, new_quiz_seed
+from .snapshot import get_vocabulary_snapshot
+from .utils import get_vocabulary_version
+
+logger = logging.getLogger(__name__)
+
+# Ready-made quizzes are kept in the cache, one per slot, under keys that include the vocabulary version so that any
+# change to the vocabulary makes the whole pool unreachable.
+QUIZ_POOL_TIMEOUT = 60 * 60 * 24
+
+
+def get_quiz_pool_size():
+    return getattr(settings, "QUIZ_POOL_SIZE", 0)
+
+
+def get_quiz_pool_key(version, question_count, include_audio, slot):
+    return f"quiz_pool:{version}:{question_count}:{int(include_audio)}:{slot}"
+
+
+def pop_pooled_quiz(question_count, include_audio):
+    version = get_vocabulary_version()
+    slots = list(range(get_quiz_pool_size()))
+    random.shuffle(slots)
+    for slot in slots:
+        key = get_quiz_pool_key(version, question_count, include_audio, slot)
+        # Only the request that manages to delete the entry gets to use it, so two requests never share a quiz.
+        if (pooled_quiz := cache.get(key)) is not None and cache.delete(key):
+            return pooled_quiz
+    return None
+
+
+def fill_quiz_pool(question_count, include_audio):
+    version = get_vocabulary_version()
+    snapshot = get_vocabulary_snapshot()
+    filled = 0
+    for slot in range(get_quiz_pool_size()):
+        key = get_quiz_pool_key(version, question_count, include_audio, slot)
+        if cache.get(key) is None:
+            seed = new_quiz_seed()
+            questions = QuizGenerator(snapshot, include_audio, seed).generate_questions(question_count)
+            if cache.add(key, {"seed": seed, "questions": questions}, timeout=QUIZ_POOL_TIMEOUT):
+                filled += 1
+    return filled
+
+
+class QuizPoolWorker(threading.Thread):
+    def __init__(self):
+        super().__init__(name="quiz-pool-worker", daemon=True)
+        self.requests = queue.Queue()
+
+    def run(self):
+        while True:
+            question_count, include_audio = self.requests.get()
+            try:
+                fill_quiz_pool(question_count, include_audio)
+            except QuizGenerationError:
+                pass  # The vocabulary cannot make this quiz; the request that asks for it will report why.
+            except Exception:
+                logger.exception("Failed to fill the quiz pool.")
+            finally:
+                connection.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def request_quiz_pool_refill(question_count, include_audio):
+    global _worker
+    if not get_quiz_pool_size():
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = QuizPoolWorker()
+            _worker.start()
+    _worker.requests.put((question_count, include_audio))
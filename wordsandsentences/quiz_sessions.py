@@ -0,0 +1,81 @@
+import uuid
+
+from django.core.cache import cache
+
+from .quiz import QuizGenerator, new_quiz_seed
+from .quiz_pool import pop_pooled_quiz, request_quiz_pool_refill
+from .snapshot import get_vocabulary_snapshot
+
+# Quizzes are handed out a page of questions at a time. A started quiz is kept in the cache along with the state of its
+# generator, so that later pages are only generated when they are asked for.
+QUIZ_PAGE_SIZE = 5
+QUIZ_TIMEOUT = 60 * 60 * 24
+
+
+def get_quiz_key(quiz_id):
+    return f"quiz:{quiz_id}"
+
+
+# Generation is deterministic, so a finished quiz can be cached and served again to anyone asking for the same seed.
+def get_quiz_result_key(seed, version, question_count, include_audio):
+    return f"quiz_result:{seed}:{version}:{question_count}:{int(include_audio)}"
+
+
+def get_seeded_questions(snapshot, seed, question_count, include_audio):
+    key = get_quiz_result_key(seed, snapshot.version, question_count, include_audio)
+    if (questions := cache.get(key)) is None:
+        questions = QuizGenerator(snapshot, include_audio, seed).generate_questions(question_count)
+        cache.set(key, questions, timeout=QUIZ_TIMEOUT)
+    return questions
+
+
+def start_quiz(question_count, include_audio, seed=None):
+    quiz_id = uuid.uuid4().hex
+    snapshot = get_vocabulary_snapshot()
+    quiz = {"seed": seed, "vocabulary_version": snapshot.version, "question_count": question_count, "include_audio": include_audio, "generator_state": None}
+    if seed is not None:
+        quiz["questions"] = get_seeded_questions(snapshot, seed, question_count, include_audio)
+    elif (pooled_quiz := pop_pooled_quiz(question_count, include_audio)) is not None:
+        quiz["seed"] = pooled_quiz["seed"]
+        quiz["questions"] = pooled_quiz["questions"]
+    elif include_audio:
+        # Audio quizzes are generated in full up front, so that the audio of every question can be loaded before the
+        # first one is shown.
+        generator = QuizGenerator(snapshot, include_audio, new_quiz_seed())
+        quiz["seed"] = generator.seed
+        quiz["questions"] = generator.generate_questions(question_count)
+    else:
+        generator = QuizGenerator(snapshot, include_audio, new_quiz_seed())
+        generator.plan(question_count)
+        quiz["seed"] = generator.seed
+        quiz["questions"] = generator.generate_next_questions(QUIZ_PAGE_SIZE)
+        quiz["generator_state"] = generator.get_state()
+    request_quiz_pool_refill(question_count, include_audio)
+    cache.set(get_quiz_key(quiz_id), quiz, timeout=QUIZ_TIMEOUT)
+    return quiz_id, quiz
+
+
+def get_page_count(quiz):
+    return -(-quiz["question_count"] // QUIZ_PAGE_SIZE)
+
+
+def get_page_questions(quiz, page):
+    return quiz["questions"][page * QUIZ_PAGE_SIZE:(page + 1) * QUIZ_PAGE_SIZE]
+
+
+def get_quiz_with_page(quiz_id, page):
+    # Returns the quiz once the questions of the page have been generated, or None if the quiz does not exist (or has
+    # expired) or the page is out of range.
+    if (quiz := cache.get(get_quiz_key(quiz_id))) is None or not 0 <= page < get_page_count(quiz):
+        return None
+    start = page * QUIZ_PAGE_SIZE
+    end = start + QUIZ_PAGE_SIZE
+    if len(quiz["questions"]) < min(end, quiz["question_count"]):
+        snapshot = get_vocabulary_snapshot()
+        generator = QuizGenerator.from_state(snapshot, quiz["generator_state"])
+        quiz["questions"] += generator.generate_next_questions(end - len(quiz["questions"]))
+        quiz["generator_state"] = generator.get_state()
+        cache.set(get_quiz_key(quiz_id), quiz, timeout=QUIZ_TIMEOUT)
+        if len(quiz["questions"]) == quiz["question_count"] and snapshot.version == quiz["vocabulary_version"]:
+            cache.set(get_quiz_result_key(quiz["seed"], snapshot.version, quiz["question_count"], quiz["include_audio"]), quiz["questions"], timeout=QUIZ_TIMEOUT)
+    return quiz
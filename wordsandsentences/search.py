@@ -0,0 +1,102 @@
+import re
+from bisect import bisect_left
+
+SEARCH_PAGE_SIZE = 20
+LATIN_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def is_cjk(character):
+    return character >= "\u2e80"
+
+
+# Items are identified in the index by a single integer key: the item's index in its table, times two, plus one for
+# sentences.
+def get_item_key(index, is_sentence):
+    return index * 2 + is_sentence
+
+
+def get_item_index(item_key):
+    return item_key // 2, bool(item_key % 2)
+
+
+class SearchIndex:
+    # Inverted index over the jyutping, cantonese and english of every word and sentence. Jyutping and English are
+    # split into tokens that are matched by prefix (through a sorted token list), and Cantonese is indexed by single
+    # characters and character pairs, as it is not split into words.
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        postings_by_token = {}
+        postings_by_ngram = {}
+        # The searched fields of each item, lower case, by item key.
+        self.fields = {}
+        self.results_by_query = {}
+        for is_sentence in (False, True):
+            table = snapshot.table(is_sentence)
+            for index in range(len(table)):
+                item_key = get_item_key(index, is_sentence)
+                jyutping, cantonese, english = self.fields[item_key] = (table.jyutping[index].lower(), table.cantonese[index], table.english[index].lower())
+                for token in set(LATIN_TOKEN_RE.findall(f"{jyutping} {english}")):
+                    postings_by_token.setdefault(token, []).append(item_key)
+                for ngram in {*cantonese, *(cantonese[i:i + 2] for i in range(len(cantonese) - 1))}:
+                    postings_by_ngram.setdefault(ngram, []).append(item_key)
+        self.tokens = sorted(postings_by_token)
+        self.token_postings = [tuple(postings_by_token[token]) for token in self.tokens]
+        self.ngram_postings = {ngram: tuple(item_keys) for ngram, item_keys in postings_by_ngram.items()}
+
+    @classmethod
+    def for_snapshot(cls, snapshot):
+        return snapshot.get_or_build("search_index", lambda: cls(snapshot))
+
+    def get_prefix_matches(self, prefix):
+        item_keys = set()
+        for i in range(bisect_left(self.tokens, prefix), len(self.tokens)):
+            if not self.tokens[i].startswith(prefix):
+                break
+            item_keys.update(self.token_postings[i])
+        return item_keys
+
+    def get_cantonese_matches(self, text):
+        ngrams = [text] if len(text) == 1 else [text[i:i + 2] for i in range(len(text) - 1)]
+        postings = sorted((self.ngram_postings.get(ngram, ()) for ngram in ngrams), key=len)
+        item_keys = set(postings[0]).intersection(*postings[1:])
+        if len(text) > 2:
+            # Every pair of characters being there does not mean they are next to each other, so check the candidates.
+            item_keys = {item_key for item_key in item_keys if text in self.fields[item_key][1]}
+        return item_keys
+
+    def get_rank(self, item_key, query):
+        # Items with a field equal to the query come first, then those with a field starting with it, then those
+        # containing it, then everything else that matched every term; shorter items first within each group.
+        fields = self.fields[item_key]
+        if query in fields:
+            score = 3
+        elif any(field.startswith(query) for field in fields):
+            score = 2
+        elif any(query in field for field in fields):
+            score = 1
+        else:
+            score = 0
+        return -score, len(fields[0]), item_key
+
+    def search(self, query):
+        # Returns the (index, is_sentence) of every item matching all the terms of the query, best matches first.
+        # The results of recent queries are kept, so that fetching the next page of results does not search again.
+        query = " ".join(query.lower().split())
+        if (results := self.results_by_query.get(query)) is None:
+            if len(self.results_by_query) >= 100:
+                self.results_by_query.clear()
+            results = self.results_by_query[query] = self.find(query)
+        return results
+
+    def find(self, query):
+        matches = []
+        for term in query.split(" "):
+            if cjk_text := "".join(character for character in term if is_cjk(character)):
+                matches.append(self.get_cantonese_matches(cjk_text))
+            else:
+                matches += [self.get_prefix_matches(token) for token in LATIN_TOKEN_RE.findall(term)]
+        if not matches:
+            return []
+        matches.sort(key=len)
+        item_keys = matches[0].intersection(*matches[1:])
+        return [get_item_index(item_key) for item_key in sorted(item_keys, key=lambda item_key: self.get_rank(item_key, query))]
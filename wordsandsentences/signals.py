@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .audio_renditions import request_audio_renditions
+from .models import Topic, Word, Sentence
+from .utils import bump_vocabulary_version, update_syllables
+
+
+@receiver([post_save, post_delete], sender=Topic)
+@receiver([post_save, post_delete], sender=Word)
+@receiver([post_save, post_delete], sender=Sentence)
+def vocabulary_changed(sender, instance, **kwargs):
+    if sender is Topic:
+        topic_ids = {instance.pk}
+    else:
+        topic_ids = {instance.topic_id, getattr(instance, "loaded_topic_id", None)} - {None}
+        instance.loaded_topic_id = instance.topic_id
+    # Wait for the commit so that other processes never rebuild from data that is not yet visible to them.
+    transaction.on_commit(lambda: bump_vocabulary_version(topic_ids))
+
+
+@receiver(post_save, sender=Word)
+@receiver(post_save, sender=Sentence)
+def learning_item_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "jyutping" in update_fields:
+        update_syllables(sender, [instance])
+
+
+@receiver(post_save, sender=Word)
+def word_saved(sender, instance, update_fields=None, **kwargs):
+    # New audio has no rendition or size until one has been made for it.
+    if instance.audio_file and instance.audio_size is None and (update_fields is None or "audio_file" in update_fields):
+        transaction.on_commit(lambda: request_audio_renditions([instance.pk]))
+
+
+@receiver(m2m_changed, sender=Sentence.response_to.through)
+def sentence_response_to_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        transaction.on_commit(bump_vocabulary_version)
@@ -0,0 +1,144 @@
+import random
+import threading
+from array import array
+
+from django.db import transaction
+
+from .models import Topic, Word, Sentence, WordSyllable, SentenceSyllable, get_audio_url
+from .utils import get_vocabulary_version
+
+
+# Column-oriented, read-only copy of every row of the Word or Sentence table.
+# Rows are addressed by their position (index) in the table rather than by database id.
+class ItemTable:
+    def __init__(self, rows, is_sentence, syllable_rows):
+        self.is_sentence = is_sentence
+        self.ids = array("q")
+        self.topic_ids = array("q")
+        self.syllable_counts = array("q")
+        jyutping, cantonese, english, audio_urls = [], [], [], []
+        for item_id, topic_id, item_jyutping, item_cantonese, item_english, syllable_count, audio_url in rows:
+            self.ids.append(item_id)
+            self.topic_ids.append(topic_id)
+            self.syllable_counts.append(syllable_count)
+            jyutping.append(item_jyutping)
+            cantonese.append(item_cantonese)
+            english.append(item_english)
+            audio_urls.append(audio_url)
+        self.jyutping = tuple(jyutping)
+        self.cantonese = tuple(cantonese)
+        self.english = tuple(english)
+        self.audio_urls = tuple(audio_urls)
+        self.index_by_id = {item_id: index for index, item_id in enumerate(self.ids)}
+        # The tones of each item's syllables in order, as a string of digits ("52" for "nei5 hou2"), from the syllable table.
+        tones = [[] for _index in range(len(self.ids))]
+        for item_id, tone in syllable_rows:
+            if tone and (index := self.index_by_id.get(item_id)) is not None:
+                tones[index].append(str(tone))
+        self.tones = tuple("".join(item_tones) for item_tones in tones)
+        self.indexes_by_english = {}
+        for index, item_english in enumerate(self.english):
+            self.indexes_by_english.setdefault(item_english, []).append(index)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cantonese_and_jyutping(self, index):
+        return f"{self.jyutping[index]}{f' ({self.cantonese[index]})' if self.cantonese[index] else ''}"
+
+
+# In-process, read-only copy of all topics, words, sentences and sentence responses for one vocabulary version.
+class VocabularySnapshot:
+    def __init__(self, version):
+        self.version = version
+        # The tables are read in one transaction so that they agree with each other; rows that still refer to an item
+        # that is not in its table are skipped all the same, rather than failing every request until the next version.
+        with transaction.atomic():
+            self.load()
+        self._derived = {}
+
+    def load(self):
+        self.topic_names = dict(Topic.objects.values_list("id", "topic_name"))
+        self.words = ItemTable(
+            (
+                (*row, get_audio_url(audio_rendition or audio_file, audio_hash) if audio_file else None)
+                for *row, audio_file, audio_rendition, audio_hash in Word.objects.order_by("id").values_list("id", "topic_id", "jyutping", "cantonese", "english", "syllable_count", "audio_file", "audio_rendition", "audio_hash")
+            ), False,
+            WordSyllable.objects.order_by("word_id", "position").values_list("word_id", "tone"),
+        )
+        self.sentences = ItemTable(
+            ((*row, None) for row in Sentence.objects.order_by("id").values_list("id", "topic_id", "jyutping", "cantonese", "english", "syllable_count")), True,
+            SentenceSyllable.objects.order_by("sentence_id", "position").values_list("sentence_id", "tone"),
+        )
+        # response_to[i] holds the indexes of the sentences that sentence i is a response to, responses[i] the reverse.
+        response_to = {}
+        responses = {}
+        sentence_index_by_id = self.sentences.index_by_id
+        for from_id, to_id in Sentence.response_to.through.objects.order_by("id").values_list("from_sentence_id", "to_sentence_id"):
+            from_index = sentence_index_by_id.get(from_id)
+            to_index = sentence_index_by_id.get(to_id)
+            if from_index is None or to_index is None:
+                continue
+            response_to.setdefault(from_index, []).append(to_index)
+            responses.setdefault(to_index, []).append(from_index)
+        self.response_to = {index: tuple(indexes) for index, indexes in response_to.items()}
+        self.responses = {index: tuple(indexes) for index, indexes in responses.items()}
+
+    def table(self, is_sentence):
+        return self.sentences if is_sentence else self.words
+
+    def get_or_build(self, key, build):
+        # Anything derived purely from the snapshot is built the first time it is needed and then kept for as long as
+        # the snapshot, i.e. for one vocabulary version.
+        if (value := self._derived.get(key)) is None:
+            value = self._derived[key] = build()
+        return value
+
+    # Pools are arrays of the indexes that pass a combination of filters.
+    def word_pool(self, audio_only=False, single_jyutping_word_only=False, include_tone=None, topic_id=None):
+        words = self.words
+        return self.get_or_build(("words", audio_only, single_jyutping_word_only, include_tone, topic_id), lambda: array("q", (
+            index for index in range(len(words))
+            if (not audio_only or words.audio_urls[index])
+            and (not single_jyutping_word_only or words.syllable_counts[index] == 1)
+            and (not include_tone or include_tone in words.tones[index])
+            and (topic_id is None or words.topic_ids[index] == topic_id)
+        )))
+
+    def linked_sentence_pool(self, links_name, max_link_count=None):
+        # Sentences with at least one response (or response_to), and optionally no more than max_link_count of them.
+        links = getattr(self, links_name)
+        return self.get_or_build(("sentences", links_name, max_link_count), lambda: array("q", sorted(
+            index for index, linked_indexes in links.items() if max_link_count is None or len(linked_indexes) <= max_link_count
+        )))
+
+    def topic_ids_with_words(self, min_word_count):
+        return self.get_or_build(("topics", min_word_count), lambda: array("q", (
+            topic_id for topic_id in sorted(set(self.words.topic_ids)) if len(self.word_pool(topic_id=topic_id)) >= min_word_count
+        )))
+
+
+def iter_random_sample(pool, rng=random):
+    # Lazy Fisher-Yates shuffle: yields the items of the pool in a random order without replacement,
+    # doing a constant amount of work per item drawn rather than copying the whole pool up front.
+    swapped = {}
+    pool_size = len(pool)
+    for i in range(pool_size):
+        j = rng.randrange(i, pool_size)
+        yield pool[swapped.get(j, j)]
+        swapped[j] = swapped.get(i, i)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_vocabulary_snapshot():
+    global _snapshot
+    version = get_vocabulary_version()
+    if (snapshot := _snapshot) is not None and snapshot.version == version:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = VocabularySnapshot(version)
+        return _snapshot
@@ -1,3 +1,719 @@
-from django.test import TestCase
+import json
+import os
+import random
+import re
+import shutil
+import struct
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template.backends.django import Template
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from jyutpinglearningsite.middleware import RequestStatsMiddleware, _template_seconds, get_request_stats, timed_template_render
+
+from .audio_bundles import AUDIO_BUNDLE_MAX_WORDS
+from .distractors import DistractorIndex
+from .import_jobs import IMPORT_JOB_STALE_AFTER, ImportJobProgress, fail_stale_import_jobs, get_import_job_progress, get_import_job_progress_key, run_import_job
+from .imports import import_audio_files, import_words_csv
+from .jyutping import get_syllable_rows
+from .models import Topic, Word, Sentence, WordSyllable, SentenceSyllable, ImportJob, ImportJobFile
+from .quiz import QuizGenerationError, QuizGenerator, QuizScheduler
+from .quiz_pool import fill_quiz_pool, get_quiz_pool_key, pop_pooled_quiz
+from .quiz_sessions import QUIZ_PAGE_SIZE, get_quiz_with_page, start_quiz
+from .search import SEARCH_PAGE_SIZE, SearchIndex
+from .snapshot import VocabularySnapshot, get_vocabulary_snapshot
+from .utils import bump_vocabulary_version, get_topics, get_topics_items, get_vocabulary_version
 
 # Create your tests here.
+
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tests"},
+    "vocabulary": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tests-vocabulary", "TIMEOUT": None},
+}
+
+
+# Tests run against their own cache, emptied before each test, with the quiz pool off, and with the vocabulary version
+# bumped once each test has made its words and sentences (the model signals only bump it on commit, which a TestCase
+# never does).
+@override_settings(CACHES=TEST_CACHES, QUIZ_POOL_SIZE=0)
+class VocabularyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("learner", password="password")
+        self.client.force_login(self.user)
+
+    def make_words(self, topic, jyutpings):
+        return [Word.objects.create(topic=topic, jyutping=jyutping, english=f"{jyutping} in English", loc=loc * 10) for loc, jyutping in enumerate(jyutpings)]
+
+    def vocabulary_changed(self):
+        bump_vocabulary_version()
+
+
+class QuizAnswerCheckTests(VocabularyTestCase):
+    def setUp(self):
+        super().setUp()
+        topic = Topic.objects.create(topic_name="animals", loc=0)
+        self.make_words(topic, ["gau2", "gam2", "maa5", "jyu4 caa4"])
+        self.vocabulary_changed()
+
+    def check_answer(self, answer, *correct):
+        return self.client.get("/quiz/api/check_answer/", {"answer": answer, "correct": correct}).json()
+
+    def test_accepts_exact_toneless_and_one_letter_wrong_answers(self):
+        self.assertEqual(self.check_answer("gau2", "gau2"), {"correct": True, "matched": "gau2"})
+        self.assertEqual(self.check_answer("maa", "maa5"), {"correct": True, "matched": "maa5"})
+        self.assertEqual(self.check_answer("jyu4 cha4", "jyu4 caa4"), {"correct": True, "matched": "jyu4 caa4"})
+
+    def test_rejects_an_exact_match_for_another_item(self):
+        # "gam2" is one letter away from "gau2", but it is a word of its own.
+        self.assertEqual(self.check_answer("gam2", "gau2"), {"correct": False, "matched": None})
+        self.assertEqual(self.check_answer("gam", "gau2"), {"correct": False, "matched": None})
+
+    def test_rejects_a_wrong_tone(self):
+        self.assertEqual(self.check_answer("gau1", "gau2"), {"correct": False, "matched": None})
+        self.assertEqual(self.check_answer("gam1", "gau2"), {"correct": False, "matched": None})
+
+
+class QuizTestCase(VocabularyTestCase):
+    WORDS = ["ngo5", "nei5", "keoi5", "hou2", "sik6", "jam2", "caa4", "faan6", "gau2", "maau1", "jyu4", "tin1", "hei3", "jat6", "jau5", "mou5"]
+    SENTENCES = ["nei5 hou2", "ngo5 hou2", "ngo5 sik6 faan6", "nei5 jam2 caa4", "keoi5 jau5 gau2", "ngo5 mou5 maau1", "tin1 hei3 hou2", "keoi5 sik6 jyu4"]
+
+    def setUp(self):
+        super().setUp()
+        topic = Topic.objects.create(topic_name="everyday", loc=0)
+        self.words = self.make_words(topic, self.WORDS)
+        self.sentences = [Sentence.objects.create(topic=topic, jyutping=jyutping, english=f"{jyutping} in English", loc=loc * 10) for loc, jyutping in enumerate(self.SENTENCES)]
+        # "ngo5 hou2" answers "nei5 hou2", and so on down the list.
+        for sentence, response in zip(self.sentences[::2], self.sentences[1::2]):
+            response.response_to.add(sentence)
+        self.vocabulary_changed()
+
+
+class TopicItemsCacheTests(VocabularyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.animals = Topic.objects.create(topic_name="animals", loc=0)
+        self.food = Topic.objects.create(topic_name="food", loc=10)
+        self.gau2, _maa5 = self.make_words(self.animals, ["gau2", "maa5"])
+        self.make_words(self.food, ["faan6", "min6"])
+        self.vocabulary_changed()
+
+    def get_topics_items(self):
+        with CaptureQueriesContext(connection) as queries:
+            topics_items = get_topics_items(list(get_topics().values()))
+        # The topics whose words were read from the database rather than the cache.
+        read_topic_ids = set()
+        for query in queries:
+            if match := re.search(r'"wordsandsentences_word"\."topic_id" IN \(([\d, ]+)\)', query["sql"]):
+                read_topic_ids.update(int(topic_id) for topic_id in match[1].split(","))
+        return topics_items, read_topic_ids
+
+    def test_a_change_to_one_topic_only_reads_that_topic_again(self):
+        self.get_topics_items()
+        self.assertEqual(self.get_topics_items()[1], set())
+        self.gau2.english = "dog"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gau2.save()
+        topics_items, read_topic_ids = self.get_topics_items()
+        self.assertEqual(read_topic_ids, {self.animals.id})
+        self.assertEqual(topics_items[self.animals.id]["words"][0]["english"], "dog")
+
+    def test_moving_an_item_reads_both_topics_again(self):
+        self.get_topics_items()
+        word = Word.objects.get(pk=self.gau2.pk)
+        word.topic = self.food
+        with self.captureOnCommitCallbacks(execute=True):
+            word.save()
+        topics_items, read_topic_ids = self.get_topics_items()
+        self.assertEqual(read_topic_ids, {self.animals.id, self.food.id})
+        self.assertNotIn("gau2", [word["jyutping"] for word in topics_items[self.animals.id]["words"]])
+
+
+class MediaFilesTestCase(VocabularyTestCase):
+    # Uploads go to a temporary media folder of their own.
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, EXPORTS_ROOT=os.path.join(media_root, "exports"), MEDIA_ACCEL_REDIRECT=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class MediaViewTests(MediaFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.word = self.make_words(Topic.objects.create(topic_name="animals", loc=0), ["gau2"])[0]
+        self.word.audio_file = SimpleUploadedFile("gau2.mp3", self.content)
+        self.word.save()
+        self.vocabulary_changed()
+
+    def test_serves_the_file_with_an_etag_and_answers_304_when_it_matches(self):
+        response = self.client.get(self.word.audio_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        response = self.client.get(self.word.audio_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_serves_byte_ranges(self):
+        response = self.client.get(self.word.audio_url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+        response = self.client.get(self.word.audio_url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-5:])
+        response = self.client.get(self.word.audio_url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, 416)
+        # A range of a file that has changed since the If-Range ETag was read gets the whole file.
+        response = self.client.get(self.word.audio_url, HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_the_current_audio_url_is_cached_for_good(self):
+        self.assertIn("immutable", self.client.get(self.word.audio_url)["Cache-Control"])
+        for url in [self.word.audio_file.url, f"{self.word.audio_file.url}?v=made-up"]:
+            with self.subTest(url):
+                cache_control = self.client.get(url)["Cache-Control"]
+                self.assertNotIn("immutable", cache_control)
+                self.assertIn("no-cache", cache_control)
+
+    def test_missing_files_and_paths_outside_the_media_folder_are_not_found(self):
+        self.assertEqual(self.client.get("/media/missing.mp3").status_code, 404)
+        self.assertEqual(self.client.get("/media/../manage.py").status_code, 404)
+
+
+class ExportTests(MediaFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.make_words(Topic.objects.create(topic_name="animals", loc=0), ["gau2", "maa5"])
+        self.vocabulary_changed()
+
+    def get_export(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        return response, b"".join(response.streaming_content) if response.status_code == 200 else b""
+
+    def test_unchanged_exports_are_answered_with_304(self):
+        for url in ["/words_export/", "/words_export/?format=xlsx", "/topics_export/"]:
+            with self.subTest(url):
+                response, _content = self.get_export(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.get_export(url, if_none_match=response["ETag"])[0].status_code, 304)
+                self.vocabulary_changed()
+                self.assertEqual(self.get_export(url, if_none_match=response["ETag"])[0].status_code, 200)
+
+    def test_exports_are_served_from_disk_until_the_vocabulary_changes(self):
+        _response, content = self.get_export("/words_export/")
+        self.assertIn(b"gau2", content)
+        self.assertEqual(len(os.listdir(settings.EXPORTS_ROOT)), 1)
+        with CaptureQueriesContext(connection) as queries:
+            _response, saved_content = self.get_export("/words_export/")
+        self.assertEqual(saved_content, content)
+        self.assertFalse([query for query in queries if "wordsandsentences_word" in query["sql"]])
+        Word.objects.filter(jyutping="maa5").update(english="horse")
+        self.vocabulary_changed()
+        _response, content = self.get_export("/words_export/")
+        self.assertIn(b"horse", content)
+        # The export of the old version has been replaced.
+        self.assertEqual(len(os.listdir(settings.EXPORTS_ROOT)), 1)
+
+
+class AudioBundleTests(MediaFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.words = self.make_words(Topic.objects.create(topic_name="animals", loc=0), ["gau2", "maa5", "ngau4"])
+        self.clips = {}
+        for word, clip in zip(self.words[:2], [b"woof" * 10, bytes(range(256))]):
+            word.audio_file = SimpleUploadedFile(f"{word.jyutping}.mp3", clip)
+            word.save()
+            self.clips[word.audio_url] = clip
+        self.vocabulary_changed()
+
+    def get_bundle(self, word_ids):
+        return self.client.get(f"/quiz/audio/{'-'.join(map(str, word_ids))}/", {"v": get_vocabulary_version()})
+
+    def test_a_bundle_holds_the_clips_of_its_words(self):
+        response = self.get_bundle(sorted(word.id for word in self.words))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        bundle = response.content
+        (manifest_length,) = struct.unpack(">I", bundle[:4])
+        manifest = json.loads(bundle[4:4 + manifest_length])
+        clips_start = 4 + manifest_length
+        # The word without audio is left out.
+        self.assertEqual(set(manifest), set(self.clips))
+        for audio_url, (offset, length, content_type) in manifest.items():
+            self.assertEqual(bundle[clips_start + offset:clips_start + offset + length], self.clips[audio_url])
+            self.assertEqual(content_type, "audio/mpeg")
+        self.assertEqual(len(bundle), clips_start + sum(map(len, self.clips.values())))
+
+    def test_only_sorted_lists_of_distinct_ids_up_to_the_limit_are_bundled(self):
+        first_id, second_id = sorted(word.id for word in self.words[:2])
+        for word_ids in [[second_id, first_id], [first_id, first_id], list(range(1, AUDIO_BUNDLE_MAX_WORDS + 2))]:
+            with self.subTest(word_ids=word_ids[:3]):
+                self.assertEqual(self.get_bundle(word_ids).status_code, 404)
+        self.assertEqual(self.client.get("/quiz/audio/1-a/").status_code, 404)
+        self.assertEqual(self.get_bundle(list(range(1, AUDIO_BUNDLE_MAX_WORDS + 1))).status_code, 200)
+
+
+class AudioRenditionTests(MediaFilesTestCase):
+    def test_new_audio_removes_the_old_rendition(self):
+        word = self.make_words(Topic.objects.create(topic_name="animals", loc=0), ["gau2"])[0]
+        word.audio_file = SimpleUploadedFile("gau2.mp3", b"old audio")
+        word.save()
+        word.audio_rendition.save("gau2.mp3", ContentFile(b"old rendition"), save=False)
+        word.audio_size = word.audio_rendition.size
+        word.save()
+        rendition_name = word.audio_rendition.name
+        word.audio_file = SimpleUploadedFile("gau2.mp3", b"new audio")
+        # Only the commit callbacks of the save are run, not the rendition of the new audio it asks for.
+        with mock.patch("wordsandsentences.signals.request_audio_renditions"), self.captureOnCommitCallbacks(execute=True):
+            word.save()
+        self.assertFalse(word.audio_rendition)
+        self.assertFalse(default_storage.exists(rendition_name))
+
+
+class StaleImportJobTests(VocabularyTestCase):
+    def test_a_running_job_without_progress_is_marked_failed(self):
+        job = ImportJob.objects.create(status="running", started_at=timezone.now() - IMPORT_JOB_STALE_AFTER - timedelta(minutes=1))
+        self.assertEqual(get_import_job_progress(job)["status"], "failed")
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertIn("stopped without finishing", job.error)
+
+    def test_a_running_job_with_recent_progress_is_left_running(self):
+        job = ImportJob.objects.create(status="running", started_at=timezone.now() - IMPORT_JOB_STALE_AFTER - timedelta(minutes=1))
+        ImportJobProgress(job)(10)
+        self.assertEqual(fail_stale_import_jobs(), 0)
+        self.assertEqual(get_import_job_progress(job)["status"], "running")
+
+    def run_job_with_audio_import(self, import_audio_files):
+        # A job with one audio file, whose import is replaced by import_audio_files.
+        job = ImportJob.objects.create()
+        ImportJobFile.objects.create(job=job, kind="audio_file", name="gau2.mp3", file="missing/gau2.mp3")
+        with mock.patch("wordsandsentences.import_jobs.import_audio_files", side_effect=import_audio_files), mock.patch("wordsandsentences.import_jobs.make_audio_renditions", return_value=0):
+            run_import_job(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_a_job_taken_for_stale_stays_failed_when_it_finishes(self):
+        def import_audio_files(audio_files, progress):
+            ImportJob.objects.filter(status="running").update(status="failed", error="Taken for stale.")
+            return []
+        job = self.run_job_with_audio_import(import_audio_files)
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "Taken for stale.")
+
+    @mock.patch("wordsandsentences.import_jobs.IMPORT_JOB_HEARTBEAT_INTERVAL", 0.01)
+    def test_a_job_busy_without_progress_is_kept_alive_by_its_heartbeat(self):
+        def import_audio_files(audio_files, progress):
+            long_ago = timezone.now() - IMPORT_JOB_STALE_AFTER - timedelta(minutes=1)
+            ImportJob.objects.filter(pk=progress.job.pk).update(started_at=long_ago)
+            cache.set(get_import_job_progress_key(progress.job.pk), {"stage": progress.job.stage, "rows_processed": 0, "updated_at": long_ago})
+            time.sleep(0.2)
+            self.assertEqual(fail_stale_import_jobs(), 0)
+            return []
+        self.assertEqual(self.run_job_with_audio_import(import_audio_files).status, "done")
+
+
+class VocabularySnapshotTests(QuizTestCase):
+    def test_rows_for_items_that_are_not_in_the_snapshot_are_skipped(self):
+        # As left by a word or sentence deleted while the snapshot was being read. They are removed again before the test's
+        # foreign keys are checked.
+        orphans = [
+            WordSyllable.objects.create(word_id=999999, position=0, final="au", tone=2),
+            SentenceSyllable.objects.create(sentence_id=999999, position=0, final="ei", tone=5),
+            Sentence.response_to.through.objects.create(from_sentence_id=999999, to_sentence_id=self.sentences[0].id),
+            Sentence.response_to.through.objects.create(from_sentence_id=self.sentences[2].id, to_sentence_id=999999),
+        ]
+        self.addCleanup(lambda: [orphan.delete() for orphan in orphans])
+        snapshot = VocabularySnapshot(get_vocabulary_version())
+        self.assertEqual(len(snapshot.words), len(self.WORDS))
+        self.assertEqual(snapshot.words.tones[snapshot.words.index_by_id[self.words[0].id]], "5")
+        self.assertEqual(snapshot.sentences.tones[snapshot.sentences.index_by_id[self.sentences[0].id]], "52")
+        self.assertEqual(snapshot.responses[0], (1,))
+        self.assertEqual(snapshot.response_to[3], (2,))
+
+
+class DistractorIndexTests(VocabularyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.topic = Topic.objects.create(topic_name="animals", loc=0)
+        # Words sharing the final "au", words sharing the final "aa", and one that sounds like none of them.
+        self.words = {word.jyutping: word for word in self.make_words(self.topic, ["gau2", "sau2", "kau2", "gau1", "maa5", "jyu4", "lau4", "nau4", "dau6", "tau3", "hau6", "maa1", "baa2", "paa3"])}
+        self.vocabulary_changed()
+
+    def get_candidate_jyutping(self, snapshot, index, jyutping):
+        words = snapshot.words
+        return [words.jyutping[candidate] for candidate in index.candidates[words.index_by_id[self.words[jyutping].id]]]
+
+    def test_candidates_are_ranked_by_tone_then_near_initial_then_final(self):
+        snapshot = VocabularySnapshot(get_vocabulary_version())
+        candidates = self.get_candidate_jyutping(snapshot, DistractorIndex(snapshot), "gau2")
+        self.assertEqual(candidates[:2], ["gau1", "kau2"])
+        self.assertEqual(set(candidates[2:]), {"sau2", "lau4", "nau4", "dau6", "tau3", "hau6"})
+        self.assertEqual(self.get_candidate_jyutping(snapshot, DistractorIndex(snapshot), "nau4")[0], "lau4")
+        self.assertEqual(self.get_candidate_jyutping(snapshot, DistractorIndex(snapshot), "maa5"), ["maa1", "baa2", "paa3"])
+        self.assertEqual(self.get_candidate_jyutping(snapshot, DistractorIndex(snapshot), "jyu4"), [])
+
+    def test_an_index_refreshed_from_the_previous_one_matches_one_built_from_scratch(self):
+        previous = DistractorIndex(VocabularySnapshot(get_vocabulary_version()))
+        Word.objects.filter(pk=self.words["sau2"].pk).update(english="hand")
+        Word.objects.filter(pk=self.words["dau6"].pk).delete()
+        self.make_words(self.topic, ["zau2"])
+        self.vocabulary_changed()
+        snapshot = VocabularySnapshot(get_vocabulary_version())
+        refreshed = DistractorIndex(snapshot, previous=previous)
+        built = DistractorIndex(snapshot)
+        self.assertEqual(refreshed.candidate_ids_by_id, built.candidate_ids_by_id)
+        self.assertEqual(refreshed.candidates, built.candidates)
+        # The "aa" words were not touched, so their lists are reused.
+        self.assertIs(refreshed.candidate_ids_by_id[self.words["maa5"].id], previous.candidate_ids_by_id[self.words["maa5"].id])
+
+    def test_a_deleted_word_is_never_a_distractor(self):
+        DistractorIndex.for_snapshot(get_vocabulary_snapshot())
+        deleted_id = self.words.pop("kau2").id
+        Word.objects.filter(pk=deleted_id).delete()
+        self.vocabulary_changed()
+        snapshot = get_vocabulary_snapshot()
+        index = DistractorIndex.for_snapshot(snapshot)
+        self.assertFalse([candidate_ids for candidate_ids in index.candidate_ids_by_id.values() if deleted_id in candidate_ids])
+        self.assertNotIn("kau2", self.get_candidate_jyutping(snapshot, index, "gau2"))
+
+
+class SearchTests(VocabularyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.topic = Topic.objects.create(topic_name="animals", loc=0)
+        for loc, (jyutping, cantonese) in enumerate([("sai3 gau2", "細狗"), ("gau2 zai2", "狗仔"), ("gau2", "狗"), ("zai2 gau2 zai2", "仔狗仔"), ("maa5", "馬")]):
+            Word.objects.create(topic=self.topic, jyutping=jyutping, cantonese=cantonese, english=f"{jyutping} in English", loc=loc * 10)
+        self.vocabulary_changed()
+
+    def search(self, query, page=0):
+        return self.client.get("/search/", {"q": query, "page": page}).json()
+
+    def get_jyutping(self, query):
+        return [result["jyutping"] for result in self.search(query)["results"]]
+
+    def test_exact_matches_come_first_then_prefixes_then_the_rest_shorter_first(self):
+        self.assertEqual(self.get_jyutping("gau2"), ["gau2", "gau2 zai2", "sai3 gau2", "zai2 gau2 zai2"])
+        self.assertEqual(self.get_jyutping("gau"), ["gau2", "gau2 zai2", "sai3 gau2", "zai2 gau2 zai2"])
+        self.assertEqual(self.get_jyutping("Gau2  ZAI2"), ["gau2 zai2", "zai2 gau2 zai2"])
+
+    def test_cantonese_is_matched_by_characters(self):
+        self.assertEqual(self.get_jyutping("狗"), ["gau2", "gau2 zai2", "sai3 gau2", "zai2 gau2 zai2"])
+        self.assertEqual(self.get_jyutping("狗仔"), ["gau2 zai2", "zai2 gau2 zai2"])
+        # "仔狗" and "狗仔" are both in "仔狗仔", but "狗仔狗" is not.
+        self.assertEqual(self.get_jyutping("狗仔狗"), [])
+        self.assertEqual(self.get_jyutping("仔狗仔"), ["zai2 gau2 zai2"])
+
+    def test_results_are_paged(self):
+        self.make_words(self.topic, [f"maa{tone} {number}" for tone in range(1, 6) for number in range(5)])
+        self.vocabulary_changed()
+        first_page = self.search("maa")
+        self.assertEqual((first_page["result_count"], len(first_page["results"]), first_page["next_page"]), (26, SEARCH_PAGE_SIZE, 1))
+        second_page = self.search("maa", page=1)
+        self.assertEqual((len(second_page["results"]), second_page["next_page"]), (26 - SEARCH_PAGE_SIZE, None))
+        self.assertFalse({result["id"] for result in first_page["results"]} & {result["id"] for result in second_page["results"]})
+
+    def test_recent_queries_are_kept_for_the_current_vocabulary_only(self):
+        search_index = SearchIndex.for_snapshot(get_vocabulary_snapshot())
+        self.assertIs(search_index.search("gau"), search_index.search("gau "))
+        for number in range(150):
+            search_index.search(f"maa{number}")
+        self.assertLessEqual(len(search_index.results_by_query), 100)
+        Word.objects.filter(jyutping="gau2").delete()
+        self.vocabulary_changed()
+        self.assertNotIn("gau2", self.get_jyutping("gau"))
+
+    def test_jyutping_close_to_the_query_is_found_when_nothing_contains_it(self):
+        response = self.search("gau3")
+        self.assertTrue(response["fuzzy"])
+        self.assertEqual([result["jyutping"] for result in response["results"]], ["gau2"])
+        self.assertFalse(self.search("gau2")["fuzzy"])
+
+
+class SyllableTests(VocabularyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.topic = Topic.objects.create(topic_name="phrases", loc=0)
+
+    def get_syllables(self, item):
+        return list(item.syllables.order_by("position").values_list("position", "initial", "final", "tone"))
+
+    def test_saving_an_item_writes_its_syllables(self):
+        word = self.make_words(self.topic, ["Gwong2 dung1 waa2"])[0]
+        self.assertEqual(self.get_syllables(word), [(0, "gw", "ong", 2), (1, "d", "ung", 1), (2, "w", "aa", 2)])
+        sentence = Sentence.objects.create(topic=self.topic, jyutping="m4 goi1, ng5 go3 aa3", english="five please", loc=0)
+        self.assertEqual(self.get_syllables(sentence), [(0, "", "m", 4), (1, "g", "oi", 1), (2, "", "ng", 5), (3, "g", "o", 3), (4, "", "aa", 3)])
+
+    def test_syllabic_nasals_and_missing_tones(self):
+        self.assertEqual(get_syllable_rows("m4"), [(0, "", "m", 4)])
+        self.assertEqual(get_syllable_rows("ng5"), [(0, "", "ng", 5)])
+        self.assertEqual(get_syllable_rows("ngo5 hm"), [(0, "ng", "o", 5), (1, "h", "m", None)])
+
+    def test_a_changed_jyutping_replaces_the_old_syllables(self):
+        word = self.make_words(self.topic, ["nei5 hou2"])[0]
+        word.jyutping = "m4 goi1"
+        word.save()
+        self.assertEqual(self.get_syllables(word), [(0, "", "m", 4), (1, "g", "oi", 1)])
+        # Saving other fields leaves the syllables alone.
+        word.english = "thank you"
+        word.save(update_fields=["english"])
+        self.assertEqual(self.get_syllables(word), [(0, "", "m", 4), (1, "g", "oi", 1)])
+        self.vocabulary_changed()
+        snapshot = get_vocabulary_snapshot()
+        index = snapshot.words.index_by_id[word.id]
+        self.assertEqual((snapshot.words.tones[index], snapshot.words.syllable_counts[index]), ("41", 2))
+
+    def test_imported_items_get_their_syllables(self):
+        csv_file = SimpleUploadedFile("words.csv", "topic,jyutping,english,is_sentence\nphrases,ng5,five,no\nphrases,m4 hai6,no,yes\n".encode())
+        import_words_csv(csv_file)
+        self.assertEqual(self.get_syllables(Word.objects.get(jyutping="ng5")), [(0, "", "ng", 5)])
+        self.assertEqual(self.get_syllables(Sentence.objects.get(jyutping="m4 hai6")), [(0, "", "m", 4), (1, "h", "ai", 6)])
+
+
+class QuizSeedTests(QuizTestCase):
+    def test_the_same_seed_gives_the_same_quiz(self):
+        _quiz_id, quiz = start_quiz(10, False, seed=1234)
+        # Not from the cache of finished quizzes.
+        cache.clear()
+        _quiz_id, replayed_quiz = start_quiz(10, False, seed=1234)
+        self.assertEqual(len(quiz["questions"]), 10)
+        self.assertEqual(replayed_quiz["questions"], quiz["questions"])
+        response = self.client.post("/quiz/api/", {"question_count": 10, "seed": 1234})
+        self.assertEqual(response.json()["questions"], quiz["questions"][:QUIZ_PAGE_SIZE])
+
+    def test_a_different_seed_gives_a_different_quiz(self):
+        self.assertNotEqual(start_quiz(10, False, seed=1)[1]["questions"], start_quiz(10, False, seed=2)[1]["questions"])
+
+
+class QuizPagingTests(QuizTestCase):
+    def test_a_quiz_generated_a_page_at_a_time_matches_one_generated_in_full(self):
+        quiz_id, quiz = start_quiz(10, False)
+        self.assertEqual(len(quiz["questions"]), QUIZ_PAGE_SIZE)
+        quiz = get_quiz_with_page(quiz_id, 1)
+        self.assertEqual(quiz["questions"], QuizGenerator(get_vocabulary_snapshot(), False, quiz["seed"]).generate_questions(10))
+
+    def test_a_generator_carries_on_from_its_state(self):
+        snapshot = get_vocabulary_snapshot()
+        generator = QuizGenerator(snapshot, False, 1234)
+        generator.plan(10)
+        questions = generator.generate_next_questions(3)
+        questions += QuizGenerator.from_state(snapshot, generator.get_state()).generate_next_questions(7)
+        self.assertEqual(questions, QuizGenerator(snapshot, False, 1234).generate_questions(10))
+
+    def test_a_quiz_that_the_vocabulary_no_longer_has_the_items_for_is_a_conflict(self):
+        quiz_id, _quiz = start_quiz(10, False)
+        Word.objects.exclude(pk__in=[word.pk for word in self.words[:2]]).delete()
+        Sentence.objects.all().delete()
+        self.vocabulary_changed()
+        with self.assertRaises(QuizGenerationError):
+            get_quiz_with_page(quiz_id, 1)
+        response = self.client.get(f"/quiz/api/{quiz_id}/1/")
+        self.assertEqual(response.status_code, 409)
+
+
+@override_settings(QUIZ_POOL_SIZE=2)
+class QuizPoolTests(QuizTestCase):
+    def test_each_pooled_quiz_is_handed_out_once(self):
+        self.assertEqual(fill_quiz_pool(10, False), 2)
+        pooled_quizzes = [pop_pooled_quiz(10, False), pop_pooled_quiz(10, False)]
+        self.assertNotEqual(pooled_quizzes[0]["seed"], pooled_quizzes[1]["seed"])
+        self.assertIsNone(pop_pooled_quiz(10, False))
+        self.assertIsNone(pop_pooled_quiz(25, False))
+        # A pooled quiz is the quiz of its seed.
+        self.assertEqual(pooled_quizzes[0]["questions"], QuizGenerator(get_vocabulary_snapshot(), False, pooled_quizzes[0]["seed"]).generate_questions(10))
+
+    def test_started_quizzes_come_from_the_pool_and_never_share_a_quiz(self):
+        # The worker fills the pool inline, as soon as a quiz is taken from it.
+        with mock.patch("wordsandsentences.quiz_sessions.request_quiz_pool_refill", side_effect=fill_quiz_pool) as request_refill:
+            fill_quiz_pool(10, False)
+            pooled_seeds = {cache.get(get_quiz_pool_key(get_vocabulary_version(), 10, False, slot))["seed"] for slot in range(2)}
+            seeds = [start_quiz(10, False)[1]["seed"] for _quiz_number in range(5)]
+        self.assertIn(seeds[0], pooled_seeds)
+        self.assertEqual(len(set(seeds)), 5)
+        self.assertEqual(request_refill.call_count, 5)
+
+    def test_a_new_vocabulary_version_makes_the_pool_unreachable(self):
+        fill_quiz_pool(10, False)
+        self.vocabulary_changed()
+        self.assertIsNone(pop_pooled_quiz(10, False))
+        self.assertEqual(fill_quiz_pool(10, False), 2)
+        self.assertIsNotNone(pop_pooled_quiz(10, False))
+
+
+class QuizSchedulerTests(VocabularyTestCase):
+    def test_only_question_types_the_vocabulary_can_fill_are_picked(self):
+        # Words without audio, and no sentences: no audio or sentence questions can be made.
+        self.make_words(Topic.objects.create(topic_name="everyday", loc=0), QuizTestCase.WORDS)
+        self.vocabulary_changed()
+        snapshot = get_vocabulary_snapshot()
+        scheduler = QuizScheduler(snapshot, True)
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                question_types = scheduler.allocate(len(QuizTestCase.WORDS), random.Random(seed))
+                self.assertTrue(all(scheduler.pool_sizes[question_type] for question_type in question_types), question_types)
+                self.assertFalse(set(question_types) & {"audio_to_tone", "audio_to_not_tone", *QuizScheduler.SENTENCE_QUESTION_TYPES})
+                self.assertEqual(len(QuizGenerator(snapshot, True, seed).generate_questions(len(QuizTestCase.WORDS))), len(QuizTestCase.WORDS))
+
+    def test_a_quiz_longer_than_the_vocabulary_can_fill_is_refused(self):
+        self.make_words(Topic.objects.create(topic_name="everyday", loc=0), QuizTestCase.WORDS[:4])
+        self.vocabulary_changed()
+        with self.assertRaises(QuizGenerationError):
+            QuizScheduler(get_vocabulary_snapshot(), False).allocate(10)
+
+
+class ImportWordsCsvTests(VocabularyTestCase):
+    CSV = "\n".join([
+        "topic,jyutping,cantonese,english,notes,is_sentence,response_to",
+        "animals,gau2,,gau2 in English,,no,",
+        "animals,maa5,,horse,,no,",
+        "animals,ngau4,,cow,,no,",
+        "greetings,nei5 hou2,,hello,,yes,",
+        "greetings,nei5 hou2 maa3,,how are you,,yes,nei5 hou2",
+    ])
+
+    def setUp(self):
+        super().setUp()
+        self.make_words(Topic.objects.create(topic_name="animals", loc=0), ["gau2", "maa5", "jyu2"])
+        self.vocabulary_changed()
+
+    def import_words_csv(self, **kwargs):
+        diff = import_words_csv(SimpleUploadedFile("words.csv", self.CSV.encode()), delete_missing=True, **kwargs)
+        return {action: sorted(entry["jyutping"] for entry in entries) for action, entries in diff.items()}
+
+    def get_vocabulary(self):
+        return (
+            list(Topic.objects.order_by("id").values_list("topic_name", "loc")),
+            list(Word.objects.order_by("id").values_list("topic__topic_name", "jyutping", "english", "loc")),
+            list(Sentence.objects.order_by("id").values_list("topic__topic_name", "jyutping", "english", "loc", "response_to__jyutping")),
+        )
+
+    def test_applies_the_diff(self):
+        version = get_vocabulary_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            diff = self.import_words_csv()
+        self.assertEqual(diff, {"created": ["nei5 hou2", "nei5 hou2 maa3", "ngau4"], "updated": ["maa5"], "unchanged": ["gau2"], "deleted": ["jyu2"]})
+        self.assertEqual(list(Word.objects.order_by("loc").values_list("jyutping", "english")), [("gau2", "gau2 in English"), ("maa5", "horse"), ("ngau4", "cow")])
+        self.assertEqual(list(Sentence.objects.get(jyutping="nei5 hou2 maa3").response_to.values_list("jyutping", flat=True)), ["nei5 hou2"])
+        self.assertNotEqual(get_vocabulary_version(), version)
+        # Importing the same CSV again changes nothing.
+        with self.captureOnCommitCallbacks() as callbacks:
+            diff = self.import_words_csv()
+        self.assertEqual(diff["unchanged"], ["gau2", "maa5", "nei5 hou2", "nei5 hou2 maa3", "ngau4"])
+        self.assertEqual(callbacks, [])
+
+    def test_a_dry_run_writes_nothing(self):
+        vocabulary = self.get_vocabulary()
+        with self.captureOnCommitCallbacks() as callbacks:
+            diff = self.import_words_csv(dry_run=True)
+        self.assertEqual(diff["created"], ["nei5 hou2", "nei5 hou2 maa3", "ngau4"])
+        self.assertEqual(diff["deleted"], ["jyu2"])
+        self.assertEqual(self.get_vocabulary(), vocabulary)
+        self.assertEqual(callbacks, [])
+
+
+class RequestStatsTests(VocabularyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_words(Topic.objects.create(topic_name="animals", loc=0), ["gau2", "maa5"])
+        self.vocabulary_changed()
+        # Each test starts from the unpatched Template.render, which is put back afterwards.
+        render_patch = mock.patch.object(Template, "render", getattr(Template.render, "__wrapped__", Template.render))
+        render_patch.start()
+        self.addCleanup(render_patch.stop)
+
+    def test_a_request_records_its_queries_template_time_and_size(self):
+        log_path = os.path.join(tempfile.mkdtemp(), "request_stats.jsonl")
+        self.addCleanup(shutil.rmtree, os.path.dirname(log_path))
+        with override_settings(REQUEST_STATS=True, REQUEST_STATS_LOG=log_path):
+            # A new client, as the middleware is only set up when a client's first request is handled.
+            client = Client()
+            client.force_login(self.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get("/")
+        with open(log_path, encoding="utf-8") as log_file:
+            (record,) = [json.loads(line) for line in log_file]
+        self.assertEqual((record["view_name"], record["status_code"]), ("index", 200))
+        self.assertEqual(record["query_count"], len(queries))
+        self.assertEqual(record["response_bytes"], len(response.content))
+        self.assertGreater(record["template_ms"], 0)
+        self.assertLessEqual(record["template_ms"], record["wall_ms"])
+        self.assertEqual(get_request_stats()["index"]["query_count"][50], len(queries))
+
+    def test_included_templates_are_timed_as_part_of_the_outer_one(self):
+        def render(template, depth=0):
+            return render_and_time(template, depth + 1) if depth < 2 else "rendered"
+        render_and_time = timed_template_render(render)
+        template_seconds = [0, False]
+        token = _template_seconds.set(template_seconds)
+        self.addCleanup(_template_seconds.reset, token)
+        # Only the outermost render reads the clock, once at the start and once at the end.
+        with mock.patch("jyutpinglearningsite.middleware.time.perf_counter", side_effect=[10, 15]):
+            self.assertEqual(render_and_time(None), "rendered")
+        self.assertEqual(template_seconds[0], 5)
+
+    def test_nothing_is_patched_when_the_stats_are_off(self):
+        with override_settings(REQUEST_STATS=False), self.assertRaises(MiddlewareNotUsed):
+            RequestStatsMiddleware(lambda request: None)
+        self.assertFalse(getattr(Template.render, "timed", False))
+
+
+@skipUnless(connection.vendor == "sqlite", "Query plans are read from SQLite's EXPLAIN QUERY PLAN.")
+class QueryPlanTests(MediaFilesTestCase):
+    # Runs the views and helpers that pick out a few rows by a filter or an ordering, and checks that every query they
+    # make with a WHERE clause is served by an index rather than by reading every row of a table. Queries without one,
+    # such as the choice lists of the forms, read whole tables on purpose, as do the views built on the vocabulary
+    # snapshot, which are left out.
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.topic = Topic.objects.create(topic_name="animals", loc=0)
+        self.words = self.make_words(self.topic, [f"gau{tone}" for tone in range(1, 7)] + [f"maa{tone} {number}" for tone in range(1, 7) for number in range(10)])
+        for word in self.words[:3]:
+            word.audio_file = SimpleUploadedFile(f"{word.jyutping}.mp3", b"audio")
+            word.save()
+        Sentence.objects.create(topic=self.topic, jyutping="nei5 hou2", english="hello", loc=0)
+        self.vocabulary_changed()
+
+    def get_full_table_scans(self, sql):
+        # SQLite describes reading a whole table as "SCAN <table>", and reading by an index as "SCAN/SEARCH <table> USING ...".
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall() if re.fullmatch(r"SCAN \w+", row[-1])]
+
+    def test_queries_of_the_views_and_helpers_use_indexes(self):
+        audio_word_ids = "-".join(str(word.id) for word in self.words[:3])
+        with CaptureQueriesContext(connection) as queries:
+            for url in ["/topic_create/", f"/word_create/{self.topic.id}/", f"/sentence_create/{self.topic.id}/", f"/topic_items/{self.topic.id}/", f"/quiz/audio/{audio_word_ids}/"]:
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+            response = self.client.post("/flashcards/", {"topic": self.topic.id, "words_sentences_both": "both", "starting_side": "jyutping"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(response.context["flashcards_data"]["next_page_url"]).status_code, 200)
+            import_audio_files([("gau4.mp3", ContentFile(b"new audio"))])
+            with mock.patch("wordsandsentences.audio_renditions.can_transcode", return_value=False):
+                call_command("make_audio_renditions", stdout=StringIO())
+        filtered_queries = [query["sql"] for query in queries if query["sql"].startswith("SELECT") and " WHERE " in query["sql"]]
+        self.assertTrue(filtered_queries)
+        for sql in filtered_queries:
+            with self.subTest(sql):
+                self.assertEqual(self.get_full_table_scans(sql), [], f"This query reads a whole table:\n{sql}")
@@ -0,0 +1,128 @@
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+from array import array
+
+# Audio renditions are made in worker processes, so this module must not import Django.
+# With ffmpeg installed, renditions are loudness normalised mono MP3s. Without it, WAV uploads are turned into mono
+# 16-bit WAVs at a lower sample rate, normalised in pure Python, and anything else is served as it was uploaded.
+FFMPEG_SAMPLE_RATE = 22050
+FFMPEG_BITRATE = "48k"
+FFMPEG_LOUDNORM = "loudnorm=I=-16:TP=-1.5:LRA=11"
+WAV_SAMPLE_RATE = 16000
+WAV_TARGET_RMS = 10 ** (-20 / 20)
+WAV_PEAK_LIMIT = 10 ** (-1 / 20)
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def can_transcode(source_path):
+    return bool(shutil.which("ffmpeg")) or is_wav(source_path)
+
+
+def transcode_audio(source_path, output_dir):
+    # Returns the (path, duration in seconds) of a new rendition of the file in output_dir, or None if there is no
+    # encoder for it.
+    if shutil.which("ffmpeg"):
+        return transcode_with_ffmpeg(source_path, output_dir)
+    if is_wav(source_path):
+        return transcode_wav(source_path, output_dir)
+    return None
+
+
+def is_wav(path):
+    with open(path, "rb") as f:
+        header = f.read(12)
+    return header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+
+def transcode_with_ffmpeg(source_path, output_dir):
+    file_descriptor, output_path = tempfile.mkstemp(suffix=".mp3", dir=output_dir)
+    os.close(file_descriptor)
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error", "-y", "-i", source_path, "-vn", "-ac", "1", "-ar", str(FFMPEG_SAMPLE_RATE),
+        "-af", FFMPEG_LOUDNORM, "-codec:a", "libmp3lame", "-b:a", FFMPEG_BITRATE, output_path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode:
+        os.remove(output_path)
+        raise TranscodeError(result.stderr.strip() or f"ffmpeg exited with {result.returncode}.")
+    return output_path, get_ffmpeg_duration(output_path)
+
+
+def get_ffmpeg_duration(path):
+    if not shutil.which("ffprobe"):
+        return None
+    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path], capture_output=True, text=True)
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def read_wav_samples(source_path):
+    # The file's samples as floats from -1 to 1, averaged down to one channel, and its sample rate.
+    try:
+        with wave.open(source_path, "rb") as wav_file:
+            channels, sample_width, sample_rate = wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise TranscodeError(f"Unreadable WAV file: {e}")
+    if sample_width == 1:
+        samples = [(sample - 128) / 128 for sample in frames]
+    elif sample_width in (2, 4):
+        samples = array("h" if sample_width == 2 else "i", frames)
+        if sys.byteorder == "big":
+            samples.byteswap()
+        scale = 2 ** (sample_width * 8 - 1)
+        samples = [sample / scale for sample in samples]
+    elif sample_width == 3:
+        samples = [int.from_bytes(frames[i:i + 3], "little", signed=True) / 2 ** 23 for i in range(0, len(frames) - 2, 3)]
+    else:
+        raise TranscodeError(f"Unsupported WAV sample width: {sample_width} bytes.")
+    if channels > 1:
+        samples = [sum(frame) / channels for frame in zip(*(samples[channel::channels] for channel in range(channels)))]
+    return samples, sample_rate
+
+
+def resample(samples, sample_rate, target_rate):
+    # Linear interpolation, which is plenty for speech going down to a rate that still covers its frequencies.
+    if sample_rate == target_rate or len(samples) < 2:
+        return samples
+    step = sample_rate / target_rate
+    last = len(samples) - 1
+    resampled = []
+    for i in range(int(last / step) + 1):
+        position = i * step
+        index = int(position)
+        fraction = position - index
+        resampled.append(samples[index] if index >= last else samples[index] + (samples[index + 1] - samples[index]) * fraction)
+    return resampled
+
+
+def transcode_wav(source_path, output_dir):
+    samples, sample_rate = read_wav_samples(source_path)
+    target_rate = min(sample_rate, WAV_SAMPLE_RATE)
+    samples = resample(samples, sample_rate, target_rate)
+    # Bring every clip to the same average loudness, without letting the peaks clip.
+    gain = 1
+    if samples and (peak := max(abs(sample) for sample in samples)):
+        rms = math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+        gain = min(WAV_TARGET_RMS / rms, WAV_PEAK_LIMIT / peak)
+    pcm = array("h", (round(max(-1, min(1, sample * gain)) * 32767) for sample in samples))
+    if sys.byteorder == "big":
+        pcm.byteswap()
+    file_descriptor, output_path = tempfile.mkstemp(suffix=".wav", dir=output_dir)
+    os.close(file_descriptor)
+    with wave.open(output_path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(target_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return output_path, len(samples) / target_rate if target_rate else None
@@ -6,8 +6,15 @@ from . import views
 
 urlpatterns = [
     path('', login_required(views.IndexView.as_view(), login_url="/login/"), name='index'),
+    path('topic_items/<int:pk>/', login_required(views.TopicItemsView.as_view(), login_url="/login/"), name='topic_items'),
+    path('search/', login_required(views.SearchView.as_view(), login_url="/login/"), name='search'),
     path('quiz/', login_required(views.QuizView.as_view(), login_url="/login/"), name='quiz'),
+    path('quiz/api/', login_required(views.QuizApiView.as_view(), login_url="/login/"), name='quiz_api'),
+    path('quiz/api/check_answer/', login_required(views.QuizAnswerCheckView.as_view(), login_url="/login/"), name='quiz_api_check_answer'),
+    path('quiz/api/<str:quiz_id>/<int:page>/', login_required(views.QuizPageApiView.as_view(), login_url="/login/"), name='quiz_api_page'),
+    path('quiz/audio/<str:word_ids>/', login_required(views.QuizAudioBundleView.as_view(), login_url="/login/"), name='quiz_audio_bundle'),
     path('flashcards/', login_required(views.FlashcardsView.as_view(), login_url="/login/"), name='flashcards'),
+    path('flashcards/api/<str:deck_id>/<int:page>/', login_required(views.FlashcardsPageApiView.as_view(), login_url="/login/"), name='flashcards_api_page'),
     path('edit_list/', staff_required(views.EditListView.as_view()), name='edit_list'),
     path('topic_create/', staff_required(views.TopicCreateView.as_view()), name='topic_create'),
     path('topic_update/<int:pk>/', staff_required(views.TopicUpdateView.as_view()), name='topic_update'),
@@ -19,6 +26,9 @@ urlpatterns = [
     path('sentence_update/<int:pk>/', staff_required(views.SentenceUpdateView.as_view()), name='sentence_update'),
     path('sentence_delete/<int:pk>/', staff_required(views.SentenceDeleteView.as_view()), name='sentence_delete'),
     path('import/', staff_required(views.ImportView.as_view()), name='import'),
+    path('import/jobs/<int:pk>/', staff_required(views.ImportJobView.as_view()), name='import_job'),
+    path('import/jobs/<int:pk>/progress/', staff_required(views.ImportJobProgressView.as_view()), name='import_job_progress'),
     path('topics_export/', staff_required(views.TopicsExportView.as_view()), name='topics_export'),
     path('words_export/', staff_required(views.WordsExportView.as_view()), name='words_export'),
+    path('request_stats/', staff_required(views.RequestStatsView.as_view()), name='request_stats'),
 ]
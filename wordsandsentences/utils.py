@@ -1,13 +1,115 @@
-from django.db.models import Q
+import hashlib
+import time
 
-from .models import Topic
+from django.core.cache import cache, caches
+from django.db.models import Count
+from .jyutping import get_syllable_rows
+from .models import Topic, Word, Sentence, WordSyllable, SentenceSyllable, get_audio_url
 
 
-def get_topic_dict(exclude_empty_topics=False):
-    topic_dict = {}
-    topics = Topic.objects.all()
+VOCABULARY_VERSION_CACHE_KEY = "vocabulary_version"
+TOPICS_TIMEOUT = 60 * 60 * 24
+
+
+def get_vocabulary_version():
+    # The version is kept in its own cache (see settings.CACHES), which holds nothing else and so is never culled, and
+    # which every worker process shares. If it is cleared a fresh version is started, which simply invalidates anything
+    # derived from the old one.
+    vocabulary_cache = caches["vocabulary"]
+    if (version := vocabulary_cache.get(VOCABULARY_VERSION_CACHE_KEY)) is None:
+        vocabulary_cache.add(VOCABULARY_VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+        version = vocabulary_cache.get(VOCABULARY_VERSION_CACHE_KEY)
+    return version
+
+
+def bump_vocabulary_version(topic_ids=()):
+    # topic_ids are the topics whose words, sentences or own fields changed, which get the new version as their topic
+    # version, so that only their cached items are read again.
+    vocabulary_cache = caches["vocabulary"]
+    version = max(time.time_ns(), (vocabulary_cache.get(VOCABULARY_VERSION_CACHE_KEY) or 0) + 1)
+    vocabulary_cache.set(VOCABULARY_VERSION_CACHE_KEY, version, timeout=None)
+    if topic_ids:
+        cache.set_many({get_topic_version_key(topic_id): version for topic_id in set(topic_ids)}, timeout=None)
+    return version
+
+
+def get_topic_version_key(topic_id):
+    return f"topic_version:{topic_id}"
+
+
+def get_topic_versions(topic_ids):
+    # {topic id: the vocabulary version as of the topic's last change}. A topic whose version is missing from the cache
+    # (never changed, or culled) starts from the current vocabulary version, which at worst reads its items again.
+    cache_keys = {topic_id: get_topic_version_key(topic_id) for topic_id in topic_ids}
+    versions = cache.get_many(cache_keys.values())
+    if missing_keys := [cache_key for cache_key in cache_keys.values() if cache_key not in versions]:
+        version = get_vocabulary_version()
+        for cache_key in missing_keys:
+            cache.add(cache_key, version, timeout=None)
+        versions.update(cache.get_many(missing_keys))
+        return {topic_id: versions.get(cache_key, version) for topic_id, cache_key in cache_keys.items()}
+    return {topic_id: versions[cache_key] for topic_id, cache_key in cache_keys.items()}
+
+
+def get_topic_content_version(topic, words, sentences):
+    # A digest of everything shown for a topic, so that anything cached per topic only changes when the topic does.
+    content = [(topic.pk, topic.topic_name, topic.colour)]
+    content += [(word["id"], word["jyutping"], word["cantonese"], word["english"], word["notes"], word["audio_url"]) for word in words]
+    content += [(sentence["id"], sentence["jyutping"], sentence["cantonese"], sentence["english"], sentence["notes"]) for sentence in sentences]
+    return hashlib.md5(repr(content).encode("utf-8")).hexdigest()
+
+
+def get_topics(exclude_empty_topics=False):
+    # {topic id: topic} for every topic in order, each with its word_count and sentence_count, kept in the cache for the
+    # current vocabulary version. The words and sentences themselves are cached per topic by get_topics_items.
+    cache_key = f"topics:{get_vocabulary_version()}"
+    if (topics := cache.get(cache_key)) is None:
+        topics = {topic.id: topic for topic in Topic.objects.all()}
+        for count_name, model_class in [("word_count", Word), ("sentence_count", Sentence)]:
+            counts = dict(model_class.objects.order_by().values_list("topic_id").annotate(Count("id")))
+            for topic_id, topic in topics.items():
+                setattr(topic, count_name, counts.get(topic_id, 0))
+        cache.set(cache_key, topics, timeout=TOPICS_TIMEOUT)
     if exclude_empty_topics:
-        topics = topics.filter(Q(word__isnull=False) | Q(sentence__isnull=False)).distinct()
-    for topic in topics:
-        topic_dict[topic] = {"words": topic.word_set.all(), "sentences": topic.sentence_set.all()}
-    return topic_dict
+        return {topic_id: topic for topic_id, topic in topics.items() if topic.word_count or topic.sentence_count}
+    return topics
+
+
+def get_topics_items(topics):
+    # {topic id: {"words": [...], "sentences": [...], "content_version": "..."}} for the given topics, where each word and
+    # sentence is a dict of the fields the pages show. Each topic is cached on its own for its topic version, so a change
+    # to one topic leaves the others cached, and the topics missing from the cache are read with one query per table.
+    topic_versions = get_topic_versions([topic.id for topic in topics])
+    cache_keys = {topic.id: f"topic_items:{topic.id}:{topic_versions[topic.id]}" for topic in topics}
+    cached = cache.get_many(cache_keys.values())
+    topics_items = {topic_id: cached[cache_key] for topic_id, cache_key in cache_keys.items() if cache_key in cached}
+    if missing_topics := [topic for topic in topics if topic.id not in topics_items]:
+        built = {topic.id: {"words": [], "sentences": []} for topic in missing_topics}
+        fields = ["id", "topic_id", "jyutping", "cantonese", "english", "notes"]
+        for item in Word.objects.filter(topic_id__in=built).values(*fields, "audio_file", "audio_rendition", "audio_hash"):
+            audio_file, audio_rendition, audio_hash = item.pop("audio_file"), item.pop("audio_rendition"), item.pop("audio_hash")
+            item["audio_url"] = get_audio_url(audio_rendition or audio_file, audio_hash) if audio_file else None
+            built[item["topic_id"]]["words"].append(item)
+        for item in Sentence.objects.filter(topic_id__in=built).values(*fields):
+            built[item["topic_id"]]["sentences"].append(item)
+        for topic in missing_topics:
+            items = built[topic.id]
+            items["content_version"] = get_topic_content_version(topic, items["words"], items["sentences"])
+        cache.set_many({cache_keys[topic_id]: items for topic_id, items in built.items()}, timeout=TOPICS_TIMEOUT)
+        topics_items.update(built)
+    return {topic.id: topics_items[topic.id] for topic in topics}
+
+
+def update_syllables(model_class, items, replace=True):
+    # Replaces the syllable rows of the given words or sentences (all of one model) with ones parsed from their jyutping.
+    # Items that have only just been created have no rows to replace.
+    syllable_class = WordSyllable if model_class is Word else SentenceSyllable
+    item_field = model_class._meta.model_name
+    if replace:
+        item_ids = [item.pk for item in items]
+        for start in range(0, len(item_ids), 500):
+            syllable_class.objects.filter(**{f"{item_field}_id__in": item_ids[start:start + 500]}).delete()
+    syllable_class.objects.bulk_create((
+        syllable_class(**{item_field: item}, position=position, initial=initial, final=final, tone=tone)
+        for item in items for position, initial, final, tone in get_syllable_rows(item.jyutping)
+    ), batch_size=1000)
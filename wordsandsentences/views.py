@@ -1,23 +1,29 @@
-import codecs
-import csv
-import os
-import random
 import re
 from datetime import datetime
 
 from django.conf import settings
-from django.core.files import File
-from django.db import transaction
-from django.db.models import Q, Count
-from django.http import HttpResponse
-from django.shortcuts import render
-from django.urls import reverse_lazy
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.text import capfirst
 from django.views import generic
-import unicodecsv
 
+from jyutpinglearningsite.middleware import REQUEST_STATS_METRICS, REQUEST_STATS_PERCENTILES, get_request_stats
+from .audio_bundles import AUDIO_BUNDLE_MAX_WORDS, AUDIO_BUNDLE_TIMEOUT, get_audio_bundle, get_audio_bundle_urls
+from .exports import EXPORT_FORMATS, iter_csv, iter_saved_export, iter_topics_rows, iter_words_rows, open_saved_export, save_xlsx
+from .flashcards import FLASHCARD_PAGE_SIZE, get_deck, get_deck_page_count, get_flashcards_page, start_flashcards
 from .forms import FlashcardsStartForm, QuizStartForm, ImportForm, TopicForm, WordForm, SentenceForm
-from .models import Topic, Word, Sentence
-from .utils import get_topic_dict
+from .models import Topic, Word, Sentence, ImportJob
+from .import_jobs import create_import_job, fail_stale_import_jobs, get_import_job_progress
+from .imports import IMPORT_PREVIEW_ROWS, import_words_csv
+from .jyutping import JyutpingIndex
+from .quiz import QuizGenerationError
+from .quiz_sessions import get_page_count, get_page_questions, get_quiz_with_page, start_quiz
+from .search import SEARCH_PAGE_SIZE, SearchIndex, get_item_index
+from .snapshot import get_vocabulary_snapshot
+from .utils import get_topics, get_topics_items, get_vocabulary_version
 
 
 class IndexView(generic.TemplateView):
@@ -25,312 +31,172 @@ class IndexView(generic.TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["topic_dict"] = get_topic_dict(exclude_empty_topics=True)
+        context["topics"] = get_topics(exclude_empty_topics=True).values()
         return context
     
 
+class TopicItemsView(generic.TemplateView):
+    template_name = "wordsandsentences/index_topic.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if (topic := get_topics().get(self.kwargs["pk"])) is None:
+            raise Http404
+        context["topic"] = topic
+        context["words_and_sentences"] = get_topics_items([topic])[topic.id]
+        return context
+
+
+class SearchView(generic.View):
+    def get(self, request, *args, **kwargs):
+        snapshot = get_vocabulary_snapshot()
+        query = request.GET.get("q", "")
+        results = SearchIndex.for_snapshot(snapshot).search(query)
+        if fuzzy := not results:
+            # Nothing contains the query, so look for Jyutping that is close to it instead.
+            results = [get_item_index(item_key) for item_key, _edits in JyutpingIndex.for_snapshot(snapshot).lookup(query)]
+        try:
+            page = max(int(request.GET.get("page", 0)), 0)
+        except ValueError:
+            page = 0
+        page_results = []
+        for index, is_sentence in results[page * SEARCH_PAGE_SIZE:(page + 1) * SEARCH_PAGE_SIZE]:
+            table = snapshot.table(is_sentence)
+            page_results.append({
+                "type": "sentence" if is_sentence else "word",
+                "id": table.ids[index],
+                "topic_id": table.topic_ids[index],
+                "topic_name": capfirst(snapshot.topic_names[table.topic_ids[index]]),
+                "jyutping": table.jyutping[index],
+                "cantonese": table.cantonese[index],
+                "english": table.english[index],
+            })
+        return JsonResponse({
+            "result_count": len(results),
+            "fuzzy": fuzzy,
+            "page": page,
+            "results": page_results,
+            "next_page": page + 1 if (page + 1) * SEARCH_PAGE_SIZE < len(results) else None,
+        })
+
+
 class QuizView(generic.FormView):
     template_name = "wordsandsentences/quiz_start.html"
     form_class = QuizStartForm
 
-    @staticmethod
-    def get_question_type(include_audio):
-        word_count = Word.objects.all().count()
-        sentence_count = Sentence.objects.all().count()
-        sentences_without_responses_count = Sentence.objects.filter(response_to=None).count()
-        if include_audio:
-            word_portion = word_count * 0.25 / (word_count * 0.25 + sentence_count)
-        else:
-            word_portion = word_count * 0.075 / (word_count * 0.075 + sentence_count)
-        sentences_without_responses_portion = sentences_without_responses_count / sentence_count
-        question_category_random = random.random()
-        question_type_random = random.random()
-        if question_category_random > 0.59:  # General questions
-            if question_type_random > 0.6:
-                return "j_to_e"
-            elif question_type_random > 0.27:
-                return "e_to_j_buttons"
-            else:
-                return "e_to_j_text"
-        question_category_random /= 0.59
-        if question_category_random <= word_portion:  # Word questions
-            if include_audio:
-                if question_type_random > 0.63:
-                    return "audio_to_tone"
-                elif question_type_random > 0.3:
-                    return "audio_to_not_tone"
-                else:
-                    return "topic_to_not_linked_word"
-            else:
-                return "topic_to_not_linked_word"
-        question_category_random -= word_portion
-        if question_category_random <= (1 - sentences_without_responses_portion) / 2:  # Sentence (with responses) questions
-            if question_type_random > 0.78:
-                return "sentence_to_response_buttons"
-            elif question_type_random > 0.5:
-                return "sentence_to_response_text"
-            elif question_type_random > 0.22:
-                return "response_to_sentence_buttons"
-            else:
-                return "response_to_sentence_text"
-        else:  # Sentence questions 
-            if question_type_random > 0.67:
-                return "sentence_to_missing_word_buttons"
-            elif question_type_random > 0.36:
-                return "sentence_to_missing_word_text"
-            else:
-                return "words_to_ordered_sentence"
-        
-    @staticmethod
-    def get_random_word_or_sentence(exclude_word_ids=[], exclude_sentence_ids=[]):
-        words = Word.objects.all()
-        if exclude_word_ids:
-            words = words.exclude(id__in=exclude_word_ids)
-        sentences = Sentence.objects.all()
-        if exclude_sentence_ids:
-            sentences = sentences.exclude(id__in=exclude_sentence_ids)
-        word = random.choice(list(words) + list(sentences))
-        return word, type(word) == Sentence
-    
-    @staticmethod
-    def get_random_word(exclude_english=[], exclude_jyutping=[], exclude_ids=[], include_tone=None, audio_only=False, single_jyutping_word_only=False):
-        words = Word.objects.all()
-        if exclude_english or exclude_jyutping:
-            words = words.exclude(Q(english__in=exclude_english) | Q(jyutping__in=exclude_jyutping))
-        if exclude_ids:
-            words = words.exclude(id__in=exclude_ids)
-        if audio_only:
-            words = words.exclude(audio_file__in=["", None])
-        if single_jyutping_word_only:
-            words = words.exclude(jyutping__icontains=" ")
-        if include_tone:
-            words = words.filter(jyutping__icontains=include_tone)
-        return random.choice(words)
-    
-    @staticmethod
-    def get_random_sentence(exclude_english=[], exclude_jyutping=[], exclude_ids=[]):
-        sentences = Sentence.objects.all()
-        if exclude_english or exclude_jyutping:
-            sentences = sentences.exclude(Q(english__in=exclude_english) | Q(jyutping__in=exclude_jyutping))
-        if exclude_ids:
-            sentences = sentences.exclude(id__in=exclude_ids)
-        return random.choice(sentences)
-    
-    def get_incorrect_words(self, correct_word, is_sentence, exclude_ids=[], include_tone=None, audio_only=False, single_jyutping_word_only=False):
-        if correct_word:
-            exclude_english = [correct_word.english]
-            exclude_jyutping = [correct_word.jyutping]
-        else:
-            exclude_english = []
-            exclude_jyutping = []
-        incorrect_words = []
-        for _i in range(3):
-            if is_sentence:
-                incorrect_word = self.get_random_sentence(exclude_english=exclude_english, exclude_jyutping=exclude_jyutping, exclude_ids=exclude_ids)
-            else:
-                incorrect_word = self.get_random_word(exclude_english=exclude_english, exclude_ids=exclude_ids, exclude_jyutping=exclude_jyutping, include_tone=include_tone, audio_only=audio_only, single_jyutping_word_only=single_jyutping_word_only)
-            exclude_english.append(incorrect_word.english)
-            exclude_jyutping.append(incorrect_word.jyutping)
-            incorrect_words.append(incorrect_word)
-        return incorrect_words
-        
     def form_valid(self, form):
-        question_count = int(form.cleaned_data["question_count"])
-        include_audio = form.cleaned_data["include_audio"]
-        used_word_ids = []
-        used_sentence_ids = []
-        questions = []
-        sentence_ids_without_responses = list(Sentence.objects.filter(responses=None).values_list("id", flat=True))
-        sentence_ids_without_response_to = list(Sentence.objects.filter(response_to=None).values_list("id", flat=True))
-        # Filter out sentences where the number of responses/response_to is greater than SENTENCE_COUNT - 3  <- as there are not enough incorrect answers to use.
-        sentence_count = Sentence.objects.all().count()
-        sentence_ids_with_too_many_responses = list(Sentence.objects.exclude(responses=None).annotate(c=Count('responses')).filter(c__gte=sentence_count - 3).values_list("id", flat=True))
-        sentences_ids_with_too_many_response_to = list(Sentence.objects.exclude(response_to=None).annotate(c=Count('response_to')).filter(c__gte=sentence_count - 3).values_list("id", flat=True))
-
-        def generate_question_dict(question_type):
-            match question_type:
-                case "j_to_e":
-                    correct_word, is_sentence = self.get_random_word_or_sentence(exclude_word_ids=used_word_ids, exclude_sentence_ids=used_sentence_ids)
-                    if is_sentence:
-                        used_sentence_ids.append(correct_word.id)
-                    else:
-                        used_word_ids.append(correct_word.id)
-                    question_audio_url = correct_word.audio_file.url if not is_sentence and correct_word.audio_file and include_audio else None
-                    if question_audio_url and random.randint(0, 1) == 1:
-                        question_text = f"What is the English translation of this Cantonese word?"
-                    else:
-                        question_text = f"What is the English translation of '{correct_word.cantonese_and_jyutping}'?"
-                    incorrect_words = self.get_incorrect_words(correct_word, is_sentence)
-                    options = [{"text": word.english, "cantonese": None, "audio_url": None, "hide_text": False} for word in [incorrect_word for incorrect_word in incorrect_words] + [correct_word]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": question_audio_url, "correct": correct_word.english, "options": options, "ordering_options": None})
-                case "e_to_j_buttons":
-                    correct_word, is_sentence = self.get_random_word_or_sentence(exclude_word_ids=used_word_ids, exclude_sentence_ids=used_sentence_ids)
-                    if is_sentence:
-                        used_sentence_ids.append(correct_word.id)
-                    else:
-                        used_word_ids.append(correct_word.id)
-                    if (option_audio_only := not is_sentence and correct_word.audio_file and include_audio and random.randint(0, 1) == 1):
-                        question_text = f"What is the Cantonse word for '{correct_word.english}'?"
-                    else:
-                        question_text = f"What is the Jyutping representation of '{correct_word.english}'?"
-                    incorrect_words = self.get_incorrect_words(correct_word, is_sentence, audio_only=option_audio_only)
-                    options = [{"text": word.jyutping, "cantonese": word.cantonese, "audio_url": word.audio_file.url if not is_sentence and word.audio_file and include_audio else None, "hide_text": option_audio_only} for word in [incorrect_word for incorrect_word in incorrect_words] + [correct_word]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_word.jyutping, "options": options, "ordering_options": None})
-                case "e_to_j_text":
-                    correct_word, is_sentence = self.get_random_word_or_sentence(exclude_word_ids=used_word_ids, exclude_sentence_ids=used_sentence_ids)
-                    if is_sentence:
-                        correct_qs = Sentence.objects.filter(english=correct_word.english)
-                        for c in correct_qs:
-                            used_sentence_ids.append(c.id)
-                    else:
-                        correct_qs = Word.objects.filter(english=correct_word.english)
-                        for c in correct_qs:
-                            used_word_ids.append(c.id)
-                    correct_list = list(correct_qs.values_list("jyutping", flat=True))
-                    question_text = f"What is the Jyutping representation of '{correct_word.english}'?"
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_list, "options": None, "ordering_options": None})
-                case "audio_to_tone":
-                    word = self.get_random_word(exclude_ids=used_word_ids, audio_only=True, single_jyutping_word_only=True)
-                    used_word_ids.append(word.id)
-                    question_audio_url = word.audio_file.url
-                    question_text = f"What tone is used for this word?"
-                    options = [{"text": str(tone_num), "cantonese": None, "audio_url": None, "hide_text": False} for tone_num in [1, 2, 3, 4, 5, 6]]
-                    questions.append({"question_text": question_text, "question_audio_url": question_audio_url, "correct": word.jyutping[-1], "options": options, "ordering_options": None})
-                case "audio_to_not_tone":
-                    correct_word = self.get_random_word(exclude_ids=used_word_ids, audio_only=True)
-                    used_word_ids.append(correct_word.id)
-                    tones_in_word = set(re.findall(r'\d+', correct_word.jyutping))
-                    tones_not_in_word = list(set(["1", "2", "3", "4", "5", "6"]).difference(tones_in_word))
-                    excluded_tone = random.choice(tones_not_in_word)
-                    question_text = f"Which of these does not use tone {excluded_tone}?"
-                    incorrect_words = self.get_incorrect_words(correct_word, False, include_tone=excluded_tone, audio_only=True)
-                    options = [{"text": word.jyutping, "cantonese": word.cantonese, "audio_url": word.audio_file.url, "hide_text": True} for word in [incorrect_word for incorrect_word in incorrect_words] + [correct_word]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_word.jyutping, "options": options, "ordering_options": None})
-                case "topic_to_not_linked_word":
-                    # Only include topics with at least three words.
-                    topic = random.choice(Topic.objects.all().annotate(word_count=Count("word")).filter(word_count__gte=3))
-                    correct_word = self.get_random_word(exclude_ids=list(Word.objects.filter(topic=topic).values_list("id", flat=True)) + used_word_ids)
-                    used_word_ids.append(correct_word.id)
-                    option_audio_only = correct_word.audio_file and include_audio and random.randint(0, 1) == 1 and topic.word_set.exclude(audio_file__in=["", None]).count() >= 3
-                    question_text = f"Which of these is not associated with the topic '{topic.topic_name}'?"
-                    incorrect_words = self.get_incorrect_words(correct_word, False, exclude_ids=Word.objects.exclude(topic=topic).values_list("id", flat=True), audio_only=option_audio_only)
-                    options = [{"text": word.jyutping, "cantonese": word.cantonese, "audio_url": word.audio_file.url if word.audio_file and include_audio else None, "hide_text": option_audio_only} for word in [incorrect_word for incorrect_word in incorrect_words] + [correct_word]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_word.jyutping, "options": options, "ordering_options": None})
-                case "sentence_to_response_buttons":
-                    if len(set(sentence_ids_without_responses + sentence_ids_with_too_many_responses + used_sentence_ids)) == sentence_count:
-                        # Fall back on a basic question if we have run out of words with responses.
-                        return generate_question_dict("j_to_e")
-                    question_sentence = self.get_random_sentence(exclude_ids=sentence_ids_without_responses + sentence_ids_with_too_many_responses + used_sentence_ids)
-                    used_sentence_ids.append(question_sentence.id)
-                    question_responses = question_sentence.responses.all()
-                    correct_sentence = random.choice(question_responses)
-                    question_text = f"Which of these would be a response to '{question_sentence.cantonese_and_jyutping}'?"
-                    incorrect_sentences = self.get_incorrect_words(correct_sentence, True, exclude_ids=list(question_responses.values_list("id", flat=True)) + [question_sentence.id])
-                    options = [{"text": sentence.jyutping, "cantonese": sentence.cantonese, "audio_url": None, "hide_text": False} for sentence in [incorrect_sentence for incorrect_sentence in incorrect_sentences] + [correct_sentence]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_sentence.jyutping, "options": options, "ordering_options": None})
-                case "sentence_to_response_text":
-                    if len(set(sentence_ids_without_responses + used_sentence_ids)) == sentence_count:
-                        return generate_question_dict("j_to_e")
-                    question_sentence = self.get_random_sentence(exclude_ids=sentence_ids_without_responses + used_sentence_ids)
-                    used_sentence_ids.append(question_sentence.id)
-                    question_responses = question_sentence.responses.all()
-                    question_text = f"What would be a response to '{question_sentence.cantonese_and_jyutping}'?"
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": list(question_responses.values_list("jyutping", flat=True)), "options": None, "ordering_options": None})
-                case "response_to_sentence_buttons":
-                    if len(set(sentence_ids_without_response_to + sentences_ids_with_too_many_response_to + used_sentence_ids)) == sentence_count:
-                        return generate_question_dict("j_to_e")
-                    question_sentence = self.get_random_sentence(exclude_ids=sentence_ids_without_response_to + sentences_ids_with_too_many_response_to + used_sentence_ids)
-                    used_sentence_ids.append(question_sentence.id)
-                    question_response_to = question_sentence.response_to.all()
-                    correct_sentence = random.choice(question_response_to)
-                    question_text = f"Which of these would '{question_sentence.cantonese_and_jyutping}' be a response to?"
-                    incorrect_sentences = self.get_incorrect_words(correct_sentence, True, exclude_ids=list(question_response_to.values_list("id", flat=True)) + [question_sentence.id])
-                    options = [{"text": sentence.jyutping, "cantonese": sentence.cantonese, "audio_url": None, "hide_text": False} for sentence in [incorrect_sentence for incorrect_sentence in incorrect_sentences] + [correct_sentence]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_sentence.jyutping, "options": options, "ordering_options": None})
-                case "response_to_sentence_text":
-                    if len(set(sentence_ids_without_response_to + used_sentence_ids)) == sentence_count:
-                        return generate_question_dict("j_to_e")
-                    question_sentence = self.get_random_sentence(exclude_ids=sentence_ids_without_response_to + used_sentence_ids)
-                    used_sentence_ids.append(question_sentence.id)
-                    question_response_to = question_sentence.response_to.all()
-                    question_text = f"What would '{question_sentence.cantonese_and_jyutping}' be a response to?"
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": list(question_response_to.values_list("jyutping", flat=True)), "options": None, "ordering_options": None})
-                case "sentence_to_missing_word_buttons":
-                    sentence = self.get_random_sentence(exclude_ids=used_sentence_ids)
-                    used_sentence_ids.append(sentence.id)
-                    sentence_word_array = sentence.jyutping.replace("?", "").split(" ")
-                    correct_word_index = random.choice(range(len(sentence_word_array)))
-                    correct_word_jyutping = sentence_word_array[correct_word_index]
-                    question_text = f"""Fill in the blank: '{' '.join(["_" if i == correct_word_index else sentence_word for i, sentence_word in enumerate(sentence_word_array)])}{"?" if "?" in sentence.jyutping else ""}'."""
-                    incorrect_words = self.get_incorrect_words(None, False, exclude_ids=Word.objects.filter(jyutping=correct_word_jyutping).values_list("id", flat=True), single_jyutping_word_only=True)
-                    options = [{"text": word_jyutping, "audio_url": None, "hide_text": False} for word_jyutping in [incorrect_word.jyutping for incorrect_word in incorrect_words] + [correct_word_jyutping]]
-                    random.shuffle(options)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": correct_word_jyutping, "options": options, "ordering_options": None})
-                case "sentence_to_missing_word_text":
-                    sentence = self.get_random_sentence(exclude_ids=used_sentence_ids)
-                    used_sentence_ids.append(sentence.id)
-                    sentence_word_array = sentence.jyutping.replace("?", "").split(" ")
-                    correct_word_index = random.choice(range(len(sentence_word_array)))
-                    correct_word_jyutping = sentence_word_array[correct_word_index]
-                    question_text = f"""Fill in the blank: '{' '.join(["_" if i == correct_word_index else sentence_word for i, sentence_word in enumerate(sentence_word_array)])}{"?" if "?" in sentence.jyutping else ""}'."""
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": [correct_word_jyutping], "options": None, "ordering_options": None})
-                case "words_to_ordered_sentence":
-                    sentence = self.get_random_sentence(exclude_ids=used_sentence_ids)
-                    used_sentence_ids.append(sentence.id)
-                    sentence_word_array = sentence.jyutping.replace("?", "").split(" ")
-                    question_text = f"Order these words to form the Jyutping representation of '{sentence.english}'."
-                    sentence_word_array_shuffled = [sentence_word for sentence_word in sentence_word_array]
-                    random.shuffle(sentence_word_array_shuffled)
-                    questions.append({"question_text": question_text, "question_audio_url": None, "correct": sentence_word_array, "options": None, "ordering_options": sentence_word_array_shuffled, "include_question_mark": "?" in sentence.jyutping})
-                case _:
-                    raise Exception(f"Unknown question type {question_type}")
-            
-        for _question_number in range(question_count):
-            if settings.DEBUG:
-                generate_question_dict(self.get_question_type(include_audio))
-            else:
-                for attempt_count in range(5):
-                    try:
-                        generate_question_dict(self.get_question_type(include_audio))
-                        break
-                    except Exception as _e:
-                        if attempt_count == 4:
-                            raise Exception("Quiz generation failed; try adding more words to the database.")
-            
-        return render(self.request, "wordsandsentences/quiz.html", {"questions": questions})
+        try:
+            quiz_id, quiz = start_quiz(int(form.cleaned_data["question_count"]), form.cleaned_data["include_audio"], form.cleaned_data["seed"])
+        except QuizGenerationError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
+        # The page renders the questions itself, starting from the first page and fetching the rest as they are needed.
+        return render(self.request, "wordsandsentences/quiz.html", {"quiz_data": get_quiz_page_data(quiz_id, quiz, 0)})
+
+
+def get_quiz_page_data(quiz_id, quiz, page):
+    questions = get_page_questions(quiz, page)
+    return {
+        "quiz_id": quiz_id,
+        "seed": quiz["seed"],
+        "vocabulary_version": quiz["vocabulary_version"],
+        "question_count": quiz["question_count"],
+        "page": page,
+        "questions": questions,
+        # Audio quizzes are generated in full when they start, so the first page brings the audio of the whole quiz.
+        "audio_bundle_urls": get_audio_bundle_urls(get_vocabulary_snapshot(), quiz["questions"]) if quiz["include_audio"] and page == 0 else [],
+        "next_page_url": reverse("quiz_api_page", args=[quiz_id, page + 1]) if page + 1 < get_page_count(quiz) else None,
+    }
+
+
+class QuizApiView(generic.View):
+    def post(self, request, *args, **kwargs):
+        form = QuizStartForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors}, status=400)
+        try:
+            quiz_id, quiz = start_quiz(int(form.cleaned_data["question_count"]), form.cleaned_data["include_audio"], form.cleaned_data["seed"])
+        except QuizGenerationError as e:
+            return JsonResponse({"errors": {"__all__": [str(e)]}}, status=400)
+        return JsonResponse(get_quiz_page_data(quiz_id, quiz, 0))
+
+
+class QuizAnswerCheckView(generic.View):
+    def get(self, request, *args, **kwargs):
+        # A typed Jyutping answer is accepted if it leaves out tones or has one letter wrong, as long as the closest
+        # matching word or sentence is one of the correct answers. An answer that is some other item's jyutping (or only
+        # differs from it by the tones it leaves out) is closer to that item, so it is wrong even if it is also one letter
+        # away from a correct answer.
+        correct_answers = {correct_answer.lower().replace("?", "") for correct_answer in request.GET.getlist("correct")}
+        snapshot = get_vocabulary_snapshot()
+        matches = JyutpingIndex.for_snapshot(snapshot).lookup(request.GET.get("answer", ""), wrong_tone_is_edit=False)
+        # lookup() returns the matches with the fewest edits first.
+        for item_key, edits in matches:
+            if edits > matches[0][1]:
+                break
+            index, is_sentence = get_item_index(item_key)
+            if (jyutping := snapshot.table(is_sentence).jyutping[index]).lower().replace("?", "") in correct_answers:
+                return JsonResponse({"correct": True, "matched": jyutping})
+        return JsonResponse({"correct": False, "matched": None})
+
+
+class QuizPageApiView(generic.View):
+    def get(self, request, quiz_id, page, *args, **kwargs):
+        try:
+            quiz = get_quiz_with_page(quiz_id, page)
+        except QuizGenerationError as e:
+            # The vocabulary has changed since the quiz started and no longer has the items for the rest of it.
+            return JsonResponse({"errors": {"__all__": [str(e)]}}, status=409)
+        if quiz is None:
+            raise Http404
+        return JsonResponse(get_quiz_page_data(quiz_id, quiz, page))
     
 
+class QuizAudioBundleView(generic.View):
+    def get(self, request, word_ids, *args, **kwargs):
+        if not re.fullmatch(r"\d+(-\d+)*", word_ids):
+            raise Http404
+        word_ids = [int(word_id) for word_id in word_ids.split("-")]
+        if word_ids != sorted(set(word_ids)) or len(word_ids) > AUDIO_BUNDLE_MAX_WORDS:
+            raise Http404
+        # Bundles asked for by the current vocabulary version never change, so they can be kept by the browser for good.
+        version = get_vocabulary_version()
+        response = HttpResponse(get_audio_bundle(word_ids, version), content_type="application/octet-stream")
+        if request.GET.get("v") == str(version):
+            patch_cache_control(response, private=True, max_age=AUDIO_BUNDLE_TIMEOUT, immutable=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 class FlashcardsView(generic.FormView):
     template_name = "wordsandsentences/flashcards_start.html"
     form_class = FlashcardsStartForm
 
     def form_valid(self, form):
-        topic = form.cleaned_data["topic"]
-        randomise_order = form.cleaned_data["randomise_order"]
-        words_sentences_both = form.cleaned_data["words_sentences_both"]
-        starting_side = form.cleaned_data["starting_side"]
-        if words_sentences_both == "sentences":
-            words = Word.objects.none()
-        else:
-            words = Word.objects.all()
-        if words_sentences_both == "words":
-            sentences = Sentence.objects.none()
-        else:
-            sentences = Sentence.objects.all()
-        if topic:
-            words = words.filter(topic=topic)
-            sentences = sentences.filter(topic=topic)
-        words_and_sentences = list(words) + list(sentences)
-        if randomise_order:
-            random.shuffle(words_and_sentences)
-        return render(self.request, "wordsandsentences/flashcards.html", {"words_and_sentences": words_and_sentences, "starting_side": starting_side})
+        deck_id, card_keys = start_flashcards(form.cleaned_data["topic"], form.cleaned_data["randomise_order"], form.cleaned_data["words_sentences_both"])
+        # The page renders the cards itself, starting from the first page of the deck and fetching the rest as they are needed.
+        return render(self.request, "wordsandsentences/flashcards.html", {"flashcards_data": get_flashcards_page_data(deck_id, card_keys, 0), "starting_side": form.cleaned_data["starting_side"]})
+
 
+def get_flashcards_page_data(deck_id, card_keys, page):
+    cards, topic_colours = get_flashcards_page(card_keys, page)
+    return {
+        "deck_id": deck_id,
+        "card_count": len(card_keys),
+        "page": page,
+        "page_size": FLASHCARD_PAGE_SIZE,
+        "cards": cards,
+        "topic_colours": topic_colours,
+        "next_page_url": reverse("flashcards_api_page", args=[deck_id, page + 1]) if page + 1 < get_deck_page_count(card_keys) else None,
+    }
+
+
+class FlashcardsPageApiView(generic.View):
+    def get(self, request, deck_id, page, *args, **kwargs):
+        if (card_keys := get_deck(deck_id)) is None or not 0 <= page < get_deck_page_count(card_keys):
+            raise Http404
+        return JsonResponse(get_flashcards_page_data(deck_id, card_keys, page))
 
 
 class EditListView(generic.TemplateView):
@@ -338,7 +204,8 @@ class EditListView(generic.TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["topic_dict"] = get_topic_dict()
+        topics = get_topics().values()
+        context["topic_dict"] = dict(zip(topics, get_topics_items(topics).values()))
         return context
 
 
@@ -448,157 +315,107 @@ class SentenceDeleteView(generic.DeleteView):
 class ImportView(generic.FormView):
     template_name = "wordsandsentences/import.html"
     form_class = ImportForm
-    success_url = reverse_lazy("index")
 
     def form_valid(self, form):
-        if topics_csv := form.cleaned_data["topics_csv"]:
-            csv_rows = list(csv.DictReader(topics_csv.file.read().decode('utf-8-sig').splitlines()))
-            with transaction.atomic():
-                try:
-                    all_topics = Topic.objects.all()
-                    imported_topic_names = [row["topic_name"] for row in csv_rows]
-                    loc = 0
-                    # Get existing topics and make sure they maintain their order before we add the new topics.
-                    for topic in all_topics.exclude(topic_name__in=imported_topic_names):
-                        print(f"Setting loc of existing topic {topic.topic_name} to {loc}")
-                        topic.loc = loc
-                        topic.save()
-                        loc += 10
-                    for row in csv_rows:
-                        imported_topic_name = row["topic_name"]
-                        topic, created = Topic.objects.get_or_create(topic_name=imported_topic_name, defaults={"loc": loc})
-                        topic.colour = row["colour"]
-                        print(f"Assigning colour {topic.colour} to {topic.topic_name}")
-                        if created:
-                            topic.loc = loc
-                        topic.save()
-                        loc += 10
-                except Exception as e:
-                    return render(self.request, self.template_name, {"form": form, "import_error": f"Error in topics CSV: {e}"})
-        if words_csv := form.cleaned_data["words_csv"]:
-            csv_rows = list(csv.DictReader(words_csv.file.read().decode('utf-8-sig').splitlines()))
-            with transaction.atomic():
-                try:
-                    # Create topics
-                    all_topics = Topic.objects.all()
-                    existing_topic_names = list(all_topics.values_list("topic_name", flat=True))
-                    next_topic_loc = all_topics.last().loc + 10 if all_topics.exists() else 0
-                    for row in csv_rows:
-                        if (topic := row["topic"]) not in existing_topic_names:
-                            Topic.objects.create(topic_name=topic, loc=next_topic_loc)
-                            print(f"Creating topic {topic}")
-                            next_topic_loc += 10
-                            existing_topic_names.append(topic)
-                    # Sort objects by topic
-                    words_by_topic = {}
-                    sentences_by_topic = {}
-                    for row in csv_rows:
-                        print(f"Adding row to topic dict: {row}")
-                        topic = row["topic"]
-                        is_sentence = row["is_sentence"].lower() == "yes"
-                        if is_sentence:
-                            model_dict = sentences_by_topic
-                        else:
-                            model_dict = words_by_topic
-                        if topic not in model_dict:
-                            model_dict[topic] = []
-                        model_dict[topic].append(row)
-                    # Create objects
-                    topic_ids_by_name = {topic.topic_name: topic.id for topic in Topic.objects.all()}
-                    for model_class, model_dict in [(Word, words_by_topic), (Sentence, sentences_by_topic)]:
-                        existing_objs = model_class.objects.all()
-                        objs_to_create = []
-                        objs_to_update = []
-                        for topic, rows in model_dict.items():
-                            existing_objs_for_topic = existing_objs.filter(topic__topic_name=topic)
-                            existing_objs_for_topic_by_jyutping = {obj.jyutping: obj for obj in existing_objs_for_topic}
-                            jyutping_values = [row["jyutping"] for row in rows]
-                            loc = 0
-                            # Get existing objects and make sure they maintain their order before we add the new objects.
-                            for obj in existing_objs_for_topic.exclude(jyutping__in=jyutping_values):
-                                print(f"Setting loc of existing object {obj.jyutping} to {loc}")
-                                obj.loc = loc
-                                obj.save()
-                                loc += 10
-                            # Create/update objects in the CSV.
-                            for row in rows:
-                                if (jyutping := row["jyutping"]) in existing_objs_for_topic_by_jyutping.keys():
-                                    print(f"Updating object {jyutping}")
-                                    obj = existing_objs_for_topic_by_jyutping[jyutping]
-                                    obj.cantonese = row["cantonese"]
-                                    obj.english = row["english"]
-                                    obj.notes = row["notes"]
-                                    obj.loc = loc
-                                    objs_to_update.append(obj)
-                                else:
-                                    print(f"Creating object {jyutping}")
-                                    obj = model_class(topic_id=topic_ids_by_name[topic], jyutping=jyutping, cantonese=row["cantonese"], english=row["english"], notes=row["notes"], loc=loc)
-                                    objs_to_create.append(obj)
-                                loc += 10
-                        if objs_to_create:
-                            model_class.objects.bulk_create(objs_to_create)
-                        if objs_to_update:
-                            model_class.objects.bulk_update(objs_to_update, ["cantonese", "english", "notes", "loc"])
-                    for topic, sentence_rows in sentences_by_topic.items():
-                        for sentence_row in sentence_rows:
-                            if sentence_row["response_to"]:
-                                response_to_obj_list = []
-                                for response_to in sentence_row["response_to"].replace(", ", ",").split(","):
-                                    try:
-                                        response_to_obj = Sentence.objects.get(jyutping=response_to)
-                                    except Sentence.MultipleObjectsReturned:
-                                        response_to_obj = Sentence.objects.get(topic__topic_name=topic, jyutping=response_to)
-                                    response_to_obj_list.append(response_to_obj)
-                                Sentence.objects.get(topic__topic_name=topic, jyutping=sentence_row["jyutping"]).response_to.set(response_to_obj_list)
-                                
-                except Exception as e:
-                    return render(self.request, self.template_name, {"form": form, "import_error": f"Error in words CSV: {e}"})
-        if audio_files := form.cleaned_data["audio_files"]:
-            with transaction.atomic():
-                try:
-                    for audio_file in audio_files:
-                        file_name = audio_file.name.split(".")[0]
-                        words = Word.objects.filter(jyutping__iexact=file_name)
-                        if not words.exists():
-                            raise Exception(f"No word found with jyutping '{file_name}'.")
-                        for word in words:
-                            if word.audio_file and os.path.isfile(word.audio_file.path):
-                                os.remove(word.audio_file.path)
-                            print(f"Attaching audio file to {word}")
-                            word.audio_file = File(audio_file.file, name=audio_file.name)
-                            word.save()
-                except Exception as e:
-                    return render(self.request, self.template_name, {"form": form, "import_error": f"Error in audio files: {e}"})
-
-        return super().form_valid(form)
+        if form.cleaned_data["dry_run"]:
+            # Only the words CSV is previewed, as topics and audio files are simple enough to check by eye.
+            try:
+                import_diff = import_words_csv(form.cleaned_data["words_csv"], dry_run=True, delete_missing=form.cleaned_data["delete_missing"])
+            except Exception as e:
+                return self.render_to_response(self.get_context_data(form=form, import_error=f"Error in words CSV: {e}"))
+            import_preview = [(action, len(entries), entries[:IMPORT_PREVIEW_ROWS] if action != "unchanged" else []) for action, entries in import_diff.items()]
+            return self.render_to_response(self.get_context_data(form=form, import_preview=import_preview, import_preview_rows=IMPORT_PREVIEW_ROWS))
+        # Imports can take longer than a request is allowed to, so they run as a background job.
+        job = create_import_job(form.cleaned_data["topics_csv"], form.cleaned_data["words_csv"], form.cleaned_data["audio_files"], form.cleaned_data["delete_missing"])
+        return redirect("import_job", pk=job.pk)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        fail_stale_import_jobs()
+        context["import_jobs"] = ImportJob.objects.all()[:10]
+        return context
+
+
+class ImportJobView(generic.DetailView):
+    model = ImportJob
+    template_name = "wordsandsentences/import_job.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["import_job_progress"] = get_import_job_progress(self.object)
+        return context
+
+
+class ImportJobProgressView(generic.View):
+    def get(self, request, *args, **kwargs):
+        try:
+            job = ImportJob.objects.get(pk=kwargs["pk"])
+        except ImportJob.DoesNotExist:
+            raise Http404
+        return JsonResponse(get_import_job_progress(job))
     
 
-class TopicsExportView(generic.View):
-    def get(request, *args, **kwargs):
-        response = HttpResponse(
-            content_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=Jyutping topics {datetime.now().date().strftime('%d-%m-%Y')}.csv"}
-        )
-        response.write(codecs.BOM_UTF8)  # Force into UTF-8 so that it accepts Chinese characters.
-        writer = unicodecsv.writer(response)
-        writer.writerow(["topic_name", "colour"])
-        for topic in Topic.objects.all():
-            writer.writerow([topic.topic_name, topic.colour])
+class ExportView(generic.View):
+    # Exports are streamed as they are read from the database: CSV row by row, and XLSX from a file once the same rows
+    # have been written into it. ?format=xlsx picks XLSX.
+    # Each export is tagged with the vocabulary version, which is also when the vocabulary last changed, so that
+    # clients can ask for it only if it has changed, and the last export is served from disk until it does.
+    export_name = None
+    file_name = None
+    sheet_title = None
+
+    def get_rows(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+        version = get_vocabulary_version()
+        etag = f'"{self.export_name}-{export_format}-{version}"'
+        last_modified = version // 1_000_000_000
+        if (response := get_conditional_response(request, etag=etag, last_modified=last_modified)) is None:
+            headers = {"Content-Disposition": f"attachment; filename={self.file_name} {datetime.now().date().strftime('%d-%m-%Y')}.{export_format}"}
+            if saved_export := open_saved_export(self.export_name, export_format, version):
+                response = FileResponse(saved_export, content_type=EXPORT_FORMATS[export_format], headers=headers)
+            elif export_format == "xlsx":
+                response = FileResponse(save_xlsx(self.get_rows(), self.sheet_title, self.export_name, version), content_type=EXPORT_FORMATS["xlsx"], headers=headers)
+            else:
+                response = StreamingHttpResponse(iter_saved_export(iter_csv(self.get_rows()), self.export_name, "csv", version), content_type=EXPORT_FORMATS["csv"], headers=headers)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
         return response
+
+
+class TopicsExportView(ExportView):
+    export_name = "topics"
+    file_name = "Jyutping topics"
+    sheet_title = "Topics"
+
+    def get_rows(self):
+        return iter_topics_rows()
     
 
-class WordsExportView(generic.View):
-    def get(request, *args, **kwargs):
-        response = HttpResponse(
-            content_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=Jyutping words {datetime.now().date().strftime('%d-%m-%Y')}.csv"}
-        )
-        response.write(codecs.BOM_UTF8)  # Force into UTF-8 so that it accepts Chinese characters.
-        writer = unicodecsv.writer(response)
-        writer.writerow(["topic", "jyutping", "cantonese", "english", "notes", "is_sentence", "response_to"])
-        for topic in Topic.objects.all():
-            for word in topic.word_set.all():
-                writer.writerow([word.topic.topic_name, word.jyutping, word.cantonese, word.english, word.notes, "no", ""])
-            for sentence in topic.sentence_set.all():
-                writer.writerow([sentence.topic.topic_name, sentence.jyutping, sentence.cantonese, sentence.english, sentence.notes, "yes", ", ".join([response_to_sentence.jyutping for response_to_sentence in sentence.response_to.all()])])
-        return response
\ No newline at end of file
+class WordsExportView(ExportView):
+    export_name = "words"
+    file_name = "Jyutping words"
+    sheet_title = "Words"
+
+    def get_rows(self):
+        return iter_words_rows()
+
+
+class RequestStatsView(generic.TemplateView):
+    template_name = "wordsandsentences/request_stats.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["request_stats_enabled"] = settings.REQUEST_STATS
+        context["metrics"] = REQUEST_STATS_METRICS
+        context["percentiles"] = REQUEST_STATS_PERCENTILES
+        context["request_stats"] = [
+            (view_name, view_stats["count"], [[view_stats[metric][percent] if view_stats[metric] else "-" for percent in REQUEST_STATS_PERCENTILES] for metric in REQUEST_STATS_METRICS])
+            for view_name, view_stats in get_request_stats().items()
+        ]
+        return context